@@ -0,0 +1,59 @@
+# coding=utf-8
+import datetime
+import functools
+
+import numpy as np
+
+# 重构后XML及MIMIC原始数据中的日期格式
+MIMIC_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# PLAGH原始数据日期格式不一致，一种是年月日时分秒，一种是年月日，按顺序尝试
+PLAGH_DATE_FORMAT_LIST = ("%Y/%m/%d %H:%M:%S", "%Y/%m/%d")
+
+
+@functools.lru_cache(maxsize=None)
+def parse_date(date_string, date_format=MIMIC_DATE_FORMAT):
+    """
+    datetime.strptime memoized by the date string. The same admission date is shared by all diagnoses and procedures
+    of a visit, thus most calls are answered by the cache. datetime is immutable, so the cached object can be shared
+    :param date_string:
+    :param date_format: a format or a tuple of formats, the formats are tried in order and the first one which
+    matches is used
+    :return: datetime.datetime
+    """
+    if isinstance(date_format, str):
+        return datetime.datetime.strptime(date_string, date_format)
+    for single_format in date_format[:-1]:
+        try:
+            return datetime.datetime.strptime(date_string, single_format)
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(date_string, date_format[-1])
+
+
+def parse_plagh_date(date_string):
+    return parse_date(date_string, PLAGH_DATE_FORMAT_LIST)
+
+
+def to_datetime64(date_list, date_format=MIMIC_DATE_FORMAT, unit='s'):
+    """
+    bulk mode of parse_date, every distinct string is parsed only once
+    :param date_list: a column of date strings
+    :param date_format: consult parse_date
+    :param unit: unit of the returned datetime64, e.g., 's' or 'D'. 'D' drops the time of the day
+    :return: datetime64 array
+    """
+    date_array = np.asarray(date_list, dtype=str)
+    if date_array.size == 0:
+        return np.zeros(date_array.shape, dtype='datetime64[' + unit + ']')
+    unique_date, inverse = np.unique(date_array, return_inverse=True)
+    parsed = np.array([parse_date(item, date_format) for item in unique_date.tolist()], dtype='datetime64[s]')
+    return parsed.astype('datetime64[' + unit + ']')[inverse.reshape(date_array.shape)]
+
+
+def day_offset(date_list, base_date_list, date_format=MIMIC_DATE_FORMAT):
+    """
+    :return: int64 array, whole days from every base date to the date, i.e., (date - base_date).days of datetime which
+    rounds towards negative infinity
+    """
+    interval = to_datetime64(date_list, date_format) - to_datetime64(base_date_list, date_format)
+    return interval.astype(np.int64) // 86400
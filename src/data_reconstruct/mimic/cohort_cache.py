@@ -0,0 +1,221 @@
+# coding=utf-8
+import csv
+import hashlib
+import os
+
+import numpy as np
+
+import mimic.derive_training_data as dtd
+from date_parsing import to_datetime64
+
+# increase it when the name, the shape or the meaning of a cached array changes
+CACHE_FORMAT_VERSION = 1
+
+# code kind of the code dictionary
+DIAGNOSIS_KIND = 0
+PROCEDURE_KIND = 1
+
+# the digest of a file is memoized by (absolute path, size, mtime), in memory and in this file of the cache folder
+DIGEST_INDEX_NAME = 'cohort_digest_index.csv'
+_digest_map = dict()
+
+
+def xml_digest(file_path, block_size=1 << 20):
+    """
+    :return: sha1 hex digest of the content of file_path
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        block = f.read(block_size)
+        while len(block) > 0:
+            digest.update(block)
+            block = f.read(block_size)
+    return digest.hexdigest()
+
+
+def memoized_xml_digest(file_path, cache_path):
+    """
+    xml_digest memoized by (absolute path, size, mtime). The known digests are also saved in DIGEST_INDEX_NAME of
+    cache_path, so a new process does not hash an unchanged XML again
+    """
+    file_stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), str(file_stat.st_size), str(file_stat.st_mtime_ns))
+    if key in _digest_map:
+        return _digest_map[key]
+
+    index_path = os.path.join(cache_path, DIGEST_INDEX_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8', newline="") as f:
+            for line in csv.reader(f):
+                if len(line) == 4:
+                    _digest_map[tuple(line[0: 3])] = line[3]
+    if key not in _digest_map:
+        _digest_map[key] = xml_digest(file_path)
+        with open(index_path, 'a', encoding='utf-8', newline="") as f:
+            csv.writer(f).writerow(list(key) + [_digest_map[key]])
+    return _digest_map[key]
+
+
+def cache_file_name(digest):
+    return 'cohort_' + digest + '.npz'
+
+
+def build_cohort(parsed_data):
+    """
+    convert the return of parsing_xml to the columnar form.
+    The patients and the visits keep the order of the XML, the events of a visit are its diagnoses followed by its
+    procedures, thus every map of parsing_xml can be rebuilt. The day offset of an event is the number of whole days
+    between the admission of its visit and the earliest admission of its patient, as in generate_sequence_map. The
+    rank of every code is calculated on the whole cohort, so it does not depend on the reserve settings
+    :param parsed_data: return of parsing_xml
+    :return: {name: array}
+    """
+    patient_info, visit_date, diagnosis_map, procedure_map = parsed_data
+    diagnosis_rank_map = dtd.diagnosis_rank(diagnosis_map)
+    procedure_rank_map = dtd.procedure_rank(procedure_map)
+
+    code_name = ['D' + code for code in diagnosis_rank_map] + ['P' + code for code in procedure_rank_map]
+    code_id_map = {name: code_id for code_id, name in enumerate(code_name)}
+
+    patient_list = list(patient_info.keys())
+    visit_patient, visit_id_list, visit_date_list = [], [], []
+    event_visit, event_code = [], []
+    for patient_no, patient_id in enumerate(patient_list):
+        for visit_id in visit_date.get(patient_id, dict()):
+            visit_no = len(visit_id_list)
+            visit_patient.append(patient_no)
+            visit_id_list.append(visit_id)
+            visit_date_list.append(visit_date[patient_id][visit_id])
+            for prefix, item_map in [('D', diagnosis_map), ('P', procedure_map)]:
+                for item in item_map.get(patient_id, dict()).get(visit_id, []):
+                    event_visit.append(visit_no)
+                    event_code.append(code_id_map[prefix + item])
+
+    visit_patient = np.array(visit_patient, dtype=np.int32)
+    visit_second = to_datetime64(visit_date_list).astype(np.int64)
+    first_second = np.full([len(patient_list)], np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first_second, visit_patient, visit_second)
+    visit_day = (visit_second - first_second[visit_patient]) // 86400
+
+    event_visit = np.array(event_visit, dtype=np.int32)
+    return {
+        'format_version': CACHE_FORMAT_VERSION,
+        'patient_id': np.array(patient_list, dtype=str),
+        'patient_birthday': np.array([patient_info[patient_id][0] for patient_id in patient_list], dtype=str),
+        'patient_sex': np.array([patient_info[patient_id][1] for patient_id in patient_list], dtype=str),
+        'visit_patient': visit_patient,
+        'visit_id': np.array(visit_id_list, dtype=str),
+        'visit_date': np.array(visit_date_list, dtype=str),
+        'visit_day': visit_day.astype(np.int32),
+        'event_patient': visit_patient[event_visit],
+        'event_visit': event_visit,
+        'event_code': np.array(event_code, dtype=np.int32),
+        'event_day': visit_day[event_visit].astype(np.int32),
+        'code_name': np.array(code_name, dtype=str),
+        'code_kind': np.array([DIAGNOSIS_KIND] * len(diagnosis_rank_map) + [PROCEDURE_KIND] * len(procedure_rank_map),
+                              dtype=np.int8),
+        'code_rank': np.array(list(diagnosis_rank_map.values()) + list(procedure_rank_map.values()), dtype=np.int32)
+    }
+
+
+def save_cohort(cohort, path):
+    """
+    the file is replaced atomically, so an existing cache file is always complete
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, **cohort)
+    os.replace(temp_path, path)
+
+
+def load_cohort(path):
+    cohort = dict()
+    with np.load(path) as data:
+        if int(data['format_version']) != CACHE_FORMAT_VERSION:
+            raise RuntimeError('cohort cache format incompatible')
+        for name in data.files:
+            cohort[name] = data[name]
+    return cohort
+
+
+def load_cohort_cache(file_path, cache_path=None):
+    """
+    load the columnar form of reconstructed.xml. The cache file is keyed by the content hash of the XML, the XML is
+    parsed and the cache is written only if no cache of the same content exists. The hash is memoized by the path,
+    the size and the mtime of the XML, consult memoized_xml_digest
+    :param file_path: path of reconstructed.xml
+    :param cache_path: folder of the cache file, the folder of the XML if it is None
+    :return: {name: array}, consult build_cohort
+    """
+    if cache_path is None:
+        cache_path = os.path.dirname(os.path.abspath(file_path))
+    path = os.path.join(cache_path, cache_file_name(memoized_xml_digest(file_path, cache_path)))
+    if os.path.exists(path):
+        return load_cohort(path)
+    cohort = build_cohort(dtd.parsing_xml(file_path))
+    save_cohort(cohort, path)
+    return cohort
+
+
+def cohort_rank_map(cohort):
+    """
+    :return: diagnosis rank map and procedure rank map, the same as diagnosis_rank and procedure_rank
+    """
+    rank_map_list = [dict(), dict()]
+    for name, kind, rank in zip(cohort['code_name'].tolist(), cohort['code_kind'].tolist(),
+                                cohort['code_rank'].tolist()):
+        rank_map_list[kind][name[1:]] = rank
+    return rank_map_list[DIAGNOSIS_KIND], rank_map_list[PROCEDURE_KIND]
+
+
+def cohort_parsed_data(cohort):
+    """
+    :return: the four maps of parsing_xml
+    """
+    patient_id = cohort['patient_id'].tolist()
+    visit_patient = cohort['visit_patient'].tolist()
+    visit_id = cohort['visit_id'].tolist()
+    code_name = cohort['code_name'].tolist()
+
+    patient_info_map = {patient: [birthday, sex] for patient, birthday, sex in zip(
+        patient_id, cohort['patient_birthday'].tolist(), cohort['patient_sex'].tolist())}
+    visit_date_map = dict()
+    for patient_no, visit, date in zip(visit_patient, visit_id, cohort['visit_date'].tolist()):
+        visit_date_map.setdefault(patient_id[patient_no], dict())[visit] = date
+    item_map = {'D': dict(), 'P': dict()}
+    for visit_no, code_id in zip(cohort['event_visit'].tolist(), cohort['event_code'].tolist()):
+        name = code_name[code_id]
+        patient_map = item_map[name[0]].setdefault(patient_id[visit_patient[visit_no]], dict())
+        patient_map.setdefault(visit_id[visit_no], []).append(name[1:])
+    return [patient_info_map, visit_date_map, item_map['D'], item_map['P']]
+
+
+def cohort_hawkes_cut(cohort, reserve_diagnosis, reserve_procedure):
+    """
+    the same as derive_hawkes_cut, but only filters the event arrays of the cohort
+    :return: event_sequence_map, index_name_map
+    """
+    diagnosis_rank_map, procedure_rank_map = cohort_rank_map(cohort)
+    index_name_map = dtd.generate_index_name_map(diagnosis_rank_map, procedure_rank_map, reserve_diagnosis,
+                                                 reserve_procedure)
+    code_index = np.array([index_name_map.get(name, -1) for name in cohort['code_name'].tolist()], dtype=np.int64)
+    code_reserve = np.where(cohort['code_kind'] == DIAGNOSIS_KIND, reserve_diagnosis, reserve_procedure)
+    reserved = (cohort['code_rank'] <= code_reserve)[cohort['event_code']]
+
+    event_patient = cohort['event_patient'][reserved]
+    event_day = cohort['event_day'][reserved]
+    event_index = code_index[cohort['event_code'][reserved]]
+    # lexsort is stable, the events of the same day keep the order of generate_sequence_map
+    order = np.lexsort((event_day, event_patient))
+    event_patient, event_day, event_index = event_patient[order], event_day[order], event_index[order]
+
+    patient_id = cohort['patient_id'].tolist()
+    boundary = np.flatnonzero(np.diff(event_patient)) + 1
+    start_list = [0] + boundary.tolist()
+    end_list = boundary.tolist() + [len(event_patient)]
+    event_sequence_map = dict()
+    for start, end in zip(start_list, end_list):
+        if end > start:
+            event_sequence_map[patient_id[event_patient[start]]] = list(zip(event_index[start: end].tolist(),
+                                                                             event_day[start: end].tolist()))
+    return event_sequence_map, index_name_map
@@ -6,6 +6,8 @@ from xml.etree import ElementTree
 
 import numpy as np
 
+from date_parsing import day_offset, parse_date
+
 
 def parsing_xml(file_path):
     """
@@ -19,12 +21,19 @@ def parsing_xml(file_path):
     patient_visit_operation_map = {}
 
     with open(file_path, 'rt', encoding='utf-8-sig') as f:
-        tree = ElementTree.parse(f)
-
+        # 用iterparse流式解析，节点属性在start事件中即可读取，每个patient_node读取完毕后即从树中删除，内存占用不随文件增长
+        root = None
         current_patient = -1
         current_visit = -1
-        for node in tree.iter():
+        for event, node in ElementTree.iterparse(f, events=('start', 'end')):
+            if root is None:
+                root = node
             node_tag = node.tag
+            if event == 'end':
+                if node_tag == "patient_node":
+                    node.clear()
+                    root.remove(node)
+                continue
             node_attrib = node.attrib
 
             # 调取病人信息
@@ -171,7 +180,7 @@ def generate_sequence_map(diagnosis_map, procedure_map, visit_date_map, index_na
     for patient_id in visit_date_map:
         for visit_id in visit_date_map[patient_id]:
             visit_day = visit_date_map[patient_id][visit_id]
-            visit_day = datetime.datetime.strptime(visit_day, "%Y-%m-%d %H:%M:%S")
+            visit_day = parse_date(visit_day)
             if not patient_first_visit_time.__contains__(patient_id):
                 patient_first_visit_time[patient_id] = visit_day
             if visit_day < patient_first_visit_time[patient_id]:
@@ -186,7 +195,7 @@ def generate_sequence_map(diagnosis_map, procedure_map, visit_date_map, index_na
                 for diagnosis_item in diagnosis_map[patient_id][visit_id]:
                     # 时间重标
                     visit_day = visit_date_map[patient_id][visit_id]
-                    visit_day = datetime.datetime.strptime(visit_day, "%Y-%m-%d %H:%M:%S")
+                    visit_day = parse_date(visit_day)
                     first_day = patient_first_visit_time[patient_id]
                     time_interval = (visit_day - first_day).days
 
@@ -198,7 +207,7 @@ def generate_sequence_map(diagnosis_map, procedure_map, visit_date_map, index_na
                 procedure_list = procedure_map[patient_id][visit_id]
                 for procedure_item in procedure_list:
                     visit_day = visit_date_map[patient_id][visit_id]
-                    visit_day = datetime.datetime.strptime(visit_day, "%Y-%m-%d %H:%M:%S")
+                    visit_day = parse_date(visit_day)
                     first_day = patient_first_visit_time[patient_id]
                     time_interval = (visit_day - first_day).days
 
@@ -212,11 +221,30 @@ def generate_sequence_map(diagnosis_map, procedure_map, visit_date_map, index_na
 
 
 def derive_hawkes_data(file_path, reserve_diagnosis, reserve_procedure):
-    patient_info, visit_date, diagnosis_map, procedure_map = parsing_xml(file_path)
+    parsed_data = parsing_xml(file_path)
 
     # 找到高频数据
-    diagnosis_rank_map = diagnosis_rank(diagnosis_map)
-    procedure_rank_map = procedure_rank(procedure_map)
+    diagnosis_rank_map = diagnosis_rank(parsed_data[2])
+    procedure_rank_map = procedure_rank(parsed_data[3])
+    return derive_hawkes_cut(parsed_data, diagnosis_rank_map, procedure_rank_map, reserve_diagnosis,
+                             reserve_procedure)
+
+
+def derive_hawkes_cut(parsed_data, diagnosis_rank_map, procedure_rank_map, reserve_diagnosis, reserve_procedure):
+    """
+    derive the hawkes data of one vocabulary cut from the result of parsing_xml, thus several cuts can share one
+    parsing. exclude_rare_diagnosis and exclude_rare_procedure modify the visit maps in place, so they work on copies
+    of the two visit map levels and parsed_data is not modified
+    :param parsed_data: return of parsing_xml
+    :param diagnosis_rank_map: return of diagnosis_rank
+    :param procedure_rank_map: return of procedure_rank
+    :param reserve_diagnosis:
+    :param reserve_procedure:
+    :return: event_sequence_map, index_name_map
+    """
+    patient_info, visit_date, diagnosis_map, procedure_map = parsed_data
+    diagnosis_map = {patient_id: dict(diagnosis_map[patient_id]) for patient_id in diagnosis_map}
+    procedure_map = {patient_id: dict(procedure_map[patient_id]) for patient_id in procedure_map}
 
     # 去除不需要的低频数据
     diagnosis_map = exclude_rare_diagnosis(reserve_diagnosis, diagnosis_rank_map, diagnosis_map)
@@ -230,11 +258,24 @@ def derive_hawkes_data(file_path, reserve_diagnosis, reserve_procedure):
 
 
 def derive_neural_network_data(file_path, reserve_diagnosis, reserve_procedure, time_stamp):
-    patient_info, visit_date, diagnosis_map, procedure_map = parsing_xml(file_path)
+    parsed_data = parsing_xml(file_path)
 
     # 找到高频数据
-    diagnosis_rank_map = diagnosis_rank(diagnosis_map)
-    procedure_rank_map = procedure_rank(procedure_map)
+    diagnosis_rank_map = diagnosis_rank(parsed_data[2])
+    procedure_rank_map = procedure_rank(parsed_data[3])
+    return derive_neural_network_cut(parsed_data, diagnosis_rank_map, procedure_rank_map, reserve_diagnosis,
+                                     reserve_procedure, time_stamp)
+
+
+def derive_neural_network_cut(parsed_data, diagnosis_rank_map, procedure_rank_map, reserve_diagnosis,
+                              reserve_procedure, time_stamp):
+    """
+    derive the dense tensors of one vocabulary cut from the result of parsing_xml, consult derive_hawkes_cut
+    :return: patient_x [N, T, D], patient_t [N, T, 1]
+    """
+    patient_info, visit_date, diagnosis_map, procedure_map = parsed_data
+    diagnosis_map = {patient_id: dict(diagnosis_map[patient_id]) for patient_id in diagnosis_map}
+    procedure_map = {patient_id: dict(procedure_map[patient_id]) for patient_id in procedure_map}
 
     # 去除不需要的低频数据
     diagnosis_map = exclude_rare_diagnosis(reserve_diagnosis, diagnosis_rank_map, diagnosis_map)
@@ -244,44 +285,61 @@ def derive_neural_network_data(file_path, reserve_diagnosis, reserve_procedure,
     index_name_map = generate_index_name_map(diagnosis_rank_map, procedure_rank_map, reserve_diagnosis,
                                              reserve_procedure)
 
-    # 病人的时间信息和事件信息
-    patient_x = np.zeros([len(visit_date), time_stamp, reserve_diagnosis + reserve_procedure])
-    patient_t = np.zeros([len(visit_date), time_stamp, 1])
+    return build_neural_network_tensor(visit_date, diagnosis_map, procedure_map, index_name_map,
+                                       reserve_diagnosis + reserve_procedure, time_stamp)
+
 
-    patient_index = 0
-    for patient_id in visit_date:
-        single_patient_x = patient_x[patient_index]
-        single_patient_t = patient_t[patient_index]
+def build_neural_network_tensor(visit_date, diagnosis_map, procedure_map, index_name_map, event_count, time_stamp):
+    """
+    build the dense tensors of derive_neural_network_data. The (patient row, visit slot, code index) triplets of all
+    events are collected at first, then the [N, T, D] tensor is filled by one fancy index assignment. The time of a
+    visit is the number of whole days since visit '1' of the patient, calculated by datetime64 arithmetic. As before,
+    the code index is index_name_map[code] - 1 and the visits whose visit_id is larger than time_stamp are dropped
+    :param visit_date: visit date map of parsing_xml
+    :param diagnosis_map: diagnosis map after exclude_rare_diagnosis
+    :param procedure_map: procedure map after exclude_rare_procedure
+    :param index_name_map: return of generate_index_name_map
+    :param event_count: D
+    :param time_stamp: T
+    :return: patient_x [N, T, D], patient_t [N, T, 1], N is the patient count of visit_date
+    """
+    visit_row, visit_slot, visit_day, first_day = [], [], [], []
+    event_row, event_slot, event_index = [], [], []
+    for row, patient_id in enumerate(visit_date):
         for visit_id in visit_date[patient_id]:
-            if int(visit_id) > time_stamp:
+            slot = int(visit_id) - 1
+            if slot >= time_stamp:
                 continue
-            # t 信息
-            if int(visit_id) == 1:
-                single_patient_t[0][0] = 0
-            else:
-                first_day = datetime.datetime.strptime(visit_date[patient_id]['1'], "%Y-%m-%d %H:%M:%S")
-                current_day = datetime.datetime.strptime(visit_date[patient_id][visit_id], "%Y-%m-%d %H:%M:%S")
-                time_interval = (current_day - first_day).days
-                single_patient_t[int(visit_id) - 1][0] = time_interval
-
-            # x 信息
-            if diagnosis_map.__contains__(patient_id) and diagnosis_map[patient_id].__contains__(visit_id):
-                diagnosis = diagnosis_map[patient_id][visit_id]
-                for item in diagnosis:
-                    d_item = 'D' + str(item)
-                    index = index_name_map[d_item] - 1
-                    single_patient_x[int(visit_id) - 1, index] = 1
-
-            if procedure_map.__contains__(patient_id) and procedure_map[patient_id].__contains__(visit_id):
-                procedure = procedure_map[patient_id][visit_id]
-                for item in procedure:
-                    d_item = 'P' + str(item)
-                    index = index_name_map[d_item] - 1
-                    single_patient_x[int(visit_id) - 1, index] = 1
+            if slot > 0:
+                visit_row.append(row)
+                visit_slot.append(slot)
+                visit_day.append(visit_date[patient_id][visit_id])
+                first_day.append(visit_date[patient_id]['1'])
+            for prefix, item_map in [('D', diagnosis_map), ('P', procedure_map)]:
+                if item_map.__contains__(patient_id) and item_map[patient_id].__contains__(visit_id):
+                    for item in item_map[patient_id][visit_id]:
+                        event_row.append(row)
+                        event_slot.append(slot)
+                        event_index.append(index_name_map[prefix + str(item)] - 1)
+
+    time_interval = day_offset(visit_day, first_day)
+
+    patient_x = np.zeros([len(visit_date), time_stamp, event_count])
+    patient_t = np.zeros([len(visit_date), time_stamp, 1])
+    patient_x[np.array(event_row, dtype=np.int64), np.array(event_slot, dtype=np.int64),
+              np.array(event_index, dtype=np.int64)] = 1
+    patient_t[np.array(visit_row, dtype=np.int64), np.array(visit_slot, dtype=np.int64), 0] = time_interval
+    return patient_x, patient_t
 
-        patient_index += 1
 
-    return patient_x, patient_t
+def non_empty_patient(patient_x, patient_t):
+    """
+    a patient is kept if every visit slot has an event, or it is a padded slot (not the first slot and its time is 0)
+    :return: bool mask of the patients
+    """
+    padded = patient_t[:, :, 0] == 0
+    padded[:, 0] = False
+    return ((patient_x == 1).any(axis=2) | padded).all(axis=1)
 
 
 def hawkes_random_split(event_sequence_map, fold=5):
@@ -304,9 +362,10 @@ def hawkes_random_split(event_sequence_map, fold=5):
 
 
 def hawkes(reserve_diagnosis, reserve_procedure, file_path, file_name):
-    event_sequence_map, index_name_map = derive_hawkes_data(file_path + file_name,
-                                                            reserve_diagnosis=reserve_diagnosis,
-                                                            reserve_procedure=reserve_procedure)
+    # 从列式缓存中读取数据，XML只在缓存不存在时解析一次；两个模块互相引用，故在此处引入
+    import mimic.cohort_cache as cohort_cache
+    cohort = cohort_cache.load_cohort_cache(file_path + file_name)
+    event_sequence_map, index_name_map = cohort_cache.cohort_hawkes_cut(cohort, reserve_diagnosis, reserve_procedure)
     batch_map = hawkes_random_split(event_sequence_map, fold=5)
     return batch_map, index_name_map
 
@@ -323,35 +382,16 @@ def neural_nets(reserve_diagnosis, reserve_procedure, time_stamp, file_path, fil
     """
     # 返回Time Major的数据
     # index 一样的x, t，对应一样的人
-    patient_x_c, patient_t_c = derive_neural_network_data(os.path.join(file_path, file_name),
-                                                          reserve_diagnosis=reserve_diagnosis,
-                                                          reserve_procedure=reserve_procedure,
-                                                          time_stamp=time_stamp)
-    patient_x = []
-    patient_t = []
+    import mimic.cohort_cache as cohort_cache
+    cohort = cohort_cache.load_cohort_cache(os.path.join(file_path, file_name))
+    diagnosis_rank_map, procedure_rank_map = cohort_cache.cohort_rank_map(cohort)
+    patient_x_c, patient_t_c = derive_neural_network_cut(cohort_cache.cohort_parsed_data(cohort), diagnosis_rank_map,
+                                                         procedure_rank_map, reserve_diagnosis, reserve_procedure,
+                                                         time_stamp)
     # 如果有空数据，直接删除
-    for i in range(len(patient_x_c)):
-        flag = True
-        single_case = patient_x_c[i]
-        for j in range(len(single_case)):
-            single_day = single_case[j]
-            day_flag = False
-            for k in range(len(single_day)):
-                single_event = single_day[k]
-                if single_event == 1:
-                    day_flag = True
-            # 如果一次事件都没有发生，则要看看是不是因为数据填充的原因，如果是，保留数据
-            if not day_flag and j != 0:
-                if patient_t_c[i][j][0] == 0:
-                    day_flag = True
-
-            flag = flag and day_flag
-
-        if flag:
-            patient_x.append(patient_x_c[i])
-            patient_t.append(patient_t_c[i])
-    patient_x = np.array(patient_x)
-    patient_t = np.array(patient_t)
+    keep = non_empty_patient(patient_x_c, patient_t_c)
+    patient_x = patient_x_c[keep]
+    patient_t = patient_t_c[keep]
 
     shuffle_list = []
     for i in range(0, len(patient_t)):
@@ -1,8 +1,18 @@
 # coding=utf-8
 import csv
+import locale
+import multiprocessing
 import os
+import shutil
 from itertools import islice
 
+# 文本字段中含有换行的表，其记录可能跨行，不能按字节区间切分
+MULTILINE_TABLE = {'NOTEEVENTS'}
+
+# the id list of a worker process, it is set by _extract_initializer
+_shared_id_list = None
+_shared_id_bytes = None
+
 
 def fetch_subject_id(root_path):
     longitudinal_name = set()
@@ -28,8 +38,8 @@ def main():
     name_list = ['ADMISSIONS', 'CALLOUT', 'PROCEDURES_ICD', 'PROCEDUREEVENTS_MV', 'PRESCRIPTIONS', 'PATIENTS',
                  'OUTPUTEVENTS', 'NOTEEVENTS', 'MICROBIOLOGYEVENTS', 'LABEVENTS', 'INPUTEVENTS_MV', 'INPUTEVENTS_CV',
                  'ICUSTAYS', 'DRGCODES', 'DIAGNOSES_ICD', 'DATETIMEEVENTS', 'CPTEVENTS', 'CHARTEVENTS']
-    for item in name_list:
-        read_and_write_data(source_data_path, item, id_list, target_data_path)
+    parallel_read_and_write_data(source_data_path, name_list, id_list, target_data_path,
+                                 processes=multiprocessing.cpu_count())
 
 
 def read_and_write_data(source_data_path, file_name, id_list, target_data_path):
@@ -53,5 +63,135 @@ def read_and_write_data(source_data_path, file_name, id_list, target_data_path):
     return fetch_data
 
 
+def byte_range_list(file_path, chunk_size):
+    """
+    split a file into byte ranges of about chunk_size bytes, every boundary is moved to the start of next line
+    :return: [(start, end), ...]
+    """
+    file_size = os.path.getsize(file_path)
+    boundary_list = [0]
+    with open(file_path, 'rb') as f:
+        position = chunk_size
+        while position < file_size:
+            f.seek(position)
+            f.readline()
+            boundary = f.tell()
+            if boundary >= file_size:
+                break
+            if boundary > boundary_list[-1]:
+                boundary_list.append(boundary)
+            position = boundary + chunk_size
+    boundary_list.append(file_size)
+    return [(boundary_list[i], boundary_list[i + 1]) for i in range(0, len(boundary_list) - 1)]
+
+
+def _extract_initializer(id_list):
+    global _shared_id_list, _shared_id_bytes
+    _shared_id_list = id_list
+    _shared_id_bytes = {item.encode('ascii') for item in id_list}
+
+
+def _extract_chunk(task):
+    """
+    filter the rows of one byte range and write them to a part file with csv.writer, as read_and_write_data does.
+    The SUBJECT_ID (second field) is cut from the raw bytes at first, only the lines whose SUBJECT_ID is in the id list
+    are parsed by csv.reader. A multiline table is filtered as a whole by csv.reader
+    :return: row count of the part file
+    """
+    if _shared_id_list is None:
+        raise RuntimeError('id list not initialized, call _extract_initializer at first')
+    source_path, part_path, start, end, multiline, encoding = task
+    row_count = 0
+    with open(part_path, 'w', encoding=encoding, newline="") as write_file:
+        csv_writer = csv.writer(write_file)
+        if multiline:
+            with open(source_path, 'r', encoding=encoding, newline="") as read_file:
+                for line in csv.reader(read_file):
+                    if _shared_id_list.__contains__(line[1]):
+                        csv_writer.writerow(line)
+                        row_count += 1
+            return row_count
+
+        with open(source_path, 'rb') as read_file:
+            read_file.seek(start)
+            data = read_file.read(end - start)
+        for line in data.split(b'\n'):
+            if len(line) == 0:
+                continue
+            # 引号不成对说明有记录跨行，字节区间切分会破坏该记录
+            if line.count(b'"') % 2 == 1:
+                raise RuntimeError('multiline record found in ' + source_path + ', add the table to MULTILINE_TABLE')
+            first_comma = line.find(b',')
+            second_comma = line.find(b',', first_comma + 1)
+            if first_comma < 0 or second_comma < 0:
+                continue
+            if line[first_comma + 1: second_comma].strip(b'"') not in _shared_id_bytes:
+                continue
+            row = next(csv.reader([line.decode(encoding)]))
+            if _shared_id_list.__contains__(row[1]):
+                csv_writer.writerow(row)
+                row_count += 1
+    return row_count
+
+
+def parallel_read_and_write_data(source_data_path, name_list, id_list, target_data_path, processes=4,
+                                 chunk_size=64 * 1024 * 1024, encoding=None):
+    """
+    the parallel version of read_and_write_data on all tables of name_list. Every table except the ones in
+    MULTILINE_TABLE is split into byte ranges of about chunk_size bytes on line boundaries, all ranges of all tables
+    are filtered concurrently by a process pool. Every range is written to a part file, then the part files of a table
+    are concatenated in order, thus the output is the same as that of read_and_write_data (the header is dropped too,
+    as its SUBJECT_ID field is not an id)
+    :param source_data_path:
+    :param name_list: table names
+    :param id_list: set of SUBJECT_ID
+    :param target_data_path:
+    :param processes:
+    :param chunk_size: byte size of a range
+    :param encoding: encoding of the source files and the output files, the platform default encoding as that of
+    read_and_write_data if it is None
+    :return: {table name: row count}
+    """
+    # the encoding is resolved here, thus line.decode of _extract_chunk agrees with open of read_and_write_data
+    if encoding is None:
+        encoding = locale.getpreferredencoding(False)
+    task_map = dict()
+    task_list = []
+    for file_name in name_list:
+        source_path = source_data_path + file_name + '.csv'
+        multiline = file_name in MULTILINE_TABLE
+        range_list = [(0, os.path.getsize(source_path))] if multiline else byte_range_list(source_path, chunk_size)
+        task_map[file_name] = []
+        for part_no, (start, end) in enumerate(range_list):
+            part_path = target_data_path + file_name + '.csv.part' + str(part_no)
+            task_map[file_name].append(len(task_list))
+            task_list.append((source_path, part_path, start, end, multiline, encoding))
+
+    # 大的区间优先调度，使各进程的负载更均衡
+    order = sorted(range(0, len(task_list)), key=lambda index: task_list[index][3] - task_list[index][2],
+                   reverse=True)
+    count_list = [0] * len(task_list)
+    if processes > 1:
+        with multiprocessing.Pool(processes, initializer=_extract_initializer, initargs=(id_list,)) as pool:
+            for index, row_count in zip(order, pool.imap(_extract_chunk, [task_list[index] for index in order])):
+                count_list[index] = row_count
+    else:
+        _extract_initializer(id_list)
+        for index in order:
+            count_list[index] = _extract_chunk(task_list[index])
+
+    count_map = dict()
+    for file_name in name_list:
+        with open(target_data_path + file_name + '.csv', 'wb') as write_file:
+            for index in task_map[file_name]:
+                part_path = task_list[index][1]
+                with open(part_path, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, write_file)
+                os.remove(part_path)
+        count_map[file_name] = sum(count_list[index] for index in task_map[file_name])
+        print(file_name + ' process finish')
+    return count_map
+
+
 if __name__ == '__main__':
     main()
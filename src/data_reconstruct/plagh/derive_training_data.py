@@ -1,7 +1,8 @@
 # coding=utf-8
-import datetime
 from xml.etree import ElementTree
 
+from date_parsing import parse_date
+
 
 def load_need_data_5_fold(xml_file_path, xml_file_name_list, diagnosis_reserve, operation_reserve):
     data_sequence_info_list = []
@@ -84,7 +85,7 @@ def generate_sequence_map(visit_diagnosis_map, visit_operation_map, patient_visi
     for patient_id in patient_visit_date_map:
         for visit_id in patient_visit_date_map[patient_id]:
             visit_day = patient_visit_date_map[patient_id][visit_id]
-            visit_day = datetime.datetime.strptime(visit_day, "%Y-%m-%d %H:%M:%S")
+            visit_day = parse_date(visit_day)
             if not patient_first_visit_time.__contains__(patient_id):
                 patient_first_visit_time[patient_id] = visit_day
             if visit_day < patient_first_visit_time[patient_id]:
@@ -103,7 +104,7 @@ def generate_sequence_map(visit_diagnosis_map, visit_operation_map, patient_visi
                 for diagnosis_item in visit_diagnosis_map[patient_id][visit_id]:
                     # 时间重标
                     visit_day = patient_visit_date_map[patient_id][visit_id]
-                    visit_day = datetime.datetime.strptime(visit_day, "%Y-%m-%d %H:%M:%S")
+                    visit_day = parse_date(visit_day)
                     first_day = patient_first_visit_time[patient_id]
                     time_interval = (visit_day - first_day).days
                     # 考虑由于计时尺度（部分数据精确到分，部分数据精确到天）造成的少量偏差
@@ -123,7 +124,7 @@ def generate_sequence_map(visit_diagnosis_map, visit_operation_map, patient_visi
                     operation_type, operation_time = operation_item
                     operation_type = "O"+operation_type
 
-                    visit_day = datetime.datetime.strptime(operation_time, "%Y-%m-%d %H:%M:%S")
+                    visit_day = parse_date(operation_time)
                     first_day = patient_first_visit_time[patient_id]
                     time_interval = (visit_day - first_day).days
                     # 考虑由于计时尺度（部分数据精确到分，部分数据精确到天）造成的少量偏差
@@ -162,12 +163,19 @@ def parsing_xml(file_path):
     patient_visit_operation_map = {}
 
     with open(file_path, 'rt', encoding='utf-8-sig') as f:
-        tree = ElementTree.parse(f)
-
+        # 用iterparse流式解析，节点属性在start事件中即可读取，每个patient_node读取完毕后即从树中删除，内存占用不随文件增长
+        root = None
         current_patient = -1
         current_visit = -1
-        for node in tree.iter():
+        for event, node in ElementTree.iterparse(f, events=('start', 'end')):
+            if root is None:
+                root = node
             node_tag = node.tag
+            if event == 'end':
+                if node_tag == "patient_node":
+                    node.clear()
+                    root.remove(node)
+                continue
             node_attrib = node.attrib
             if node_tag == "diagnosis_icd":
                 diagnosis_code_rank_map[node_attrib['code']] = node_attrib['rank']
@@ -1,7 +1,8 @@
 import csv
-import datetime
 from itertools import islice
 
+from date_parsing import parse_date, parse_plagh_date
+
 
 # 载入病人性别，民族，出生日期信息
 def load_patient_info(file_path, encoding="gbk", newline=""):
@@ -13,7 +14,7 @@ def load_patient_info(file_path, encoding="gbk", newline=""):
             # 部分数据有错，没有Birthday信息，直接丢弃
             if len(birthday) < 2:
                 continue
-            birthday = datetime.datetime.strptime(birthday, "%Y/%m/%d")
+            birthday = parse_date(birthday, "%Y/%m/%d")
             patient_info_map[patient_id] = dict({"sex": sex, "birthday": birthday, "ethnic_group": ethnic_group})
     return patient_info_map
 
@@ -25,7 +26,7 @@ def load_outpatient_diagnosis(file_path, encoding="gbk", newline=""):
         csv_reader = csv.reader(outpatient_file)
         for line in islice(csv_reader, 1, None):
             patient_id, visit_date, visit_no, diagnosis_description = line
-            visit_date = datetime.datetime.strptime(visit_date, "%Y/%m/%d")
+            visit_date = parse_date(visit_date, "%Y/%m/%d")
             if outpatient_diagnosis_map.__contains__(patient_id):
                 outpatient_diagnosis_map[patient_id][visit_no] = {"visit_date": visit_date,
                                                                   "diagnosis_description": diagnosis_description}
@@ -44,14 +45,10 @@ def load_operation(file_path, encoding="gbk", newline=""):
         for line in islice(csv_reader, 1, None):
             patient_id, visit_id, operation_no, operation_description, icd_9, heal, operation_date = line
 
-            # 原始数据日期格式不一致，一种是年月日时分，一种是年月日
-            # 若日期格式为年月日时分，长度必然大于10；若为年月日，长度必然小于等于10
+            # 原始数据日期格式不一致，一种是年月日时分，一种是年月日，由parse_plagh_date依次尝试
             if len(operation_date) < 2:
                 continue
-            elif len(operation_date) > 10:
-                operation_date = datetime.datetime.strptime(operation_date, "%Y/%m/%d %H:%M:%S")
-            else:
-                operation_date = datetime.datetime.strptime(operation_date, "%Y/%m/%d")
+            operation_date = parse_plagh_date(operation_date)
 
             content = {"icd_code": icd_9, "operation_date": operation_date,  "operation_description":
                        operation_description,  "heal": heal, }
@@ -75,14 +72,10 @@ def load_hospitalized_patient_diagnosis(file_path, encoding="gbk", newline=""):
         for line in islice(csv_reader, 1, None):
             patient_id, visit_id, diagnosis_type, diagnosis_no, diagnosis_desc, icd_code, icd_version, \
              diagnosis_date, treat_day, treat_result = line
-            # 原始数据日期格式不一致，一种是年月日时分，一种是年月日
-            # 若日期格式为年月日时分，长度必然大于10；若为年月日，长度必然小于等于10
+            # 原始数据日期格式不一致，一种是年月日时分，一种是年月日，由parse_plagh_date依次尝试
             if len(diagnosis_date) < 2:
                 continue
-            elif len(diagnosis_date) > 10:
-                diagnosis_date = datetime.datetime.strptime(diagnosis_date, "%Y/%m/%d %H:%M:%S")
-            else:
-                diagnosis_date = datetime.datetime.strptime(diagnosis_date, "%Y/%m/%d")
+            diagnosis_date = parse_plagh_date(diagnosis_date)
 
             if diagnosis_type == "3":
                 diagnosis_type = "出院主要诊断"
@@ -112,20 +105,13 @@ def load_hospitalized_patient_visit_admission_date(file_path, encoding="gbk", ne
         for line in islice(csv_reader, 1, None):
             patient_id, visit_id, admission_date, discharge_date, military_flag = line
 
-            # 原始数据日期格式不一致，一种是年月日时分，一种是年月日
-            # 若日期格式为年月日时分，长度必然大于10；若为年月日，长度必然小于等于10
+            # 原始数据日期格式不一致，一种是年月日时分，一种是年月日，由parse_plagh_date依次尝试
             if len(admission_date) < 2:
                 continue
-            elif len(admission_date) > 10:
-                admission_date = datetime.datetime.strptime(admission_date, "%Y/%m/%d %H:%M:%S")
-            else:
-                admission_date = datetime.datetime.strptime(admission_date, "%Y/%m/%d")
+            admission_date = parse_plagh_date(admission_date)
             if len(discharge_date) < 2:
                 continue
-            elif len(discharge_date) > 10:
-                discharge_date = datetime.datetime.strptime(discharge_date, "%Y/%m/%d %H:%M:%S")
-            else:
-                discharge_date = datetime.datetime.strptime(discharge_date, "%Y/%m/%d")
+            discharge_date = parse_plagh_date(discharge_date)
 
             content = [admission_date, discharge_date, military_flag]
             if admission_map.__contains__(patient_id):
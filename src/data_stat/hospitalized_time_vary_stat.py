@@ -1,6 +1,7 @@
 import csv
 from itertools import islice
-import datetime
+
+from date_parsing import parse_date
 
 
 # 得到病人第一次入院和最后一次入院的时间，入院的总次数
@@ -79,8 +80,8 @@ def main():
             visit_distribution[visit_count] += 1
     # 统计病人住院长期纵向数据时间跨度
     for patient_id in first_admission:
-        first_admission_date = datetime.datetime.strptime(first_admission[patient_id][1], "%Y/%m/%d %H:%M:%S")
-        last_admission_date = datetime.datetime.strptime(last_admission[patient_id][1], "%Y/%m/%d %H:%M:%S")
+        first_admission_date = parse_date(first_admission[patient_id][1], "%Y/%m/%d %H:%M:%S")
+        last_admission_date = parse_date(last_admission[patient_id][1], "%Y/%m/%d %H:%M:%S")
         patient_duration[patient_id] = (last_admission_date - first_admission_date).days
 
     # 输出住院次数为某个数量的统计结果
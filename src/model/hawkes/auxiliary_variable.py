@@ -0,0 +1,96 @@
+# coding=utf-8
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class AuxiliaryVariable(Mapping):
+    """
+    array backed auxiliary variable store
+    the auxiliary variable list of the i-th event has i+1 entries, [1-st triggered, ..., base triggered], thus the
+    auxiliary variables of a sequence with n events form a lower triangle (include the diagonal). The triangle is
+    saved row by row in one flat float buffer (float64 by default), the triangles of all sequences are concatenated
+    in the order of PackedSequence (CSR style, sequence_offset[p] is the start of the p-th triangle).
+
+    The store is also a read-only mapping, { id : { event_no: [auxiliary_map_i]}}, which is compatible with the
+    former nested dictionary data structure
+    """
+
+    def __init__(self, packed_sequence, dtype=np.float64):
+        self.__packed = packed_sequence
+        self.__position_map = {j: p for p, j in enumerate(packed_sequence.sequence_id_list)}
+
+        length = packed_sequence.length
+        self.sequence_offset = np.zeros([packed_sequence.sequence_count + 1], dtype=np.int64)
+        self.sequence_offset[1:] = np.cumsum(length * (length + 1) // 2)
+        self.buffer = np.zeros([self.sequence_offset[-1]], dtype=dtype)
+        self.__read_only_buffer = self.buffer.view()
+        self.__read_only_buffer.flags.writeable = False
+        # buffer position of the base triggered entry (q_ii) of every event
+        order = packed_sequence.event_order
+        self.diagonal_position = self.sequence_offset[packed_sequence.event_sequence] + order * (order + 3) // 2
+
+        # we assume the value of all entries in a list are same when initialize auxiliary variable
+        for length, positions in packed_sequence.bucket_map.items():
+            row, _ = np.tril_indices(length)
+            self.assign_bucket(positions, (1 / (row + 1))[np.newaxis, :], packed=True)
+
+    def triangle_position(self, positions, length):
+        """
+        :return: [B, L*(L+1)/2] buffer position of the triangles of the given equal length sequences
+        """
+        return self.sequence_offset[positions][:, np.newaxis] + np.arange(length * (length + 1) // 2)[np.newaxis, :]
+
+    def assign_bucket(self, positions, auxiliary, packed=False):
+        """
+        :param positions: sequence positions of a bucket
+        :param auxiliary: [B, L, L] auxiliary matrix (only the lower triangle and diagonal are used), or
+        [B, L*(L+1)/2] packed triangles if packed is True
+        :param packed:
+        """
+        if len(positions) == 0:
+            return
+        length = int(self.__packed.length[positions[0]])
+        if not packed:
+            row, col = np.tril_indices(length)
+            auxiliary = auxiliary[:, row, col]
+        self.buffer[self.triangle_position(positions, length)] = auxiliary
+
+    def sequence_triangle(self, sequence_id):
+        position = self.__position_map[sequence_id]
+        return self.__read_only_buffer[self.sequence_offset[position]: self.sequence_offset[position + 1]]
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes + self.sequence_offset.nbytes
+
+    def __getitem__(self, sequence_id):
+        return SequenceAuxiliaryView(self.sequence_triangle(sequence_id))
+
+    def __iter__(self):
+        return iter(self.__packed.sequence_id_list)
+
+    def __len__(self):
+        return self.__packed.sequence_count
+
+
+class SequenceAuxiliaryView(Mapping):
+    """
+    read-only { event_no: [auxiliary_map_i]} view of the triangle of one sequence
+    """
+
+    def __init__(self, triangle):
+        self.__triangle = triangle
+        self.__length = int((np.sqrt(8 * len(triangle) + 1) - 1) // 2)
+
+    def __getitem__(self, event_no):
+        if not 0 <= event_no < self.__length:
+            raise KeyError(event_no)
+        start = event_no * (event_no + 1) // 2
+        return self.__triangle[start: start + event_no + 1]
+
+    def __iter__(self):
+        return iter(range(0, self.__length))
+
+    def __len__(self):
+        return self.__length
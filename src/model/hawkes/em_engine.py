@@ -0,0 +1,300 @@
+# coding=utf-8
+import numpy as np
+
+
+def lower_triangle_mask(length, include_diagonal=False):
+    """
+    :return: [L, L] boolean mask, entry [i, l] is True if event l happens before event i
+    """
+    return np.tri(length, length, 0 if include_diagonal else -1, dtype=bool)
+
+
+def excitation_matrix(mutual_intensity, time_decay, index_matrix, lag_matrix):
+    """
+    :param mutual_intensity: [event_count, event_count]
+    :param time_decay: discrete time decay table
+    :param index_matrix: [B, L] event index of a bucket
+    :param lag_matrix: [B, L, L] pairwise lag of a bucket, consult PackedSequence.lag_bucket
+    :return: [B, L, L], entry [b, i, l] is alpha_{i l} * kappa(t_i - t_l) when l < i, otherwise 0
+    """
+    length = index_matrix.shape[1]
+    alpha = mutual_intensity[index_matrix[:, :, np.newaxis], index_matrix[:, np.newaxis, :]]
+    excitation = alpha * time_decay[lag_matrix]
+    excitation[:, ~lower_triangle_mask(length)] = 0
+    return excitation
+
+
+def auxiliary_probability(base_intensity, mutual_intensity, time_decay, index_matrix, lag_matrix):
+    """
+    according to eq. 9, 10, calculate the auxiliary variable of a whole bucket of equal length sequences
+    :param base_intensity: [event_count, 1]
+    :param mutual_intensity: [event_count, event_count]
+    :param time_decay: discrete time decay table
+    :param index_matrix: [B, L] event index of a bucket
+    :param lag_matrix: [B, L, L] pairwise lag of a bucket
+    :return: auxiliary, [B, L, L], entry [b, i, l] (l < i) is q_il, entry [b, i, i] is q_ii, other entries are 0
+    denominator, [B, L], the denominator of eq. 9, 10
+    """
+    length = index_matrix.shape[1]
+    auxiliary = excitation_matrix(mutual_intensity, time_decay, index_matrix, lag_matrix)
+    diagonal = np.arange(length)
+    auxiliary[:, diagonal, diagonal] = base_intensity[index_matrix, 0]
+    denominator = auxiliary.sum(axis=2)
+    auxiliary /= denominator[:, :, np.newaxis]
+    return auxiliary, denominator
+
+
+def expectation(base_intensity, mutual_intensity, time_decay, packed_sequence, auxiliary_variable):
+    """
+    update the auxiliary variable of all sequences of packed_sequence bucket by bucket
+    :return: {position of sequence: denominator of every event}
+    """
+    denominator_map = dict()
+    for positions, index_matrix, lag_matrix in packed_sequence.lag_bucket():
+        auxiliary, denominator = auxiliary_probability(base_intensity, mutual_intensity, time_decay, index_matrix,
+                                                       lag_matrix)
+        auxiliary_variable.assign_bucket(positions, auxiliary)
+        for b in range(0, len(positions)):
+            denominator_map[positions[b]] = denominator[b]
+    return denominator_map
+
+
+def alpha_nominator(auxiliary_variable, packed_sequence, event_count, sparse_structure=None):
+    """
+    the nominator of the mutual intensity update, entry [u, v] is the sum of q_il of all event pairs whose i-th event
+    is u and l-th event is v
+    :param auxiliary_variable: AuxiliaryVariable
+    :param packed_sequence: PackedSequence
+    :param event_count:
+    :param sparse_structure: SparseMutualIntensity, if it is not None, the nominator of the stored pairs is returned
+    :return: [event_count, event_count], or [nnz] aligned with sparse_structure.data
+    """
+    nominator = np.zeros([event_count, event_count] if sparse_structure is None else [sparse_structure.nnz])
+    for length, positions in packed_sequence.bucket_map.items():
+        if length < 2:
+            continue
+        row, col = np.tril_indices(length, -1)
+        event_position = packed_sequence.offset[positions][:, np.newaxis]
+        triangle_row, triangle_col = np.tril_indices(length)
+        off_diagonal = triangle_row != triangle_col
+        weight = auxiliary_variable.buffer[auxiliary_variable.triangle_position(positions, length)[:, off_diagonal]]
+        nominator += pair_sum(packed_sequence.event_index[event_position + row],
+                              packed_sequence.event_index[event_position + col], weight, event_count, sparse_structure)
+    return nominator
+
+
+def pair_sum(later_index, earlier_index, weight, event_count, sparse_structure=None):
+    """
+    :return: the sum of weight of every type pair, [event_count, event_count], or [nnz] aligned with
+    sparse_structure.data
+    """
+    if sparse_structure is None:
+        pair_code = later_index * event_count + earlier_index
+        nominator = np.bincount(pair_code.ravel(), weights=weight.ravel(), minlength=event_count * event_count)
+        return nominator.reshape([event_count, event_count])
+    position = sparse_structure.pair_position(later_index, earlier_index).ravel()
+    if np.any(position < 0):
+        raise RuntimeError('event pair out of the sparse structure')
+    return np.bincount(position, weights=weight.ravel(), minlength=sparse_structure.nnz)
+
+
+def alpha_denominator(discrete_time_integral, packed_sequence, event_count, sparse_structure=None):
+    """
+    the integral term does not depend on the triggered event type, thus all rows of the denominator are same
+    :return: [event_count, event_count], or [nnz] aligned with sparse_structure.data
+    """
+    # for numerical stability, we add 1
+    lag = packed_sequence.integral_lag + 1
+    row = np.bincount(packed_sequence.event_index, weights=discrete_time_integral[lag], minlength=event_count)
+    if sparse_structure is not None:
+        return row[sparse_structure.indices]
+    return np.repeat(row[np.newaxis, :], event_count, axis=0)
+
+
+def mu_nominator(auxiliary_variable, packed_sequence, event_count):
+    """
+    :return: [event_count, 1], entry [u, 0] is the sum of q_ii of all events whose type is u
+    """
+    weight = auxiliary_variable.buffer[auxiliary_variable.diagonal_position]
+    nominator = np.bincount(packed_sequence.event_index, weights=weight, minlength=event_count)
+    return nominator[:, np.newaxis]
+
+
+def mu_denominator(packed_sequence):
+    return packed_sequence.span_sum
+
+
+def log_likelihood(base_intensity, mutual_intensity, time_decay, time_integral, packed_sequence):
+    """
+    according to eq. 6, 7, 12
+    part one, the log intensity of every event, is evaluated bucket by bucket. Part two, the integral of intensity,
+    equals sum_u mu_u * (t_last - t_first) + sum_v (sum_u alpha_uv) * w_v, where w_v is the sum of kernel integral of
+    all events whose type is v, thus it is evaluated by one matrix-vector product
+    :return: log likelihood
+    """
+    part_one = 0
+    for _, index_matrix, lag_matrix in packed_sequence.lag_bucket():
+        excitation = excitation_matrix(mutual_intensity, time_decay, index_matrix, lag_matrix)
+        intensity = base_intensity[index_matrix, 0] + excitation.sum(axis=2)
+        part_one += np.log(intensity).sum(dtype=np.float64)
+    return part_one - log_likelihood_part_two(base_intensity, mutual_intensity, time_integral, packed_sequence)
+
+
+def log_likelihood_part_two(base_intensity, mutual_intensity, time_integral, packed_sequence):
+    event_count = len(base_intensity)
+    weight = np.bincount(packed_sequence.event_index, weights=time_integral[packed_sequence.integral_lag],
+                         minlength=event_count)
+    return base_intensity.sum(dtype=np.float64) * packed_sequence.span_sum + \
+        np.dot(mutual_intensity.sum(axis=0, dtype=np.float64), weight)
+
+
+def truncation_cutoff(time_decay, tolerance):
+    """
+    find the smallest lag w such that every kernel value whose lag is not smaller than w is negligible, i.e., not
+    larger than tolerance * max kernel value
+    :return: cutoff lag w, the largest dropped kernel value and the dropped share of the kernel table
+    """
+    threshold = tolerance * np.abs(time_decay).max()
+    significant = np.flatnonzero(np.abs(time_decay) > threshold)
+    cutoff = int(significant[-1]) + 1 if len(significant) > 0 else 1
+    dropped = np.abs(time_decay[cutoff:])
+    max_dropped = dropped.max() if len(dropped) > 0 else 0.
+    dropped_share = dropped.sum() / np.abs(time_decay).sum()
+    return cutoff, max_dropped, dropped_share
+
+
+def window_excitation(mutual_intensity, time_decay, packed_sequence, width):
+    """
+    :return: alpha_{i l} * kappa(t_i - t_l) of every event pair (i, l) inside the truncated window
+    """
+    later, earlier = packed_sequence.window_pair(width)
+    event_index = packed_sequence.event_index
+    alpha = mutual_intensity[event_index[later], event_index[earlier]]
+    return alpha * time_decay[packed_sequence.window_lag(width)]
+
+
+def window_intensity(base_intensity, mutual_intensity, time_decay, packed_sequence, width):
+    """
+    :return: the intensity of every event (the denominator of eq. 9, 10) only counting the earlier events inside
+    the window, and the excitation of every event pair inside the window
+    """
+    later, earlier = packed_sequence.window_pair(width)
+    excitation = window_excitation(mutual_intensity, time_decay, packed_sequence, width)
+    intensity = base_intensity[packed_sequence.event_index, 0] + \
+        np.bincount(later, weights=excitation, minlength=len(packed_sequence.event_index))
+    return intensity, excitation
+
+
+def window_triangle_position(auxiliary_variable, packed_sequence, later, earlier):
+    """
+    :return: buffer position of q_il of every event pair (i, l)
+    """
+    order = packed_sequence.event_order
+    return auxiliary_variable.sequence_offset[packed_sequence.event_sequence[later]] + \
+        order[later] * (order[later] + 1) // 2 + order[earlier]
+
+
+def window_expectation(base_intensity, mutual_intensity, time_decay, packed_sequence, auxiliary_variable, width):
+    """
+    the truncated version of expectation, the auxiliary variables of event pairs out of the window are set as 0
+    :return: {position of sequence: denominator of every event}
+    """
+    later, earlier = packed_sequence.window_pair(width)
+    intensity, excitation = window_intensity(base_intensity, mutual_intensity, time_decay, packed_sequence, width)
+    auxiliary_variable.buffer[:] = 0
+    auxiliary_variable.buffer[window_triangle_position(auxiliary_variable, packed_sequence, later, earlier)] = \
+        excitation / intensity[later]
+    auxiliary_variable.buffer[auxiliary_variable.diagonal_position] = \
+        base_intensity[packed_sequence.event_index, 0] / intensity
+    offset = packed_sequence.offset
+    return {p: intensity[offset[p]: offset[p + 1]] for p in range(0, packed_sequence.sequence_count)}
+
+
+def window_alpha_nominator(auxiliary_variable, packed_sequence, event_count, width, sparse_structure=None):
+    later, earlier = packed_sequence.window_pair(width)
+    event_index = packed_sequence.event_index
+    weight = auxiliary_variable.buffer[window_triangle_position(auxiliary_variable, packed_sequence, later, earlier)]
+    return pair_sum(event_index[later], event_index[earlier], weight, event_count, sparse_structure)
+
+
+def window_log_likelihood(base_intensity, mutual_intensity, time_decay, time_integral, packed_sequence, width):
+    """
+    the truncated version of log_likelihood, only part one is truncated
+    """
+    intensity, _ = window_intensity(base_intensity, mutual_intensity, time_decay, packed_sequence, width)
+    return np.log(intensity).sum(dtype=np.float64) - log_likelihood_part_two(base_intensity, mutual_intensity,
+                                                                             time_integral, packed_sequence)
+
+
+def exp_recursive_statistic(base_intensity, mutual_intensity, omega, packed_sequence):
+    """
+    for the exp kernel, the decayed excitation state R_i[v] = sum_{l < i, type of l is v} exp(-omega * (t_i - t_l))
+    satisfies R_i = (R_{i-1} + e_{type of i-1}) * exp(-omega * (t_i - t_{i-1})), thus the intensity of every event is
+    mu_u + alpha_u . R_i, which costs O(n * event_count) instead of O(n^2) per sequence.
+    The k-th events of all sequences are processed together, sequences are sorted by length so that the sequences
+    which still have a k-th event form a prefix
+    :return: intensity, [N], the intensity (the denominator of eq. 9, 10) of every event
+    responsibility, [event_count, event_count], entry [u, v] is the sum of R_i[v] / intensity_i over all events i of
+    type u, thus the nominator of mutual intensity update is alpha * responsibility
+    """
+    event_count = len(base_intensity)
+    event_index = packed_sequence.event_index
+    event_time = packed_sequence.event_time
+    order = np.argsort(-packed_sequence.length, kind='stable')
+    start = packed_sequence.offset[order]
+    length = packed_sequence.length[order]
+
+    state = np.zeros([len(order), event_count])
+    intensity = np.zeros([len(event_index)])
+    responsibility = np.zeros([event_count, event_count])
+    max_length = int(length[0]) if len(length) > 0 else 0
+    for k in range(0, max_length):
+        active = int(np.count_nonzero(length > k))
+        event = start[0: active] + k
+        index = event_index[event]
+        active_state = state[0: active]
+        if k > 0:
+            active_state[np.arange(active), event_index[event - 1]] += 1
+            active_state *= np.exp(-1 * omega * (event_time[event] - event_time[event - 1]))[:, np.newaxis]
+        intensity[event] = base_intensity[index, 0] + (mutual_intensity[index] * active_state).sum(axis=1)
+        np.add.at(responsibility, index, active_state / intensity[event][:, np.newaxis])
+    return intensity, responsibility
+
+
+def conditional_intensity(base_intensity, mutual_intensity, time_decay, packed_sequence, query_time,
+                          max_element=2 ** 22):
+    """
+    lambda_u(t) = mu_u + sum_{l: t_l <= t} alpha_{u v_l} * kappa(t - t_l) of every sequence (history) and every query
+    time. kappa is read from the discrete time decay table, the events whose lag is not smaller than the table size
+    contribute 0. The decayed excitation state S[g, b, v] = sum_{l: type of l is v} kappa(t_gb - t_l) is accumulated by
+    one bincount, then the excitation is S . alpha^T
+    :param base_intensity: [event_count, 1]
+    :param mutual_intensity: [event_count, event_count] or SparseMutualIntensity
+    :param time_decay: discrete time decay table
+    :param packed_sequence: PackedSequence of the histories
+    :param query_time: [G, B] integer query time (day) of every history
+    :param max_element: the [g, N] lag arrays contain no more than max_element entries
+    :return: [G, B, event_count]
+    """
+    event_count = len(base_intensity)
+    query_time = np.asarray(query_time, dtype=np.int64)
+    grid_count, sequence_count = query_time.shape
+    event_sequence = packed_sequence.event_sequence
+    code = event_sequence * event_count + packed_sequence.event_index
+    state_size = sequence_count * event_count
+    state = np.zeros([grid_count, state_size])
+    chunk_size = max(1, max_element // max(len(code), 1))
+    for start in range(0, grid_count, chunk_size):
+        query = query_time[start: start + chunk_size]
+        lag = query[:, event_sequence] - packed_sequence.event_time[np.newaxis, :]
+        valid = (lag >= 0) & (lag < len(time_decay))
+        weight = np.where(valid, time_decay[np.where(valid, lag, 0)], 0.)
+        grid_code = np.arange(len(query))[:, np.newaxis] * state_size + code[np.newaxis, :]
+        state[start: start + len(query)] = np.bincount(grid_code.ravel(), weights=weight.ravel(),
+                                                       minlength=len(query) * state_size).reshape([-1, state_size])
+    state = state.reshape([grid_count, sequence_count, event_count])
+    if isinstance(mutual_intensity, np.ndarray):
+        excitation = np.matmul(state, mutual_intensity.T)
+    else:
+        excitation = mutual_intensity.dot(state)
+    return base_intensity[:, 0] + excitation
@@ -0,0 +1,206 @@
+# coding=utf-8
+import csv
+import datetime
+import itertools
+import os
+import time
+
+import numpy as np
+
+from hawkes.hawkes_process import Hawkes
+
+
+def generate_parameter(event_count, omega, random_state, base_range=(0.01, 0.05), branching_ratio=0.5):
+    """
+    generate a stable ground truth parameter. The integral of exp kernel is 1 / omega, the mutual intensity is scaled
+    so that the spectral radius of the branching matrix (mutual intensity / omega) is branching_ratio
+    :return: base intensity [event_count, 1], mutual intensity [event_count, event_count]
+    """
+    base_intensity = random_state.uniform(base_range[0], base_range[1], [event_count, 1])
+    mutual_intensity = random_state.uniform(0, 1, [event_count, event_count])
+    spectral_radius = np.abs(np.linalg.eigvals(mutual_intensity / omega)).max()
+    mutual_intensity = mutual_intensity * branching_ratio / spectral_radius
+    return base_intensity, mutual_intensity
+
+
+def simulate_sequence(hawkes, max_length, horizon, random_state):
+    """
+    simulate a multivariate Hawkes sequence by Ogata thinning, the kernel is evaluated by Hawkes.kernel_calculate.
+    The current intensity is used as the upper bound of the intensity before next event, thus the kernel of hawkes
+    must be non-increasing, e.g., the exp kernel
+    :param hawkes: Hawkes model which holds the ground truth base intensity and mutual intensity
+    :param max_length: the simulation stops when the sequence has max_length events
+    :param horizon: the simulation stops when time exceeds horizon (day)
+    :param random_state:
+    :return: [(event_index, event_time), ...], event time is an integer day, the time of first event is 0
+    """
+    def intensity(current_time):
+        if len(history) == 0:
+            return hawkes.base_intensity[:, 0]
+        kernel = np.array([hawkes.kernel_calculate(item[1], current_time) for item in history])
+        history_index = [item[0] for item in history]
+        return hawkes.base_intensity[:, 0] + np.dot(hawkes.mutual_intensity[:, history_index], kernel)
+
+    history = []
+    current_time = 0.
+    while len(history) < max_length:
+        upper_bound = intensity(current_time).sum()
+        current_time += random_state.exponential(1 / upper_bound)
+        if current_time > horizon:
+            break
+        candidate = intensity(current_time)
+        if random_state.uniform(0, upper_bound) <= candidate.sum():
+            event_index = random_state.choice(len(candidate), p=candidate / candidate.sum())
+            history.append((int(event_index), current_time))
+
+    if len(history) == 0:
+        return []
+    first_time = history[0][1]
+    return [(item[0], int(item[1] - first_time)) for item in history]
+
+
+def generate_sequence_map(hawkes, sequence_count, max_length, horizon, random_state):
+    """
+    :return: {id_index: [(event_index, event_time), ...]}, empty sequences are simulated again
+    """
+    sequence_map = dict()
+    while len(sequence_map) < sequence_count:
+        sequence = simulate_sequence(hawkes, max_length, horizon, random_state)
+        if len(sequence) > 0:
+            sequence_map[str(len(sequence_map))] = sequence
+    return sequence_map
+
+
+def simulate_data(event_count, sequence_count, sequence_length, omega, max_day, seed, branching_ratio=0.5):
+    """
+    simulate a training set and a test set (a quarter of the training set) from a ground truth exp kernel model
+    """
+    random_state = np.random.RandomState(seed)
+    generator = Hawkes(training_data={}, test_data={}, event_count=event_count, kernel='exp',
+                       init_strategy='default', time_slot=None, omega=omega, max_day=max_day)
+    generator.base_intensity, generator.mutual_intensity = generate_parameter(event_count, omega, random_state,
+                                                                              branching_ratio=branching_ratio)
+    horizon = max_day - 1
+    training_data = generate_sequence_map(generator, sequence_count, sequence_length, horizon, random_state)
+    test_data = generate_sequence_map(generator, max(1, sequence_count // 4), sequence_length, horizon,
+                                      random_state)
+    return training_data, test_data
+
+
+def time_function(function, repeat):
+    """
+    :return: the median wall time (second) of repeat calls
+    """
+    cost = []
+    for _ in range(0, repeat):
+        start_time = time.perf_counter()
+        function()
+        cost.append(time.perf_counter() - start_time)
+    return float(np.median(cost))
+
+
+def benchmark_configuration(event_count, sequence_count, sequence_length, time_slot, repeat=3, omega=1,
+                            max_day=10000, seed=0):
+    """
+    simulate the training set and the test set, then time the kernel table update, the E step, the M step and the log
+    likelihood calculation of a model whose kernel is exp (time_slot is None) or Fourier
+    :return: result map of one configuration
+    """
+    training_data, test_data = simulate_data(event_count, sequence_count, sequence_length, omega, max_day, seed)
+
+    kernel = 'exp' if time_slot is None else 'Fourier'
+    np.random.seed(seed)
+    hawkes = Hawkes(training_data=training_data, test_data=test_data, event_count=event_count, kernel=kernel,
+                    init_strategy='default', time_slot=time_slot, omega=omega, max_day=max_day)
+
+    def update_kernel_table():
+        if kernel == 'Fourier':
+            hawkes.k_omega_update()
+        hawkes.update_discrete_time_decay_function()
+        hawkes.update_discrete_integral_function()
+
+    update_kernel_table()
+    result = dict()
+    result['event_count'] = event_count
+    result['sequence_count'] = sequence_count
+    result['sequence_length'] = sequence_length
+    result['time_slot'] = 'none' if time_slot is None else time_slot
+    result['kernel'] = kernel
+    result['event_sum'] = len(hawkes.packed_training_data.event_index)
+    result['kernel_table_time'] = time_function(update_kernel_table, repeat)
+    result['expectation_time'] = time_function(hawkes.expectation_step, repeat)
+    result['maximization_time'] = time_function(hawkes.maximization_step, repeat)
+    result['log_likelihood_time'] = time_function(lambda: hawkes.log_likelihood_calculate(hawkes.training_data),
+                                                  repeat)
+    return result
+
+
+def benchmark(event_count_list, sequence_count_list, sequence_length_list, time_slot_list, file_path, file_name,
+              repeat=3):
+    """
+    run the benchmark on the grid and write the result to a csv file, one configuration per row
+    """
+    result_list = []
+    for event_count, sequence_count, sequence_length, time_slot in itertools.product(
+            event_count_list, sequence_count_list, sequence_length_list, time_slot_list):
+        result = benchmark_configuration(event_count, sequence_count, sequence_length, time_slot, repeat=repeat)
+        print(result)
+        result_list.append(result)
+
+    with open(os.path.join(file_path, file_name), 'w', encoding='utf-8-sig', newline="") as f:
+        csv_writer = csv.DictWriter(f, fieldnames=list(result_list[0].keys()))
+        csv_writer.writeheader()
+        csv_writer.writerows(result_list)
+    return result_list
+
+
+def benchmark_acceleration(event_count, sequence_count, sequence_length, time_slot, parameter_tolerance,
+                           max_iteration, file_path, file_name, omega=1, max_day=10000, seed=0,
+                           branching_ratio=0.8):
+    """
+    fit the same simulated data with plain EM and with SQUAREM until the relative parameter change is smaller than
+    parameter_tolerance, and write the iteration count, the EM update count, the final log likelihood and the wall time
+    of both methods to a csv file.
+    The parameter change is used as the criterion because the log likelihood of this model is not monotone along EM
+    iterations
+    """
+    training_data, test_data = simulate_data(event_count, sequence_count, sequence_length, omega, max_day, seed,
+                                             branching_ratio=branching_ratio)
+    kernel = 'exp' if time_slot is None else 'Fourier'
+    result_list = []
+    for acceleration in [None, 'squarem']:
+        np.random.seed(seed)
+        hawkes = Hawkes(training_data=training_data, test_data=test_data, event_count=event_count, kernel=kernel,
+                        init_strategy='default', time_slot=time_slot, omega=omega, max_day=max_day)
+        start_time = time.perf_counter()
+        hawkes.optimization(max_iteration, parameter_tolerance=parameter_tolerance, acceleration=acceleration)
+        result = dict()
+        result['acceleration'] = 'none' if acceleration is None else acceleration
+        result['kernel'] = kernel
+        result['iteration'] = hawkes.iteration_count
+        result['em_update'] = hawkes.em_map_count
+        result['train_log_likelihood'] = hawkes.train_log_likelihood_tendency[-1]
+        result['test_log_likelihood'] = hawkes.test_log_likelihood_tendency[-1]
+        result['wall_time'] = time.perf_counter() - start_time
+        print(result)
+        result_list.append(result)
+
+    with open(os.path.join(file_path, file_name), 'w', encoding='utf-8-sig', newline="") as f:
+        csv_writer = csv.DictWriter(f, fieldnames=list(result_list[0].keys()))
+        csv_writer.writeheader()
+        csv_writer.writerows(result_list)
+    return result_list
+
+
+def main():
+    save_file_path = os.path.abspath('..\\..\\..') + '\\reconstruct_data\\mimic_3\\benchmark\\'
+    file_name = 'hawkes_benchmark_' + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + '.csv'
+    benchmark(event_count_list=[10, 100], sequence_count_list=[100, 1000], sequence_length_list=[10, 50],
+              time_slot_list=[None, 100, 1000], file_path=save_file_path, file_name=file_name)
+    benchmark_acceleration(event_count=10, sequence_count=300, sequence_length=40, time_slot=None,
+                           parameter_tolerance=1e-7, max_iteration=3000, file_path=save_file_path,
+                           file_name='acceleration_' + file_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,13 @@
 # coding=utf-8
 import csv
+import multiprocessing
 import os
+import time
 
+import mimic.cohort_cache as cohort_cache
 import mimic.derive_training_data as dtd
 from hawkes.hawkes_process import Hawkes
+from hawkes.hawkes_result import load_result, result_file_name, save_result_npz
 
 
 def hawkes_load_data(file_path, file_name, diagnosis_reserve, procedure_reserve):
@@ -77,6 +81,7 @@ def save_result(return_data_map, file_path, name_prefix):
             base_intensity_vector.append(base_intensity_data[i][0])
         csv_writer.writerows([base_intensity_vector])
 
+    # the auxiliary variable of the return map of hawkes_optimization is read lazily, reading it runs a full E step
     # with open(os.path.join(file_path, auxiliary_variable), 'w', encoding='utf-8-sig', newline="") as f:
     #     csv_writer = csv.writer(f)
     #     auxiliary_variable_data = return_data_map['auxiliary_variable']
@@ -125,8 +130,26 @@ def save_result(return_data_map, file_path, name_prefix):
             csv_writer.writerows([decay_integral])
 
 
+class HawkesReturnMap(dict):
+    """
+    return map of hawkes_optimization. Reading Hawkes.auxiliary_variable runs a full E step and allocates the whole
+    auxiliary buffer, thus the 'auxiliary_variable' key is read from the model on its first access by key only, the
+    map does not hold it before (get does not read it either)
+    """
+
+    def __init__(self, hawkes_process):
+        super().__init__()
+        self.__hawkes_process = hawkes_process
+
+    def __missing__(self, key):
+        if key != 'auxiliary_variable':
+            raise KeyError(key)
+        self[key] = self.__hawkes_process.auxiliary_variable
+        return self[key]
+
+
 def hawkes_optimization(train_data, test_data, iteration, diagnosis_reserve, procedure_reserve, kernel,
-                        time_slot, ):
+                        time_slot, sparse=False, precision='float64'):
     """
     :param train_data:
     :param test_data:
@@ -135,33 +158,181 @@ def hawkes_optimization(train_data, test_data, iteration, diagnosis_reserve, pro
     :param procedure_reserve:
     :param kernel:
     :param time_slot:
-    :return:
+    :param sparse: only store the mutual intensity of co-occurring type pairs, consult Hawkes. The dense mutual
+    intensity is returned in both modes
+    :param precision: 'float64' or 'float32', consult Hawkes
+    :return: HawkesReturnMap, the auxiliary variable is read lazily
     """
 
     event_sum = diagnosis_reserve + procedure_reserve
 
     hawkes_process = Hawkes(training_data=train_data, test_data=test_data, event_count=event_sum, kernel=kernel,
-                            init_strategy='default', time_slot=time_slot)
+                            init_strategy='default', time_slot=time_slot, sparse=sparse,
+                            precision=precision)
     hawkes_process.optimization(iteration)
 
-    return_data_map = dict()
+    return_data_map = HawkesReturnMap(hawkes_process)
     return_data_map['train_log_likelihood_tendency'] = hawkes_process.train_log_likelihood_tendency
     return_data_map['test_log_likelihood_tendency'] = hawkes_process.test_log_likelihood_tendency
-    return_data_map['mutual_intensity'] = hawkes_process.mutual_intensity
+    return_data_map['mutual_intensity'] = hawkes_process.mutual_intensity_dense()
     return_data_map['base_intensity'] = hawkes_process.base_intensity
-    return_data_map['auxiliary_variable'] = hawkes_process.auxiliary_variable
     return_data_map['kernel'] = kernel
+    return_data_map['time_decay_function'] = hawkes_process.discrete_time_decay
+    return_data_map['time_decay_integral'] = hawkes_process.discrete_time_integral
     if kernel == 'fourier' or kernel == 'Fourier':
         return_data_map['k_omega'] = hawkes_process.k_omega
         return_data_map['y_omega'] = hawkes_process.y_omega
         return_data_map['count_of_each_slot'] = hawkes_process.count_of_each_slot
         return_data_map['count_of_each_event'] = hawkes_process.count_of_each_event
-        return_data_map['time_decay_function'] = hawkes_process.discrete_time_decay
-        return_data_map['time_decay_integral'] = hawkes_process.discrete_time_integral
 
     return return_data_map
 
 
+def save_hawkes_result(return_data_map, file_path, name_prefix, metadata, csv_export=False):
+    """
+    save the result of a run to one versioned npz file (consult hawkes_result), the per matrix csv files of
+    save_result are written too if csv_export is True
+    """
+    save_result_npz(return_data_map, file_path, name_prefix, metadata)
+    if csv_export:
+        save_result(return_data_map, file_path, name_prefix)
+
+
+def convert_result_to_csv(result_path, file_path, name_prefix):
+    """
+    conversion tool, write the csv files of save_result from a npz result file
+    """
+    result = load_result(result_path)
+    return_data_map = {name: result[name] for name in result if not name.startswith('meta_')}
+    save_result(return_data_map, file_path, name_prefix)
+
+
+def hawkes_split_data(event_sequence_map):
+    """
+    split the data as hawkes_load_data does, the first fold is the test data
+    """
+    data_sequence_info = dtd.hawkes_random_split(event_sequence_map, fold=5)
+    index = 0
+    test_event_sequence_map = None
+    train_event_sequence_map = dict()
+    for key in data_sequence_info:
+        if index == 0:
+            test_event_sequence_map = data_sequence_info[key]
+        else:
+            train_event_sequence_map.update(data_sequence_info[key])
+        index += 1
+    return train_event_sequence_map, test_event_sequence_map
+
+
+# the data of every vocabulary cut, it is set by the initializer of every worker process
+_grid_data_map = dict()
+
+
+def _grid_initializer(data_map):
+    global _grid_data_map
+    _grid_data_map = data_map
+
+
+def _grid_worker(configuration):
+    """
+    fit one configuration and save its result
+    :return: summary row of the configuration
+    """
+    train_data, test_data = _grid_data_map[(configuration['diagnosis'], configuration['procedure'])]
+    start_time = time.perf_counter()
+    parameter_map = hawkes_optimization(train_data, test_data, configuration['iteration'],
+                                        configuration['diagnosis'], configuration['procedure'],
+                                        configuration['kernel'], configuration['time_slot'])
+    save_hawkes_result(parameter_map, configuration['save_file_path'], configuration['name_prefix'],
+                       grid_metadata(configuration), configuration['csv_export'])
+    wall_time = time.perf_counter() - start_time
+    return grid_summary_row(configuration, parameter_map['train_log_likelihood_tendency'][-1],
+                            parameter_map['test_log_likelihood_tendency'][-1], wall_time, 'done')
+
+
+def grid_metadata(configuration):
+    return {name: configuration[name] for name in ['diagnosis', 'procedure', 'iteration', 'time_slot']}
+
+
+# columns of the grid summary table, the keys of grid_summary_row
+GRID_SUMMARY_FIELD_LIST = ['kernel', 'diagnosis', 'procedure', 'iteration', 'time_slot', 'train_log_likelihood',
+                           'test_log_likelihood', 'wall_time', 'status']
+
+
+def grid_summary_row(configuration, train_log_likelihood, test_log_likelihood, wall_time, status):
+    return {'kernel': configuration['kernel'], 'diagnosis': configuration['diagnosis'],
+            'procedure': configuration['procedure'], 'iteration': configuration['iteration'],
+            'time_slot': 'none' if configuration['time_slot'] is None else configuration['time_slot'],
+            'train_log_likelihood': train_log_likelihood, 'test_log_likelihood': test_log_likelihood,
+            'wall_time': wall_time, 'status': status}
+
+
+def hawkes_grid_eval(source_file_path, source_file_name, save_file_path, diagnosis_list, procedure_list,
+                     iteration_list, kernel_list, time_slot_list, processes=1, summary_name='hawkes_grid_summary.csv',
+                     csv_export=False):
+    """
+    run the hyper-parameter grid of hawkes_eval concurrently.
+    The XML is loaded from the cohort cache (consult mimic.cohort_cache), every (diagnosis, procedure) vocabulary cut
+    is filtered from the cached arrays and split once, then all configurations of the cut share the same training
+    data and test data.
+    The configurations whose npz result file already exists are skipped, their final log likelihood is read from the
+    result file. At last, a summary table of all configurations is written to save_file_path + summary_name
+    :param processes: size of the process pool, the configurations are run in the current process if it is 1
+    :param csv_export: write the csv files of save_result besides the npz result file
+    :return: summary rows, in the order of the grid
+    """
+    name_prefix_temp = '{}_diagnosis_{}_procedure_{}_iteration_{}_slot_{}_'
+    cohort = cohort_cache.load_cohort_cache(source_file_path + source_file_name)
+
+    data_map = dict()
+    configuration_list = []
+    for diagnosis_reserve in diagnosis_list:
+        for procedure_reserve in procedure_list:
+            event_sequence_map, name_index_map = cohort_cache.cohort_hawkes_cut(cohort, diagnosis_reserve,
+                                                                                procedure_reserve)
+            data_map[(diagnosis_reserve, procedure_reserve)] = hawkes_split_data(event_sequence_map)
+            map_name = 'index_name_map_diagnosis_' + str(diagnosis_reserve) + '_procedure_' + str(
+                procedure_reserve) + '.csv'
+            hawkes_save_name_index_map(save_file_path, map_name, name_index_map)
+
+            for iteration in iteration_list:
+                for kernel in kernel_list:
+                    for time_slot in ([None] if kernel == 'exp' else time_slot_list):
+                        name_prefix = name_prefix_temp.format(kernel, str(diagnosis_reserve), str(procedure_reserve),
+                                                              str(iteration),
+                                                              'none' if time_slot is None else str(time_slot))
+                        configuration_list.append({'diagnosis': diagnosis_reserve, 'procedure': procedure_reserve,
+                                                   'iteration': iteration, 'kernel': kernel, 'time_slot': time_slot,
+                                                   'name_prefix': name_prefix, 'save_file_path': save_file_path,
+                                                   'csv_export': csv_export})
+
+    summary_list = [None] * len(configuration_list)
+    pending_list = []
+    for index, configuration in enumerate(configuration_list):
+        result_path = os.path.join(save_file_path, result_file_name(configuration['name_prefix']))
+        if os.path.exists(result_path):
+            result = load_result(result_path)
+            summary_list[index] = grid_summary_row(configuration, result['train_log_likelihood_tendency'][-1],
+                                                   result['test_log_likelihood_tendency'][-1], '', 'skipped')
+        else:
+            pending_list.append(index)
+
+    if processes > 1 and len(pending_list) > 0:
+        with multiprocessing.Pool(processes, initializer=_grid_initializer, initargs=(data_map,)) as pool:
+            result_list = pool.map(_grid_worker, [configuration_list[index] for index in pending_list], chunksize=1)
+    else:
+        _grid_initializer(data_map)
+        result_list = [_grid_worker(configuration_list[index]) for index in pending_list]
+    for index, result in zip(pending_list, result_list):
+        summary_list[index] = result
+
+    with open(os.path.join(save_file_path, summary_name), 'w', encoding='utf-8-sig', newline="") as f:
+        csv_writer = csv.DictWriter(f, fieldnames=GRID_SUMMARY_FIELD_LIST)
+        csv_writer.writeheader()
+        csv_writer.writerows(summary_list)
+    return summary_list
+
+
 def hawkes_eval():
     # the data location of local environment is different from remote server, we need select appropriate path at first
     # source data server: os.path.abspath('/mnt/datashare/group.huang/diseaseprogression/reconstruct_data/mimic_3
@@ -194,7 +365,9 @@ def hawkes_eval():
                                                             procedure_reserve, kernel, time_slot)
                         name_prefix = name_prefix_temp.format(kernel, str(diagnosis_reserve), str(procedure_reserve),
                                                               str(iteration), 'none')
-                        save_result(parameter_map, save_file_path, name_prefix)
+                        metadata = {'diagnosis': diagnosis_reserve, 'procedure': procedure_reserve,
+                                    'iteration': iteration, 'time_slot': time_slot}
+                        save_hawkes_result(parameter_map, save_file_path, name_prefix, metadata)
                     else:
                         for time_slot in [1000]:
                             parameter_map = hawkes_optimization(train_data, test_data, iteration, diagnosis_reserve,
@@ -202,7 +375,18 @@ def hawkes_eval():
                             name_prefix = name_prefix_temp.format(kernel, str(diagnosis_reserve),
                                                                   str(procedure_reserve),
                                                                   str(iteration), str(time_slot))
-                            save_result(parameter_map, save_file_path, name_prefix)
+                            metadata = {'diagnosis': diagnosis_reserve, 'procedure': procedure_reserve,
+                                        'iteration': iteration, 'time_slot': time_slot}
+                            save_hawkes_result(parameter_map, save_file_path, name_prefix, metadata)
+
+
+def hawkes_grid():
+    # paths are as same as hawkes_eval
+    source_file_path = os.path.abspath('..\\..\\..') + '\\reconstruct_data\\mimic_3\\reconstruct\\'
+    save_file_path = os.path.abspath('..\\..\\..') + '\\reconstruct_data\\mimic_3\\reconstruct\\'
+    source_file_name = 'reconstructed.xml'
+    hawkes_grid_eval(source_file_path, source_file_name, save_file_path, diagnosis_list=[80], procedure_list=[20],
+                     iteration_list=[10], kernel_list=['fourier', 'exp'], time_slot_list=[1000], processes=4)
 
 
 if __name__ == '__main__':
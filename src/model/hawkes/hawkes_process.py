@@ -7,6 +7,13 @@ import os
 import numpy as np
 
 import mimic.derive_training_data as dtd
+from hawkes import em_engine
+from hawkes.auxiliary_variable import AuxiliaryVariable
+from hawkes.kernel_table import KernelTable
+from hawkes.multi_start import multi_start_optimization
+from hawkes.packed_sequence import PackedSequence
+from hawkes.sharded_em import ShardedEM
+from hawkes.sparse_intensity import SparseMutualIntensity
 
 
 class Hawkes(object):
@@ -16,7 +23,8 @@ class Hawkes(object):
     """
 
     def __init__(self, training_data, test_data, event_count, kernel, init_strategy, time_slot, omega=1,
-                 init_time=100, max_day=10000):
+                 init_time=100, max_day=10000, truncation=None, exp_recursion=True, sparse=False,
+                 precision='float64'):
         """
         Construct a new Hawkes Model
         :param training_data:
@@ -41,9 +49,26 @@ class Hawkes(object):
         automatically after initialization procedure accomplished
         :param time_slot: time slot count
         :param init_time: the time of first event
+        :param truncation: if truncation is not None, the kernel support is truncated at the lag after which every
+        kernel value is smaller than truncation * max kernel value, each event only visits the earlier events inside
+        the window in E step and likelihood calculation
+        :param exp_recursion: if kernel is exp and the kernel is not truncated, the event intensities of E step and
+        likelihood calculation are calculated recursively in linear time, consult em_engine.exp_recursive_statistic.
+        The auxiliary variables are not materialized by the E step in this case, they are calculated only when
+        auxiliary_variable is visited
+        :param sparse: if sparse is True, the mutual intensity is a SparseMutualIntensity which only stores the type
+        pairs co-occurring in the training data (alpha of other pairs is 0 after the first M step), the E step and
+        the M step only visit these pairs. The exp recursion is disabled in sparse mode, use mutual_intensity_dense
+        to export the dense matrix
+        :param precision: 'float64' or 'float32'. If it is 'float32', the intensities, the kernel tables and the
+        auxiliary variables are float32 and the spectral data are complex64, which halves their memory. The
+        sufficient statistics of the M step and the log likelihood are still accumulated in float64
         """
-        self.training_data = training_data
-        self.test_data = test_data
+        # the packed data holds the data-only statistics, it is rebuilt only when the data is replaced
+        self.__training_data = training_data
+        self.__test_data = test_data
+        self.packed_training_data = PackedSequence(training_data)
+        self.packed_test_data = PackedSequence(test_data)
         self.excite_kernel = kernel
         self.event_count = event_count
         self.init_strategy = init_strategy
@@ -51,11 +76,36 @@ class Hawkes(object):
         self.omega = omega
         self.train_log_likelihood_tendency = []
         self.test_log_likelihood_tendency = []
+        self.iteration_count = 0
+        self.em_map_count = 0
+        if precision == 'float64':
+            self.real_dtype, self.complex_dtype = np.float64, np.complex128
+        elif precision == 'float32':
+            self.real_dtype, self.complex_dtype = np.float32, np.complex64
+        else:
+            raise RuntimeError('illegal precision')
+        # the running sufficient statistics of the stochastic EM
+        self.stochastic_statistic = None
+        # the start kept by multi_start_optimization
+        self.best_start = None
+        self.sparse_structure = None
+        if sparse:
+            self.sparse_structure = SparseMutualIntensity.from_packed_sequence(self.packed_training_data, event_count)
         self.base_intensity = self.initialize_base_intensity()
         self.mutual_intensity = self.initialize_mutual_intensity()
-        self.auxiliary_variable = self.initialize_auxiliary_variable()
+        self.exp_recursion = exp_recursion and (kernel == 'default' or kernel == 'exp') and truncation is None and \
+            not sparse
+        # the parameters and the statistics of the last recursive E step
+        self.expectation_parameter = None
+        self.expectation_statistic = None
+        # the auxiliary variable store is allocated when it is visited at first, the stochastic EM never visits it
+        self.__auxiliary_stale = False
+        self.__auxiliary_variable = None
         self.initial_time = init_time
         self.max_day = max_day
+        self.kernel_table = KernelTable(max_day, time_slot)
+        self.truncation = truncation
+        self.truncation_width = None
         self.auxiliary_variable_denominator = None
         self.mu_nominator_vector = None
         self.mu_denominator_vector = None
@@ -71,10 +121,14 @@ class Hawkes(object):
             self.k_omega = self.k_omega_update()
         print("Hawkes Process Model Initialize Accomplished")
 
-    def initialize_base_intensity(self):
+    def initialize_base_intensity(self, random_state=None):
+        """
+        :param random_state: np.random.RandomState of the draws, the global random generator if it is None
+        """
+        random_state = np.random if random_state is None else random_state
         base_intensity = None
         if self.init_strategy == 'default':
-            base_intensity = np.random.uniform(0.1, 1, [self.event_count, 1])
+            base_intensity = random_state.uniform(0.1, 1, [self.event_count, 1]).astype(self.real_dtype)
         else:
             pass
 
@@ -82,10 +136,18 @@ class Hawkes(object):
             raise RuntimeError('illegal initial strategy')
         return base_intensity
 
-    def initialize_mutual_intensity(self):
+    def initialize_mutual_intensity(self, random_state=None):
+        """
+        :param random_state: consult initialize_base_intensity
+        """
+        random_state = np.random if random_state is None else random_state
         mutual_excite_intensity = None
-        if self.init_strategy == 'default':
-            mutual_excite_intensity = np.random.uniform(0.1, 1, [self.event_count, self.event_count])
+        if self.init_strategy == 'default' and self.sparse_structure is not None:
+            mutual_excite_intensity = self.sparse_structure.with_data(
+                random_state.uniform(0.1, 1, [self.sparse_structure.nnz]).astype(self.real_dtype))
+        elif self.init_strategy == 'default':
+            mutual_excite_intensity = random_state.uniform(0.1, 1, [self.event_count, self.event_count]).astype(
+                self.real_dtype)
         else:
             pass
 
@@ -103,20 +165,92 @@ class Hawkes(object):
 
         when initialize auxiliary variable, we assume the value of all entries in a list are same
 
-        :return: auxiliary_map, data structure { id : { event_no: [auxiliary_map_i]}}
-        auxiliary_map_i [1-st triggered, ..., base triggered]
-        """
-        auxiliary_map = {}
-        for sequence_id in self.training_data:
-            auxiliary_event_map = {}
-            list_length = len(self.training_data[sequence_id])
-            for i in range(0, list_length):
-                single_event_auxiliary_list = []
-                for j in range(-1, i):
-                    single_event_auxiliary_list.append(1 / (i + 1))
-                auxiliary_event_map[i] = single_event_auxiliary_list
-            auxiliary_map[sequence_id] = auxiliary_event_map
-        return auxiliary_map
+        :return: auxiliary_map, an array backed read-only mapping { id : { event_no: [auxiliary_map_i]}}
+        auxiliary_map_i [1-st triggered, ..., base triggered], consult AuxiliaryVariable for the memory layout
+        """
+        return AuxiliaryVariable(self.packed_training_data, self.real_dtype)
+
+    @property
+    def training_data(self):
+        return self.__training_data
+
+    @training_data.setter
+    def training_data(self, training_data):
+        """
+        replacing the training data invalidates the packed training data, the auxiliary variables, the statistics of
+        the last E step, the sparse structure and the spectral caches, they are rebuilt here
+        """
+        self.__training_data = training_data
+        self.packed_training_data = PackedSequence(training_data)
+        self.auxiliary_variable = None
+        self.expectation_statistic = None
+        self.stochastic_statistic = None
+        if self.sparse_structure is not None:
+            mutual_intensity = self.mutual_intensity_dense()
+            self.sparse_structure = SparseMutualIntensity.from_packed_sequence(self.packed_training_data,
+                                                                               self.event_count)
+            self.mutual_intensity = self.sparse_structure.from_dense(mutual_intensity, self.real_dtype)
+        if self.excite_kernel == 'fourier' or self.excite_kernel == 'Fourier':
+            self.count_of_each_slot = self.event_count_of_each_slot_function()
+            self.count_of_each_event = self.event_count_of_each_event_function()
+            self.y_omega = self.y_omega_calculate()
+            self.k_omega_cache = self.k_omega_cache_calculate()
+            self.k_omega = self.k_omega_update()
+
+    @property
+    def test_data(self):
+        return self.__test_data
+
+    @test_data.setter
+    def test_data(self, test_data):
+        self.__test_data = test_data
+        self.packed_test_data = PackedSequence(test_data)
+
+    @property
+    def auxiliary_variable(self):
+        if self.__auxiliary_variable is None:
+            self.__auxiliary_variable = self.initialize_auxiliary_variable()
+        if self.__auxiliary_stale:
+            base_intensity, mutual_intensity, time_decay = self.expectation_parameter
+            em_engine.expectation(base_intensity, mutual_intensity, time_decay, self.packed_training_data,
+                                  self.__auxiliary_variable)
+            self.__auxiliary_stale = False
+        return self.__auxiliary_variable
+
+    @auxiliary_variable.setter
+    def auxiliary_variable(self, auxiliary_variable):
+        self.__auxiliary_variable = auxiliary_variable
+        self.__auxiliary_stale = False
+
+    def mutual_intensity_dense(self):
+        """
+        :return: [event_count, event_count] mutual intensity, the entries which are not stored in sparse mode are 0
+        """
+        if self.sparse_structure is not None:
+            return self.mutual_intensity.to_dense()
+        return self.mutual_intensity
+
+    def parameter_vector(self, base_intensity=None, mutual_intensity=None):
+        """
+        :return: the base intensity and the stored mutual intensity (the current ones if they are None) in one flat
+        vector
+        """
+        base_intensity = self.base_intensity if base_intensity is None else base_intensity
+        mutual_intensity = self.mutual_intensity if mutual_intensity is None else mutual_intensity
+        if self.sparse_structure is not None:
+            mutual_intensity = mutual_intensity.data
+        return np.concatenate([base_intensity.ravel(), mutual_intensity.ravel()])
+
+    def assign_parameter_vector(self, parameter):
+        """
+        the inverse of parameter_vector
+        """
+        event_count = self.event_count
+        self.base_intensity = parameter[0: event_count].reshape([event_count, 1])
+        if self.sparse_structure is not None:
+            self.mutual_intensity = self.sparse_structure.with_data(parameter[event_count:])
+        else:
+            self.mutual_intensity = parameter[event_count:].reshape([event_count, event_count])
 
     def event_count_of_each_event_function(self):
         count_vector = np.zeros([self.event_count, 1])
@@ -147,32 +281,30 @@ class Hawkes(object):
 
     # update y, k_omega
     def k_omega_cache_calculate(self):
-        cache = np.zeros([self.event_count, self.time_slot], dtype=np.complex64)
-        omega = np.arange(0, 2 * np.pi, 2 * np.pi / self.time_slot)
-        for j in self.training_data:
-            for item in self.training_data[j]:
-                event_index = item[0]
-                event_time = item[1]
-                cache[event_index] += np.exp(-1 * complex(0, 1) * omega * event_time)
-        return cache
+        """
+        cache[u, k] = sum of exp(-i * omega_k * t) over all events of type u. As event time is an integer,
+        exp(-i * omega_k * t) only depends on t mod time_slot, thus the cache is the FFT of the histogram of
+        (event type, event time mod time_slot), and each distinct (event_index, event_time) is counted only once
+        """
+        packed = self.packed_training_data
+        slot_time = packed.event_time % self.time_slot
+        histogram = np.bincount(packed.event_index * self.time_slot + slot_time,
+                                minlength=self.event_count * self.time_slot)
+        histogram = histogram.reshape([self.event_count, self.time_slot])
+        cache = np.fft.fft(histogram, axis=1)
+        return cache.astype(np.complex64)
 
     def k_omega_update(self):
-        # calculate denominator
+        # calculate denominator, sum(alpha * count) = column sum . count, sum(cache . alpha) = cache . row sum
         k_denominator = np.zeros([self.time_slot, 1], dtype=np.complex64)
-        for k in range(0, self.time_slot):
-            if k == 0:
-                mutual_in = self.mutual_intensity
-                count_event = self.count_of_each_event
-                denominator = np.matmul(mutual_in, count_event).sum()
-                k_denominator[k][0] = denominator
-            else:
-                cache = self.k_omega_cache[:, k]
-                mutual = self.mutual_intensity
-                k_denominator[k][0] = np.dot(cache, mutual).sum()
+        column_sum = self.mutual_intensity.sum(axis=0, dtype=np.float64)
+        row_sum = self.mutual_intensity.sum(axis=1, dtype=np.float64)
+        k_denominator[0][0] = np.dot(column_sum, self.count_of_each_event[:, 0])
+        k_denominator[1:, 0] = np.dot(row_sum, self.k_omega_cache[:, 1:])
         k_nominator = np.zeros([self.time_slot, 1], dtype=np.complex64)
         for k in range(0, self.time_slot):
             if k == 0:
-                k_nominator[k][0] = self.y_omega[k][0] - np.pi * 2 * self.base_intensity.sum()
+                k_nominator[k][0] = self.y_omega[k][0] - np.pi * 2 * self.base_intensity.sum(dtype=np.float64)
             else:
                 k_nominator[k][0] = self.y_omega[k][0]
 
@@ -180,14 +312,11 @@ class Hawkes(object):
         return k_nominator / k_denominator
 
     def y_omega_calculate(self):
-        y_omega = np.zeros([self.time_slot, 1], dtype=np.complex128)
-        for k in range(0, self.time_slot):
-            omega_k = 2 * math.pi / self.time_slot * k
-            y_omega_k = 0
-            for i in range(0, self.time_slot):
-                y_omega_k += np.exp(-1 * omega_k * i * complex(0, 1)) * self.count_of_each_slot[i]
-            y_omega[k][0] = y_omega_k
-        return y_omega
+        """
+        y_omega_k = sum_i exp(-i * omega_k * i) * count_of_each_slot_i, i.e., the FFT of the slot histogram
+        """
+        y_omega = np.fft.fft(self.count_of_each_slot[:, 0])
+        return y_omega[:, np.newaxis].astype(self.complex_dtype)
 
     # EM Algorithm
     def maximization_step(self):
@@ -195,62 +324,79 @@ class Hawkes(object):
         self.alpha_denominator_update()
         self.mu_nominator_update()
         self.mu_denominator_update()
-        self.mutual_intensity = self.alpha_nominator_matrix / self.alpha_denominator_matrix
-        self.base_intensity = self.mu_nominator_vector / self.mu_denominator_vector
+        self.mutual_intensity = (self.alpha_nominator_matrix / self.alpha_denominator_matrix).astype(self.real_dtype)
+        if self.sparse_structure is not None:
+            self.mutual_intensity = self.sparse_structure.with_data(self.mutual_intensity)
+        self.base_intensity = (self.mu_nominator_vector / self.mu_denominator_vector).astype(self.real_dtype)
 
     def alpha_nominator_update(self):
-        alpha_matrix = np.zeros([self.event_count, self.event_count])
-        data_source = self.training_data
-        for j in data_source:
-            list_length = len(data_source[j])
-            for i in range(1, list_length):
-                for k in range(0, i):
-                    i_event_index = data_source[j][i][0]
-                    k_event_index = data_source[j][k][0]
-                    alpha_matrix[i_event_index][k_event_index] += self.auxiliary_variable[j][i][k]
-        self.alpha_nominator_matrix = alpha_matrix
+        if self.expectation_statistic is not None:
+            _, responsibility = self.expectation_statistic
+            self.alpha_nominator_matrix = self.expectation_parameter[1] * responsibility
+        elif self.truncation_width is None:
+            self.alpha_nominator_matrix = em_engine.alpha_nominator(self.auxiliary_variable,
+                                                                    self.packed_training_data, self.event_count,
+                                                                    self.sparse_structure)
+        else:
+            self.alpha_nominator_matrix = em_engine.window_alpha_nominator(self.auxiliary_variable,
+                                                                           self.packed_training_data,
+                                                                           self.event_count, self.truncation_width,
+                                                                           self.sparse_structure)
 
     def alpha_denominator_update(self):
-        alpha_matrix = np.zeros([self.event_count, self.event_count])
-        for j in self.training_data:
-            event_list = self.training_data[j]
-            # for numerical stability, we add 1
-            last_event_time = event_list[-1][1] + 1
-            for l in range(0, self.event_count):
-                for k in range(0, len(event_list)):
-                    k_event_index = event_list[k][0]
-                    k_event_time = event_list[k][1]
-                    integral = self.discrete_time_integral[last_event_time - k_event_time]
-                    alpha_matrix[l][k_event_index] += integral
-        self.alpha_denominator_matrix = alpha_matrix
+        self.alpha_denominator_matrix = em_engine.alpha_denominator(self.discrete_time_integral,
+                                                                    self.packed_training_data, self.event_count,
+                                                                    self.sparse_structure)
 
     def mu_nominator_update(self):
-        nominator = np.zeros([self.event_count, 1])
-        for j in self.training_data:
-            event_list = self.training_data[j]
-            for i in range(0, len(event_list)):
-                i_event_index = event_list[i][0]
-                nominator[i_event_index][0] += self.auxiliary_variable[j][i][i]
-        self.mu_nominator_vector = nominator
+        if self.expectation_statistic is not None:
+            intensity, _ = self.expectation_statistic
+            packed = self.packed_training_data
+            nominator = np.bincount(packed.event_index, weights=1 / intensity, minlength=self.event_count)
+            self.mu_nominator_vector = self.expectation_parameter[0] * nominator[:, np.newaxis]
+        else:
+            self.mu_nominator_vector = em_engine.mu_nominator(self.auxiliary_variable, self.packed_training_data,
+                                                              self.event_count)
 
     def mu_denominator_update(self):
-        denominator = 0
-        for j in self.training_data:
-            event_list = self.training_data[j]
-            first_time = event_list[0][1]
-            last_time = event_list[-1][1]
-            denominator += last_time - first_time
-        self.mu_denominator_vector = denominator
+        self.mu_denominator_vector = em_engine.mu_denominator(self.packed_training_data)
+
+    def sharded_expectation_maximization_step(self, sharded_em):
+        """
+        the auxiliary variables are kept by the workers of sharded_em, they are collected after optimization
+        """
+        self.alpha_nominator_matrix, self.alpha_denominator_matrix, self.mu_nominator_vector, \
+            self.mu_denominator_vector = sharded_em.step(self.base_intensity, self.mutual_intensity,
+                                                         self.discrete_time_decay, self.discrete_time_integral)
+        self.auxiliary_variable_denominator = None
+        self.mutual_intensity = (self.alpha_nominator_matrix / self.alpha_denominator_matrix).astype(self.real_dtype)
+        self.base_intensity = (self.mu_nominator_vector / self.mu_denominator_vector).astype(self.real_dtype)
 
     # E Step
     def expectation_step(self):
-        self.auxiliary_variable_denominator_update()
-        for j in self.training_data:
-            list_length = len(self.training_data[j])
-            for i in range(0, list_length):
-                for l in range(0, i):
-                    self.auxiliary_variable[j][i][l] = self.calculate_q_il(j=j, i=i, _l=l)
-                self.auxiliary_variable[j][i][i] = self.calculate_q_ii(j=j, i=i)
+        """
+        the auxiliary variables of a whole bucket of equal length sequences are calculated together by
+        em_engine.auxiliary_probability. If exp_recursion is enabled, only the event intensities and the statistics
+        of the M step are calculated, the auxiliary variables are materialized lazily
+        """
+        packed = self.packed_training_data
+        self.expectation_statistic = None
+        if self.exp_recursion:
+            self.expectation_parameter = (self.base_intensity, self.mutual_intensity, self.discrete_time_decay)
+            self.expectation_statistic = em_engine.exp_recursive_statistic(self.base_intensity,
+                                                                           self.mutual_intensity, self.omega, packed)
+            self.__auxiliary_stale = True
+            intensity = self.expectation_statistic[0]
+            denominator_map = {p: intensity[packed.offset[p]: packed.offset[p + 1]]
+                               for p in range(0, packed.sequence_count)}
+        elif self.truncation_width is None:
+            denominator_map = em_engine.expectation(self.base_intensity, self.mutual_intensity,
+                                                    self.discrete_time_decay, packed, self.auxiliary_variable)
+        else:
+            denominator_map = em_engine.window_expectation(self.base_intensity, self.mutual_intensity,
+                                                           self.discrete_time_decay, packed, self.auxiliary_variable,
+                                                           self.truncation_width)
+        self.auxiliary_variable_denominator = {packed.sequence_id_list[p]: denominator_map[p] for p in denominator_map}
 
     def calculate_q_il(self, j, i, _l):
         """
@@ -266,7 +412,7 @@ class Hawkes(object):
         i_event_time = event_list[i][1]
         l_event_index = event_list[_l][0]
         l_event_time = event_list[_l][1]
-        alpha = self.mutual_intensity[i_event_index][l_event_index]
+        alpha = self.mutual_intensity[i_event_index, l_event_index]
         kernel = self.discrete_time_decay[i_event_time - l_event_time]
 
         nominator = alpha * kernel
@@ -288,24 +434,14 @@ class Hawkes(object):
         return q_ii
 
     def auxiliary_variable_denominator_update(self):
+        packed = self.packed_training_data
         denominator_map = {}
-        for j in self.training_data:
-            event_list = self.training_data[j]
-            single_denominator_map = {}
-            for i in range(0, len(event_list)):
-                i_event_index = event_list[i][0]
-                i_event_time = event_list[i][1]
-
-                denominator = 0
-                denominator += self.base_intensity[i_event_index][0]
-                for l in range(0, i):
-                    l_event_index = event_list[l][0]
-                    l_event_time = event_list[l][1]
-                    alpha = self.mutual_intensity[i_event_index][l_event_index]
-                    kernel = self.discrete_time_decay[i_event_time - l_event_time]
-                    denominator += alpha * kernel
-                single_denominator_map[i] = denominator
-            denominator_map[j] = single_denominator_map
+        for positions, index_matrix, lag_matrix in packed.lag_bucket():
+            excitation = em_engine.excitation_matrix(self.mutual_intensity, self.discrete_time_decay, index_matrix,
+                                                     lag_matrix)
+            denominator = self.base_intensity[index_matrix, 0] + excitation.sum(axis=2)
+            for b in range(0, len(positions)):
+                denominator_map[packed.sequence_id_list[positions[b]]] = denominator[b]
 
         self.auxiliary_variable_denominator = denominator_map
 
@@ -318,9 +454,8 @@ class Hawkes(object):
             kernel_value = np.exp(-1 * omega * (late_event_time - early_event_time))
             return kernel_value
         elif kernel_type == 'fourier' or kernel_type == 'Fourier':
-            exp = np.exp(complex(0, 1) * (late_event_time - early_event_time) * np.arange(0, 2 * np.pi,
-                                                                                          2 * np.pi / self.time_slot))
-            kappa = (exp * self.k_omega).sum()
+            exp = np.exp(complex(0, 1) * (late_event_time - early_event_time) * self.kernel_table.omega)
+            kappa = (exp * self.k_omega[:, 0]).sum()
             return abs(kappa)
         else:
             raise RuntimeError('illegal kernel name')
@@ -340,8 +475,8 @@ class Hawkes(object):
             # the calculate equations are different when k=0
 
             # for k>0
-            omega = np.arange(2 * np.pi / self.time_slot, 2 * np.pi, 2 * np.pi / self.time_slot)
-            first = self.k_omega[1:, ]
+            omega = self.kernel_table.omega[1:]
+            first = self.k_omega[1:, 0]
             middle = complex(0, 1) / omega
             last = 1 - np.exp(complex(0, 1) * omega * (upper_bound - lower_bound))
             kernel_integral = (first * middle * last).sum()
@@ -352,39 +487,79 @@ class Hawkes(object):
         else:
             raise RuntimeError('illegal kernel name')
 
-    def optimization(self, iteration):
+    def optimization(self, iteration, processes=1, chunk_size=256, tolerance=None, parameter_tolerance=None,
+                     patience=None, checkpoint_path=None, checkpoint_interval=1, acceleration=None,
+                     squarem_tolerance=1e-6):
+        """
+        :param iteration: the total iteration count, a model resumed from a checkpoint continues from the iteration
+        of the checkpoint
+        :param processes: if processes > 1, the E step and the sufficient statistics of the M step are calculated
+        by ShardedEM in worker processes
+        :param chunk_size: sequence count of a chunk in sharded mode
+        :param tolerance: stop if the relative change of train log likelihood is smaller than tolerance
+        :param parameter_tolerance: stop if the largest change of base intensity and mutual intensity, relative to
+        the largest parameter, is smaller than parameter_tolerance
+        :param patience: stop if the test log likelihood is not improved in patience consecutive iterations
+        :param checkpoint_path: if it is not None, the model is saved to checkpoint_path (.npz) every
+        checkpoint_interval iterations and when optimization stops, consult save_checkpoint
+        :param checkpoint_interval:
+        :param acceleration: None or 'squarem'. If it is 'squarem', every iteration is a SQUAREM extrapolation of two
+        EM updates, consult squarem_step
+        :param squarem_tolerance: relative decrease of train log likelihood accepted by squarem_step
+        """
+        if acceleration is not None and acceleration != 'squarem':
+            raise RuntimeError('illegal acceleration')
+        sharded_em = None
+        if processes > 1 and self.truncation is not None:
+            raise RuntimeError('sharded mode does not support kernel truncation')
+        if processes > 1 and self.sparse_structure is not None:
+            raise RuntimeError('sharded mode does not support sparse mutual intensity')
+        if processes > 1:
+            sharded_em = ShardedEM(self.training_data, self.event_count, self.max_day, processes, chunk_size)
+        try:
+            self.__optimization(iteration, sharded_em, tolerance, parameter_tolerance, patience, checkpoint_path,
+                                checkpoint_interval, acceleration, squarem_tolerance)
+            if sharded_em is not None:
+                self.auxiliary_variable.buffer[:] = sharded_em.auxiliary_buffer()
+        finally:
+            if sharded_em is not None:
+                sharded_em.close()
+        if checkpoint_path is not None:
+            self.save_checkpoint(checkpoint_path)
+        print("optimization accomplished")
 
-        # initialize likelihood
-        update_time_decay_start = datetime.datetime.now()
-        self.update_discrete_time_decay_function()
-        self.update_discrete_integral_function()
-        update_time_decay_end = datetime.datetime.now()
-        likelihood_star_time = datetime.datetime.now()
-        train_log_likelihood = self.log_likelihood_calculate(self.training_data)
-        test_log_likelihood = self.log_likelihood_calculate(self.test_data)
-        likelihood_end_time = datetime.datetime.now()
-        likelihood_time = str((likelihood_end_time - likelihood_star_time).seconds)
-        update_time_decay = str((update_time_decay_end - update_time_decay_start).seconds)
-
-        self.train_log_likelihood_tendency.append(train_log_likelihood)
-        self.test_log_likelihood_tendency.append(test_log_likelihood)
-        print(self.excite_kernel + "_" + 'iteration: ' + str(0) + ',test likelihood = ' +
-              str(test_log_likelihood) + ',train likelihood = ' + str(train_log_likelihood) + " optimize time " +
-              "None" + " seconds. likelihood time " + likelihood_time + " seconds. update time: " +
-              update_time_decay + "seconds")
-
-        for i in range(1, iteration + 1):
-            # EM Algorithm
-            if self.excite_kernel == 'fourier' or self.excite_kernel == 'Fourier':
-                self.k_omega_update()
+    def __optimization(self, iteration, sharded_em, tolerance, parameter_tolerance, patience, checkpoint_path,
+                       checkpoint_interval, acceleration, squarem_tolerance):
+        if self.iteration_count == 0:
+            # initialize likelihood
             update_time_decay_start = datetime.datetime.now()
             self.update_discrete_time_decay_function()
             self.update_discrete_integral_function()
             update_time_decay_end = datetime.datetime.now()
+            likelihood_star_time = datetime.datetime.now()
+            train_log_likelihood = self.log_likelihood_calculate(self.training_data)
+            test_log_likelihood = self.log_likelihood_calculate(self.test_data)
+            likelihood_end_time = datetime.datetime.now()
+            likelihood_time = str((likelihood_end_time - likelihood_star_time).seconds)
+            update_time_decay = str((update_time_decay_end - update_time_decay_start).seconds)
+
+            self.train_log_likelihood_tendency.append(train_log_likelihood)
+            self.test_log_likelihood_tendency.append(test_log_likelihood)
+            print(self.excite_kernel + "_" + 'iteration: ' + str(0) + ',test likelihood = ' +
+                  str(test_log_likelihood) + ',train likelihood = ' + str(train_log_likelihood) +
+                  " optimize time " + "None" + " seconds. likelihood time " + likelihood_time +
+                  " seconds. update time: " + update_time_decay + "seconds")
+
+        for i in range(self.iteration_count + 1, iteration + 1):
+            previous_base_intensity = self.base_intensity
+            previous_mutual_intensity = self.mutual_intensity
 
+            # EM Algorithm
             optimize_start_time = datetime.datetime.now()
-            self.expectation_step()
-            self.maximization_step()
+            if acceleration == 'squarem':
+                update_time_decay = self.squarem_step(sharded_em, squarem_tolerance)
+            else:
+                update_time_decay = self.em_map(sharded_em)
             optimize_end_time = datetime.datetime.now()
 
             likelihood_star_time = datetime.datetime.now()
@@ -392,42 +567,389 @@ class Hawkes(object):
             test_log_likelihood = self.log_likelihood_calculate(self.test_data)
             likelihood_end_time = datetime.datetime.now()
 
-            optimize_time = str((optimize_end_time - optimize_start_time).seconds)
+            optimize_time = str((optimize_end_time - optimize_start_time - update_time_decay).seconds)
             likelihood_time = str((likelihood_end_time - likelihood_star_time).seconds)
-            update_time_decay = str((update_time_decay_end - update_time_decay_start).seconds)
+            update_time_decay = str(update_time_decay.seconds)
             self.train_log_likelihood_tendency.append(train_log_likelihood)
             self.test_log_likelihood_tendency.append(test_log_likelihood)
+            self.iteration_count = i
             print(self.excite_kernel + "_" + 'iteration: ' + str(i) + ',test likelihood = ' +
                   str(test_log_likelihood) + ',train likelihood = ' + str(train_log_likelihood) + " optimize time " +
                   optimize_time + " seconds. likelihood time " + likelihood_time + " seconds. update time: " +
                   update_time_decay + "seconds")
 
-        print("optimization accomplished")
+            if checkpoint_path is not None and i % checkpoint_interval == 0:
+                self.save_checkpoint(checkpoint_path)
+            stop_reason = self.stop_criterion(previous_base_intensity, previous_mutual_intensity, tolerance,
+                                              parameter_tolerance, patience)
+            if stop_reason is not None:
+                print(self.excite_kernel + "_" + 'early stop at iteration ' + str(i) + ', ' + stop_reason)
+                break
+
+    def stochastic_optimization(self, step, batch_size, forgetting_rate=0.6, delay=1, seed=0,
+                                evaluation_interval=None):
+        """
+        stochastic (online) EM, Cappe and Moulines (2009). Every step draws a mini-batch of sequences (without
+        replacement, a new permutation every epoch), calculates the sufficient statistics of the M step on the
+        mini-batch, scales them to the size of the training data and updates the running statistics
+        s = (1 - rho_t) * s + rho_t * s_batch, rho_t = (t + delay) ^ -forgetting_rate (rho_1 = 1). The parameters
+        are the M step of the running statistics, and the auxiliary variables of a mini-batch are discarded after
+        use, thus the memory of E step is bounded by batch_size
+        :param step: the total step count, the step count is recorded in iteration_count
+        :param batch_size: sequence count of a mini-batch
+        :param forgetting_rate: in (0.5, 1]
+        :param delay:
+        :param seed: seed of the mini-batch sampling
+        :param evaluation_interval: the train and test log likelihood are calculated every evaluation_interval steps
+        and at the last step, one epoch by default
+        """
+        if not 0.5 < forgetting_rate <= 1:
+            raise RuntimeError('illegal forgetting rate')
+        if batch_size < 1:
+            raise RuntimeError('illegal batch size')
+        sequence_id_list = self.packed_training_data.sequence_id_list
+        sequence_count = len(sequence_id_list)
+        batch_count = (sequence_count + batch_size - 1) // batch_size
+        if evaluation_interval is None:
+            evaluation_interval = batch_count
+        random_state = np.random.RandomState(seed)
+
+        self.update_discrete_time_decay_function()
+        self.update_discrete_integral_function()
+        if self.iteration_count == 0:
+            self.train_log_likelihood_tendency.append(self.log_likelihood_calculate(self.training_data))
+            self.test_log_likelihood_tendency.append(self.log_likelihood_calculate(self.test_data))
+
+        statistic = self.stochastic_statistic
+        permutation = []
+        for t in range(self.iteration_count + 1, step + 1):
+            if len(permutation) == 0:
+                permutation = list(random_state.permutation(sequence_count))
+            batch = permutation[0: batch_size]
+            permutation = permutation[batch_size:]
+
+            if self.excite_kernel == 'fourier' or self.excite_kernel == 'Fourier':
+                self.k_omega_update()
+            self.update_discrete_time_decay_function()
+            self.update_discrete_integral_function()
+            batch_data = {sequence_id_list[p]: self.training_data[sequence_id_list[p]] for p in batch}
+            batch_statistic = [item * (sequence_count / len(batch)) for item in self.batch_statistic(batch_data)]
+            rho = 1. if statistic is None else (t + delay) ** (-1 * forgetting_rate)
+            if statistic is None:
+                statistic = batch_statistic
+            else:
+                statistic = [(1 - rho) * statistic[k] + rho * batch_statistic[k] for k in range(0, 4)]
+            self.stochastic_maximization_step(statistic)
+            self.stochastic_statistic = statistic
+            self.iteration_count = t
+
+            if t % evaluation_interval == 0 or t == step:
+                train_log_likelihood = self.log_likelihood_calculate(self.training_data)
+                test_log_likelihood = self.log_likelihood_calculate(self.test_data)
+                self.train_log_likelihood_tendency.append(train_log_likelihood)
+                self.test_log_likelihood_tendency.append(test_log_likelihood)
+                print(self.excite_kernel + "_" + 'step: ' + str(t) + ',test likelihood = ' +
+                      str(test_log_likelihood) + ',train likelihood = ' + str(train_log_likelihood) +
+                      ', step size ' + str(rho))
+        print("stochastic optimization accomplished")
+
+    def batch_statistic(self, batch_data):
+        """
+        the E step on a mini-batch, the auxiliary variables are only kept in this function
+        :return: alpha nominator, alpha denominator, mu nominator, mu denominator of batch_data
+        """
+        packed = PackedSequence(batch_data)
+        if self.exp_recursion:
+            intensity, responsibility = em_engine.exp_recursive_statistic(self.base_intensity, self.mutual_intensity,
+                                                                          self.omega, packed)
+            alpha_nominator = self.mutual_intensity * responsibility
+            nominator = np.bincount(packed.event_index, weights=1 / intensity, minlength=self.event_count)
+            mu_nominator = self.base_intensity * nominator[:, np.newaxis]
+        else:
+            auxiliary_variable = AuxiliaryVariable(packed, self.real_dtype)
+            if self.truncation_width is None:
+                em_engine.expectation(self.base_intensity, self.mutual_intensity, self.discrete_time_decay, packed,
+                                      auxiliary_variable)
+                alpha_nominator = em_engine.alpha_nominator(auxiliary_variable, packed, self.event_count,
+                                                            self.sparse_structure)
+            else:
+                em_engine.window_expectation(self.base_intensity, self.mutual_intensity, self.discrete_time_decay,
+                                             packed, auxiliary_variable, self.truncation_width)
+                alpha_nominator = em_engine.window_alpha_nominator(auxiliary_variable, packed, self.event_count,
+                                                                   self.truncation_width, self.sparse_structure)
+            mu_nominator = em_engine.mu_nominator(auxiliary_variable, packed, self.event_count)
+        alpha_denominator = em_engine.alpha_denominator(self.discrete_time_integral, packed, self.event_count,
+                                                        self.sparse_structure)
+        return alpha_nominator, alpha_denominator, mu_nominator, em_engine.mu_denominator(packed)
+
+    def stochastic_maximization_step(self, statistic):
+        """
+        the M step of the running statistics, the parameters whose denominator is still 0 (no event of the type has
+        been sampled) are not changed
+        """
+        alpha_nominator, alpha_denominator, mu_nominator, mu_denominator = statistic
+        previous_mutual_intensity = self.mutual_intensity
+        if self.sparse_structure is not None:
+            previous_mutual_intensity = previous_mutual_intensity.data
+        mutual_intensity = np.where(alpha_denominator > 0,
+                                    alpha_nominator / np.where(alpha_denominator > 0, alpha_denominator, 1),
+                                    previous_mutual_intensity).astype(self.real_dtype)
+        if self.sparse_structure is not None:
+            mutual_intensity = self.sparse_structure.with_data(mutual_intensity)
+        self.mutual_intensity = mutual_intensity
+        if mu_denominator > 0:
+            self.base_intensity = (mu_nominator / mu_denominator).astype(self.real_dtype)
+
+    def em_map(self, sharded_em=None):
+        """
+        one EM update of base intensity and mutual intensity, the kernel tables are updated at first
+        :return: the time spent on kernel table update
+        """
+        if self.excite_kernel == 'fourier' or self.excite_kernel == 'Fourier':
+            self.k_omega_update()
+        update_time_decay_start = datetime.datetime.now()
+        self.update_discrete_time_decay_function()
+        self.update_discrete_integral_function()
+        update_time_decay_end = datetime.datetime.now()
+
+        if sharded_em is None:
+            self.expectation_step()
+            self.maximization_step()
+        else:
+            self.sharded_expectation_maximization_step(sharded_em)
+        self.em_map_count += 1
+        return update_time_decay_end - update_time_decay_start
+
+    def squarem_step(self, sharded_em=None, tolerance=1e-6):
+        """
+        SQUAREM (Varadhan and Roland, 2008) extrapolation of the EM map F, theta = (base intensity, mutual intensity)
+        theta_1 = F(theta_0), theta_2 = F(theta_1), r = theta_1 - theta_0, v = theta_2 - 2 * theta_1 + theta_0,
+        theta' = theta_0 - 2 * a * r + a^2 * v with a = -|r| / |v|, then theta' is stabilized by one more EM update.
+        The extrapolation is projected to positive parameters. If the train log likelihood of the stabilized theta'
+        is smaller than the one of theta_0 by more than tolerance * |log likelihood of theta_0|, the step falls back
+        to the plain EM result theta_2, and all states derived from the rejected theta' (k_omega, kernel tables,
+        statistics of the E step and the auxiliary variables) are rebuilt as they were after F(theta_1).
+        As in the SQUAREM package, a small tolerance is allowed because the log likelihood is not monotone along the
+        EM map of this model near its fixed point (the alpha denominator adds 1 day to the observation window)
+        :return: the time spent on kernel table update
+        """
+        theta_0 = self.parameter_vector()
+        if len(self.train_log_likelihood_tendency) > 0:
+            # optimization records the train log likelihood of the current parameters before every step
+            start_log_likelihood = self.train_log_likelihood_tendency[-1]
+        else:
+            start_log_likelihood = self.log_likelihood_calculate(self.training_data)
+        update_time = self.em_map(sharded_em)
+        theta_1 = self.parameter_vector()
+        theta_1_intensity = self.base_intensity, self.mutual_intensity
+        update_time += self.em_map(sharded_em)
+        theta_2 = self.parameter_vector()
+        # the kernel tables of F(theta_1) are calculated from theta_1
+        table_state = (getattr(self, 'k_omega', None), self.discrete_time_decay, self.discrete_time_integral)
+
+        r = theta_1 - theta_0
+        v = theta_2 - 2 * theta_1 + theta_0
+        if np.dot(v, v) == 0:
+            return update_time
+        step = min(-1., -1 * np.sqrt(np.dot(r, r) / np.dot(v, v)))
+        theta = np.maximum(theta_0 - 2 * step * r + step * step * v, 1e-10)
+
+        self.assign_parameter_vector(theta)
+        update_time += self.em_map(sharded_em)
+        log_likelihood = self.log_likelihood_calculate(self.training_data)
+        if not log_likelihood >= start_log_likelihood - tolerance * abs(start_log_likelihood):
+            # replay F(theta_1) on the kernel tables of theta_1, the result is theta_2
+            k_omega, self.discrete_time_decay, self.discrete_time_integral = table_state
+            if k_omega is not None:
+                self.k_omega = k_omega
+            self.base_intensity, self.mutual_intensity = theta_1_intensity
+            if sharded_em is None:
+                self.expectation_step()
+                self.maximization_step()
+            else:
+                self.sharded_expectation_maximization_step(sharded_em)
+        return update_time
+
+    def stop_criterion(self, previous_base_intensity, previous_mutual_intensity, tolerance, parameter_tolerance,
+                       patience):
+        """
+        :return: the reason of early stopping, None if optimization should continue
+        """
+        train = self.train_log_likelihood_tendency
+        if tolerance is not None and len(train) > 1:
+            relative_change = abs(train[-1] - train[-2]) / abs(train[-2])
+            if relative_change < tolerance:
+                return 'relative change of train log likelihood ' + str(relative_change)
+
+        if parameter_tolerance is not None:
+            previous_parameter = self.parameter_vector(previous_base_intensity, previous_mutual_intensity)
+            change = np.abs(self.parameter_vector() - previous_parameter).max()
+            scale = np.abs(previous_parameter).max()
+            if change / scale < parameter_tolerance:
+                return 'relative change of parameter ' + str(change / scale)
+
+        test = self.test_log_likelihood_tendency
+        if patience is not None and len(test) - 1 - int(np.argmax(test)) >= patience:
+            return 'test log likelihood is not improved in ' + str(patience) + ' iterations'
+        return None
+
+    def save_checkpoint(self, checkpoint_path):
+        """
+        save the parameters and the iteration state to a compressed npz file, the file is replaced atomically
+        """
+        k_omega = self.k_omega if hasattr(self, 'k_omega') else np.zeros([0, 1], dtype=np.complex64)
+        temp_path = checkpoint_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(f, base_intensity=self.base_intensity, mutual_intensity=self.mutual_intensity_dense(),
+                                k_omega=k_omega, iteration_count=self.iteration_count,
+                                em_map_count=self.em_map_count,
+                                train_log_likelihood_tendency=np.array(self.train_log_likelihood_tendency),
+                                test_log_likelihood_tendency=np.array(self.test_log_likelihood_tendency),
+                                kernel=self.excite_kernel, event_count=self.event_count,
+                                time_slot=-1 if self.time_slot is None else self.time_slot)
+        os.replace(temp_path, checkpoint_path)
+
+    def optimization_state(self):
+        """
+        :return: the parameters and the iteration state, which are restored by restore_optimization_state
+        """
+        return {'base_intensity': self.base_intensity, 'mutual_intensity': self.mutual_intensity,
+                'k_omega': self.k_omega if hasattr(self, 'k_omega') else None,
+                'iteration_count': self.iteration_count, 'em_map_count': self.em_map_count,
+                'train_log_likelihood_tendency': list(self.train_log_likelihood_tendency),
+                'test_log_likelihood_tendency': list(self.test_log_likelihood_tendency)}
+
+    def restore_optimization_state(self, state):
+        """
+        restore a state of optimization_state, the auxiliary variables and the statistics of the last E step do not
+        belong to the state, they are dropped
+        """
+        self.base_intensity = state['base_intensity']
+        self.mutual_intensity = state['mutual_intensity']
+        if state['k_omega'] is not None:
+            self.k_omega = state['k_omega']
+        self.iteration_count = state['iteration_count']
+        self.em_map_count = state['em_map_count']
+        self.train_log_likelihood_tendency = list(state['train_log_likelihood_tendency'])
+        self.test_log_likelihood_tendency = list(state['test_log_likelihood_tendency'])
+        self.auxiliary_variable = None
+        self.expectation_statistic = None
+        self.stochastic_statistic = None
+        self.update_discrete_time_decay_function()
+        self.update_discrete_integral_function()
+
+    def random_start_state(self, seed):
+        """
+        :return: the optimization state of a new random initialization, the draws do not touch the global random
+        generator
+        """
+        random_state = np.random.RandomState(seed)
+        state = {'base_intensity': self.initialize_base_intensity(random_state),
+                 'mutual_intensity': self.initialize_mutual_intensity(random_state),
+                 'k_omega': None, 'iteration_count': 0, 'em_map_count': 0,
+                 'train_log_likelihood_tendency': [], 'test_log_likelihood_tendency': []}
+        if self.excite_kernel == 'fourier' or self.excite_kernel == 'Fourier':
+            # k_omega_update reads the intensities and writes k_omega of the model
+            current = self.base_intensity, self.mutual_intensity, self.k_omega
+            self.base_intensity, self.mutual_intensity = state['base_intensity'], state['mutual_intensity']
+            state['k_omega'] = self.k_omega_update()
+            self.base_intensity, self.mutual_intensity, self.k_omega = current
+        return state
+
+    def multi_start_optimization(self, start_count, iteration, prune_iteration=None, keep_count=1, processes=1,
+                                 seed=0, optimization_option=None):
+        """
+        fit start_count random initializations and keep the best one by train log likelihood, consult
+        multi_start.multi_start_optimization
+        :return: {start_no: trace}, the trace of every start
+        """
+        return multi_start_optimization(self, start_count, iteration, prune_iteration, keep_count, processes, seed,
+                                        optimization_option)
+
+    def resume(self, checkpoint_path):
+        """
+        restore the parameters and the iteration state from a checkpoint, the following optimization continues from
+        the iteration of the checkpoint
+        """
+        with np.load(checkpoint_path) as checkpoint:
+            time_slot = -1 if self.time_slot is None else self.time_slot
+            if str(checkpoint['kernel']) != self.excite_kernel or int(checkpoint['event_count']) != \
+                    self.event_count or int(checkpoint['time_slot']) != time_slot:
+                raise RuntimeError('checkpoint incompatible')
+            self.base_intensity = checkpoint['base_intensity'].astype(self.real_dtype)
+            self.mutual_intensity = checkpoint['mutual_intensity'].astype(self.real_dtype)
+            if self.sparse_structure is not None:
+                self.mutual_intensity = self.sparse_structure.from_dense(self.mutual_intensity, self.real_dtype)
+            if self.excite_kernel == 'fourier' or self.excite_kernel == 'Fourier':
+                self.k_omega = checkpoint['k_omega']
+            self.iteration_count = int(checkpoint['iteration_count'])
+            # a checkpoint without the map count is written by plain EM, which applies one EM map per iteration
+            self.em_map_count = int(checkpoint['em_map_count']) if 'em_map_count' in checkpoint.files else \
+                self.iteration_count
+            self.train_log_likelihood_tendency = checkpoint['train_log_likelihood_tendency'].tolist()
+            self.test_log_likelihood_tendency = checkpoint['test_log_likelihood_tendency'].tolist()
+        self.update_discrete_time_decay_function()
+        self.update_discrete_integral_function()
+
+    # prediction
+    def conditional_intensity(self, history_list, query_time):
+        """
+        batch scoring API, the conditional intensity of every event type given partial histories, consult
+        em_engine.conditional_intensity. The current discrete kernel tables are reused, thus the query time is an
+        integer day and the events earlier than the query time by max_day or more are ignored
+        :param history_list: [[(event_index, event_time), ...], ...], a history may be empty
+        :param query_time: one query time for all histories, or a list of query time, one per history
+        :return: [B, event_count], the ranking of next event of history b is np.argsort(-intensity[b])
+        """
+        query = np.broadcast_to(np.floor(np.asarray(query_time)), [len(history_list)])[np.newaxis, :]
+        return self.__conditional_intensity(PackedSequence(dict(enumerate(history_list))), query)[0]
+
+    def conditional_intensity_grid(self, history_list, time_grid, relative=True):
+        """
+        evaluate the conditional intensity of all histories on a time grid in one call
+        :param history_list: [[(event_index, event_time), ...], ...]
+        :param time_grid: [G] query times. If relative is True, they are the offsets after the last event of every
+        history (after 0 for empty histories), otherwise they are absolute event times
+        :param relative:
+        :return: [G, B, event_count]
+        """
+        packed = PackedSequence(dict(enumerate(history_list)))
+        query = np.floor(np.asarray(time_grid))[:, np.newaxis] + np.zeros([1, len(history_list)])
+        if relative and len(packed.event_time) > 0:
+            last_event_time = packed.event_time[np.maximum(packed.offset[1:] - 1, 0)]
+            query += np.where(packed.length > 0, last_event_time, 0)[np.newaxis, :]
+        return self.__conditional_intensity(packed, query)
+
+    def __conditional_intensity(self, packed, query_time):
+        if self.discrete_time_decay is None:
+            self.update_discrete_time_decay_function()
+        return em_engine.conditional_intensity(self.base_intensity, self.mutual_intensity, self.discrete_time_decay,
+                                               packed, query_time)
 
     # calculate log-likelihood
     def log_likelihood_calculate(self, data_source):
         """
         according to eq. 6
-        calculate the log likelihood based on current parameter
+        calculate the log likelihood based on current parameter, consult em_engine.log_likelihood
         :return:
         """
-        log_likelihood = 0
-
-        # calculate part one of log-likelihood
-        # according to equation 6
-        for j in data_source:
-            list_length = len(data_source[j])
-
-            # part 1
-            for i in range(0, list_length):
-                part_one = self.part_one_calculate(j=j, i=i, data_source=data_source)
-                log_likelihood += part_one
-
-            # part 2
-            for u in range(0, self.event_count):
-                part_two = self.part_two_calculate(j=j, u=u, data_source=data_source)
-                log_likelihood -= part_two
-        return log_likelihood
+        if data_source is self.training_data:
+            packed = self.packed_training_data
+        elif data_source is self.test_data:
+            packed = self.packed_test_data
+        else:
+            packed = PackedSequence(data_source)
+        if self.exp_recursion:
+            intensity, _ = em_engine.exp_recursive_statistic(self.base_intensity, self.mutual_intensity, self.omega,
+                                                             packed)
+            return np.log(intensity).sum(dtype=np.float64) - em_engine.log_likelihood_part_two(
+                self.base_intensity, self.mutual_intensity, self.discrete_time_integral, packed)
+        if self.truncation_width is not None:
+            return em_engine.window_log_likelihood(self.base_intensity, self.mutual_intensity,
+                                                   self.discrete_time_decay, self.discrete_time_integral, packed,
+                                                   self.truncation_width)
+        return em_engine.log_likelihood(self.base_intensity, self.mutual_intensity, self.discrete_time_decay,
+                                        self.discrete_time_integral, packed)
 
     def part_one_calculate(self, j, i, data_source):
         """
@@ -448,7 +970,7 @@ class Hawkes(object):
             l_event_index = data_source[j][l][0]
             l_event_time = data_source[j][l][1]
 
-            alpha = self.mutual_intensity[i_event_index][l_event_index]
+            alpha = self.mutual_intensity[i_event_index, l_event_index]
             kernel = self.discrete_time_decay[i_event_time - l_event_time]
             part_one += alpha * kernel
 
@@ -474,27 +996,42 @@ class Hawkes(object):
 
             lower_bound = 0
             upper_bound = last_event_time - k_event_time
-            alpha = self.mutual_intensity[u][k_event_index]
+            alpha = self.mutual_intensity[u, k_event_index]
 
             part_two += alpha * self.discrete_time_integral[upper_bound - lower_bound]
 
         return part_two
 
     def update_discrete_time_decay_function(self):
-        discrete_function = []
-        for i in range(0, self.max_day):
-            intensity = self.kernel_calculate(0, i)
-            discrete_function.append(intensity)
-        discrete_function = np.array(discrete_function)
-        self.discrete_time_decay = discrete_function
+        kernel_type = self.excite_kernel
+        if kernel_type == 'default' or kernel_type == 'exp':
+            if self.omega is None:
+                raise RuntimeError('omega lost')
+            self.discrete_time_decay = self.kernel_table.exp_decay(self.omega).astype(self.real_dtype)
+        elif kernel_type == 'fourier' or kernel_type == 'Fourier':
+            self.discrete_time_decay = self.kernel_table.fourier_decay(self.k_omega).astype(self.real_dtype)
+        else:
+            raise RuntimeError('illegal kernel name')
+        if self.truncation is not None:
+            self.update_truncation_width()
+
+    def update_truncation_width(self):
+        width, max_dropped, dropped_share = em_engine.truncation_cutoff(self.discrete_time_decay, self.truncation)
+        if width != self.truncation_width:
+            print("kernel truncated at lag " + str(width) + " days, max dropped kernel value " + str(max_dropped) +
+                  ", dropped share of kernel table " + str(dropped_share))
+        self.truncation_width = width
 
     def update_discrete_integral_function(self):
-        discrete_integral_function = []
-        for i in range(0, self.max_day):
-            integral = self.kernel_integral(lower_bound=0, upper_bound=i)
-            discrete_integral_function.append(integral)
-        discrete_integral_function = np.array(discrete_integral_function)
-        self.discrete_time_integral = discrete_integral_function
+        kernel_type = self.excite_kernel
+        if kernel_type == 'default' or kernel_type == 'exp':
+            if self.omega is None:
+                raise RuntimeError('illegal hyper_parameter, omega lost')
+            self.discrete_time_integral = self.kernel_table.exp_integral(self.omega).astype(self.real_dtype)
+        elif kernel_type == 'fourier' or kernel_type == 'Fourier':
+            self.discrete_time_integral = self.kernel_table.fourier_integral(self.k_omega).astype(self.real_dtype)
+        else:
+            raise RuntimeError('illegal kernel name')
 
 
 def unit_test():
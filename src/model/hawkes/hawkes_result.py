@@ -0,0 +1,57 @@
+# coding=utf-8
+import os
+
+import numpy as np
+
+# increase it when the name, the shape or the meaning of a saved array changes
+RESULT_FORMAT_VERSION = 1
+
+# the arrays which only exist when the kernel is Fourier are saved as empty arrays for the exp kernel
+RESULT_ARRAY_LIST = ['mutual_intensity', 'base_intensity', 'train_log_likelihood_tendency',
+                     'test_log_likelihood_tendency', 'time_decay_function', 'time_decay_integral', 'k_omega',
+                     'y_omega', 'count_of_each_slot', 'count_of_each_event']
+
+
+def result_file_name(name_prefix):
+    return name_prefix + 'result.npz'
+
+
+def save_result_npz(return_data_map, file_path, name_prefix, metadata=None):
+    """
+    save the return map of hawkes_optimization to one uncompressed npz file, every matrix and vector is saved as a
+    numpy array, thus it is loaded without parsing. The file is replaced atomically, so an existing result file is
+    always complete
+    :param return_data_map: return of hawkes_model_eval.hawkes_optimization
+    :param file_path:
+    :param name_prefix:
+    :param metadata: {name: number or string}, e.g., the hyper-parameters of the run, saved with the prefix 'meta_'
+    :return: the path of the result file
+    """
+    array_map = {'format_version': RESULT_FORMAT_VERSION, 'kernel': return_data_map['kernel']}
+    for name in RESULT_ARRAY_LIST:
+        value = return_data_map.get(name, None)
+        array_map[name] = np.zeros([0]) if value is None else np.asarray(value)
+    if metadata is not None:
+        for name in metadata:
+            array_map['meta_' + name] = 'none' if metadata[name] is None else metadata[name]
+
+    path = os.path.join(file_path, result_file_name(name_prefix))
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, **array_map)
+    os.replace(temp_path, path)
+    return path
+
+
+def load_result(path):
+    """
+    :return: {name: array}, the kernel and the metadata are converted to python scalars
+    """
+    result = dict()
+    with np.load(path) as data:
+        if int(data['format_version']) != RESULT_FORMAT_VERSION:
+            raise RuntimeError('result format incompatible')
+        for name in data.files:
+            value = data[name]
+            result[name] = value.item() if value.ndim == 0 else value
+    return result
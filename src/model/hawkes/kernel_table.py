@@ -0,0 +1,51 @@
+# coding=utf-8
+import numpy as np
+
+
+class KernelTable(object):
+    """
+    evaluate the whole discrete time decay table and discrete integral table in one pass.
+    The omega grid, the lag grid and the complex basis of the Fourier kernel only depend on max_day and time_slot,
+    thus they are built once and reused in every iteration
+    """
+
+    def __init__(self, max_day, time_slot=None):
+        self.max_day = max_day
+        self.time_slot = time_slot
+        self.lag = np.arange(0, max_day)
+        self.omega = None
+        self.slot_lag = None
+        self.integral_factor = None
+        if time_slot is not None:
+            # omega_k = 2 * pi * k / time_slot
+            self.omega = 2 * np.pi * np.arange(0, time_slot) / time_slot
+            # exp(i * omega_k * t) is periodic in t (period time_slot) when t is an integer
+            self.slot_lag = self.lag % time_slot
+            # i / omega_k for k > 0, the k = 0 term is handled separately
+            self.integral_factor = np.zeros([time_slot], dtype=np.complex128)
+            self.integral_factor[1:] = complex(0, 1) / self.omega[1:]
+
+    def exp_decay(self, omega):
+        return np.exp(-1 * omega * self.lag)
+
+    def exp_integral(self, omega):
+        return (1 - np.exp(-1 * omega * self.lag)) / omega
+
+    def fourier_decay(self, k_omega):
+        """
+        kappa(t) = |sum_k k_omega_k * exp(i * omega_k * t)|, the sum is time_slot * ifft(k_omega)[t mod time_slot]
+        """
+        k_omega = np.asarray(k_omega).ravel()
+        series = np.fft.ifft(k_omega) * self.time_slot
+        return np.abs(series[self.slot_lag])
+
+    def fourier_integral(self, k_omega):
+        """
+        integral of kappa from 0 to t,
+        |(k_omega_0 * t + sum_{k>0} k_omega_k * i / omega_k * (1 - exp(i * omega_k * t))) / time_slot|
+        """
+        k_omega = np.asarray(k_omega).ravel()
+        coefficient = k_omega * self.integral_factor
+        series = np.fft.ifft(coefficient) * self.time_slot
+        integral = coefficient.sum() - series[self.slot_lag] + k_omega[0] * self.lag
+        return np.abs(integral / self.time_slot)
@@ -0,0 +1,89 @@
+# coding=utf-8
+import multiprocessing
+
+import numpy as np
+
+# the model of a worker process, it is set by the initializer of the worker
+_worker_model = None
+
+
+def _initializer(hawkes):
+    global _worker_model
+    _worker_model = hawkes
+
+
+def _run_start(task):
+    """
+    continue the optimization of one start from its state
+    :return: the state after optimization
+    """
+    state, iteration, optimization_option = task
+    _worker_model.restore_optimization_state(state)
+    _worker_model.optimization(iteration, **optimization_option)
+    return _worker_model.optimization_state()
+
+
+def _final_log_likelihood(state):
+    log_likelihood = state['train_log_likelihood_tendency'][-1]
+    return -np.inf if np.isnan(log_likelihood) else log_likelihood
+
+
+def multi_start_optimization(hawkes, start_count, iteration, prune_iteration=None, keep_count=1, processes=1, seed=0,
+                             optimization_option=None):
+    """
+    fit start_count random initializations (start k is drawn with seed + k) and keep the best one by train log
+    likelihood. All starts use the packed data and the data-only caches of hawkes, worker processes receive the model
+    once when they are created.
+    If prune_iteration is not None, all starts are optimized to prune_iteration at first, only the keep_count best
+    starts are optimized to iteration then. At last, the state of the best start is restored into hawkes
+    :param hawkes: Hawkes
+    :param start_count:
+    :param iteration:
+    :param prune_iteration:
+    :param keep_count: the start count which survives pruning
+    :param processes: the starts are optimized in the current process if it is 1
+    :param seed:
+    :param optimization_option: other keyword arguments of Hawkes.optimization, e.g., tolerance or acceleration
+    :return: {start_no: {'train_log_likelihood_tendency': [...], 'test_log_likelihood_tendency': [...],
+    'pruned': bool}}, the best start is saved as hawkes.best_start
+    """
+    if start_count < 1 or keep_count < 1:
+        raise RuntimeError('illegal start count')
+    optimization_option = dict() if optimization_option is None else optimization_option
+    state_list = [hawkes.random_start_state(seed + start_no) for start_no in range(0, start_count)]
+    stage_list = [iteration] if prune_iteration is None or prune_iteration >= iteration else \
+        [prune_iteration, iteration]
+
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, initializer=_initializer, initargs=(hawkes,))
+    else:
+        _initializer(hawkes)
+    try:
+        active_list = list(range(0, start_count))
+        for stage_no, stage_iteration in enumerate(stage_list):
+            task_list = [(state_list[start_no], stage_iteration, optimization_option) for start_no in active_list]
+            if pool is not None:
+                result_list = pool.map(_run_start, task_list, chunksize=1)
+            else:
+                result_list = [_run_start(task) for task in task_list]
+            for start_no, state in zip(active_list, result_list):
+                state_list[start_no] = state
+            if stage_no < len(stage_list) - 1:
+                active_list = sorted(active_list, key=lambda k: -1 * _final_log_likelihood(state_list[k]))
+                active_list = sorted(active_list[0: keep_count])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    best_start = max(active_list, key=lambda k: _final_log_likelihood(state_list[k]))
+    hawkes.restore_optimization_state(state_list[best_start])
+    hawkes.best_start = best_start
+    trace_map = dict()
+    for start_no in range(0, start_count):
+        trace_map[start_no] = {
+            'train_log_likelihood_tendency': state_list[start_no]['train_log_likelihood_tendency'],
+            'test_log_likelihood_tendency': state_list[start_no]['test_log_likelihood_tendency'],
+            'pruned': start_no not in active_list}
+    return trace_map
@@ -0,0 +1,188 @@
+# coding=utf-8
+import numpy as np
+
+# the lag matrices of lag_bucket are kept only if all of them contain no more than this number of int32 entries,
+# otherwise they are built chunk by chunk on every visit, so the resident memory is not O(sum n^2)
+LAG_CACHE_LIMIT = 2 ** 22
+
+
+class PackedSequence(object):
+    """
+    pack the event sequence map into flat numpy arrays only once, thus the EM algorithm can use gathers and
+    broadcasting instead of looking up the dictionary event by event.
+    The statistics which only depend on the data (sequence spans, the lags of event pairs and the lags used by the
+    kernel integral) are calculated when they are visited at first and saved as integer arrays, thus an EM iteration
+    only gathers them from the current kernel tables. The pairwise lag matrices are only saved for small data, consult
+    LAG_CACHE_LIMIT
+    """
+
+    def __init__(self, data_source):
+        """
+        :param data_source: {id_index: [(event_index, event_time), (event_index, event_time),...]}, the same data
+        structure as the training data of Hawkes
+        """
+        self.sequence_id_list = list(data_source.keys())
+        self.sequence_count = len(self.sequence_id_list)
+
+        length = [len(data_source[j]) for j in self.sequence_id_list]
+        self.length = np.array(length, dtype=np.int64)
+        self.offset = np.zeros([self.sequence_count + 1], dtype=np.int64)
+        self.offset[1:] = np.cumsum(self.length)
+
+        event_index = []
+        event_time = []
+        for j in self.sequence_id_list:
+            for event in data_source[j]:
+                event_index.append(event[0])
+                event_time.append(event[1])
+        self.event_index = np.array(event_index, dtype=np.int64)
+        self.event_time = np.array(event_time, dtype=np.int64)
+        # the sequence position and the in-sequence order of every event
+        self.event_sequence = np.repeat(np.arange(self.sequence_count, dtype=np.int64), self.length)
+        self.event_order = np.arange(len(self.event_index), dtype=np.int64) - self.offset[self.event_sequence]
+
+        self.bucket_map = self.__build_bucket_map()
+        self.__window_pair_cache = dict()
+        self.__window_lag_cache = dict()
+        self.__lag_bucket_cache = dict()
+        self.__span_sum = None
+        self.__integral_lag = None
+
+    def __build_bucket_map(self):
+        """
+        sequences with equal length are collected in a bucket, so they can be stacked into a [B, L] matrix
+        :return: {length: np.array([position of sequence, ...])}
+        """
+        bucket_map = dict()
+        order = np.argsort(self.length, kind='stable')
+        sorted_length = self.length[order]
+        boundary = np.flatnonzero(np.diff(sorted_length)) + 1
+        for positions in np.split(order, boundary):
+            if len(positions) == 0:
+                continue
+            bucket_map[int(self.length[positions[0]])] = positions
+        return bucket_map
+
+    @property
+    def first_event_time(self):
+        return self.event_time[self.offset[:-1]]
+
+    @property
+    def last_event_time(self):
+        return self.event_time[self.offset[1:] - 1]
+
+    @property
+    def span_sum(self):
+        """
+        the sum of t_last - t_first of all sequences
+        """
+        if self.__span_sum is None:
+            self.__span_sum = int((self.last_event_time - self.first_event_time).sum())
+        return self.__span_sum
+
+    @property
+    def integral_lag(self):
+        """
+        [N] int32, t_last - t_i of every event i, the upper bound of the kernel integral of event i
+        """
+        if self.__integral_lag is None:
+            lag = self.last_event_time[self.event_sequence] - self.event_time
+            self.__integral_lag = lag.astype(np.int32)
+        return self.__integral_lag
+
+    def sequence(self, position):
+        """
+        :param position: the position of a sequence in sequence_id_list
+        :return: event index array and event time array of the sequence
+        """
+        start = self.offset[position]
+        end = self.offset[position + 1]
+        return self.event_index[start: end], self.event_time[start: end]
+
+    def iterate_bucket(self, max_element=2 ** 22):
+        """
+        iterate all buckets, a large bucket is split into several chunks so that the [B, L, L] pairwise arrays
+        built by the caller contain no more than max_element entries
+        :param max_element:
+        :return: generator of (positions, event index matrix [B, L], event time matrix [B, L])
+        """
+        for length in sorted(self.bucket_map):
+            if length == 0:
+                continue
+            positions = self.bucket_map[length]
+            chunk_size = max(1, max_element // (length * length))
+            for start in range(0, len(positions), chunk_size):
+                chunk = positions[start: start + chunk_size]
+                event_position = self.offset[chunk][:, np.newaxis] + np.arange(length)[np.newaxis, :]
+                yield chunk, self.event_index[event_position], self.event_time[event_position]
+
+    @property
+    def pair_element_count(self):
+        """
+        the entry count of all [B, L, L] pairwise matrices, i.e., sum of n^2
+        """
+        return int((self.length * self.length).sum())
+
+    def lag_bucket(self, max_element=2 ** 22, cache_limit=LAG_CACHE_LIMIT):
+        """
+        the chunks of iterate_bucket with the pairwise lag matrix instead of the event time matrix. The lag matrices
+        are built only once if pair_element_count is not larger than cache_limit, otherwise they are gathered chunk by
+        chunk on every call and only one chunk is resident
+        :return: list or generator of (positions, event index matrix [B, L], lag matrix [B, L, L]), entry [b, i, l] of
+        the lag matrix is t_i - t_l if l < i, otherwise 0 so that it can index the discrete time decay table safely,
+        int32
+        """
+        if max_element in self.__lag_bucket_cache:
+            return self.__lag_bucket_cache[max_element]
+        if self.pair_element_count > cache_limit:
+            return self.__iterate_lag_bucket(max_element)
+        chunk_list = list(self.__iterate_lag_bucket(max_element))
+        self.__lag_bucket_cache = {max_element: chunk_list}
+        return chunk_list
+
+    def __iterate_lag_bucket(self, max_element):
+        for positions, index_matrix, time_matrix in self.iterate_bucket(max_element):
+            length = time_matrix.shape[1]
+            lag = (time_matrix[:, :, np.newaxis] - time_matrix[:, np.newaxis, :]).astype(np.int32)
+            lag[:, ~np.tri(length, length, -1, dtype=bool)] = 0
+            yield positions, index_matrix, lag
+
+    def window_pair(self, width):
+        """
+        find all event pairs (i, l), l < i, in the same sequence with t_i - t_l < width. As the event time of a sequence
+        is sorted, the first earlier event inside the window is found by binary search
+        :param width: window width (day)
+        :return: flat event position of the later events and the earlier events, both are int64 arrays
+        """
+        if width in self.__window_pair_cache:
+            return self.__window_pair_cache[width]
+
+        event_count = len(self.event_index)
+        if event_count == 0:
+            empty = np.zeros([0], dtype=np.int64)
+            return empty, empty
+        # the composite key is sorted across sequences, and the window of an event never reaches the previous one
+        first_time = self.event_time.min()
+        stride = int(self.event_time.max() - first_time) + width + 1
+        key = self.event_sequence * stride + (self.event_time - first_time)
+        window_start = np.searchsorted(key, key - width, side='right')
+        window_start = np.maximum(window_start, self.offset[self.event_sequence])
+
+        pair_count = np.arange(event_count, dtype=np.int64) - window_start
+        later = np.repeat(np.arange(event_count, dtype=np.int64), pair_count)
+        pair_offset = np.zeros([event_count], dtype=np.int64)
+        pair_offset[1:] = np.cumsum(pair_count)[:-1]
+        earlier = window_start[later] + np.arange(len(later), dtype=np.int64) - pair_offset[later]
+
+        self.__window_pair_cache = {width: (later, earlier)}
+        return later, earlier
+
+    def window_lag(self, width):
+        """
+        :return: int32 lag t_i - t_l of every event pair (i, l) of window_pair(width)
+        """
+        if width not in self.__window_lag_cache:
+            later, earlier = self.window_pair(width)
+            lag = (self.event_time[later] - self.event_time[earlier]).astype(np.int32)
+            self.__window_lag_cache = {width: lag}
+        return self.__window_lag_cache[width]
@@ -0,0 +1,162 @@
+# coding=utf-8
+import multiprocessing
+import traceback
+
+import numpy as np
+
+from hawkes import em_engine
+from hawkes.auxiliary_variable import AuxiliaryVariable
+from hawkes.packed_sequence import PackedSequence
+
+
+def _shared_view(shared_array, shape):
+    return np.frombuffer(shared_array, dtype=np.float64).reshape(shape)
+
+
+def _shard_worker(connection, shared_array_map, shape_map, chunk_map, event_count):
+    """
+    a worker owns several chunks of the training data, it keeps the packed data and the auxiliary variable of its
+    chunks during the whole optimization and reads the current parameter and kernel tables from shared memory
+    :param connection: pipe to the parent process
+    :param shared_array_map: {name: RawArray}
+    :param shape_map: {name: shape}
+    :param chunk_map: {chunk_no: sub training data}
+    :param event_count:
+    """
+    try:
+        parameter = {name: _shared_view(shared_array_map[name], shape_map[name]) for name in shared_array_map}
+        packed_map = {chunk_no: PackedSequence(chunk_map[chunk_no]) for chunk_no in chunk_map}
+        auxiliary_map = {chunk_no: AuxiliaryVariable(packed_map[chunk_no]) for chunk_no in chunk_map}
+
+        while True:
+            command = connection.recv()
+            if command == 'step':
+                statistic_map = dict()
+                for chunk_no in packed_map:
+                    packed = packed_map[chunk_no]
+                    auxiliary = auxiliary_map[chunk_no]
+                    em_engine.expectation(parameter['base_intensity'], parameter['mutual_intensity'],
+                                          parameter['time_decay'], packed, auxiliary)
+                    statistic_map[chunk_no] = (
+                        em_engine.alpha_nominator(auxiliary, packed, event_count),
+                        em_engine.alpha_denominator(parameter['time_integral'], packed, event_count),
+                        em_engine.mu_nominator(auxiliary, packed, event_count),
+                        em_engine.mu_denominator(packed))
+                connection.send(statistic_map)
+            elif command == 'auxiliary':
+                connection.send({chunk_no: auxiliary_map[chunk_no].buffer for chunk_no in auxiliary_map})
+            elif command == 'stop':
+                connection.close()
+                break
+            else:
+                raise RuntimeError('illegal command')
+    except Exception:
+        # the parent only sees EOFError if the worker dies silently, thus the traceback is sent back
+        connection.send(('error', traceback.format_exc()))
+
+
+class ShardedEM(object):
+    """
+    run the E step and the sufficient statistic accumulation of the M step in worker processes.
+
+    The training data is split into chunks of chunk_size contiguous sequences and the chunks are dealt to workers
+    round robin. Statistics are returned per chunk and reduced in chunk order, thus the result does not depend on the
+    worker count. The intensity matrices and kernel tables are written to shared memory by the parent in every
+    iteration instead of being pickled to workers
+    """
+
+    def __init__(self, training_data, event_count, max_day, processes, chunk_size=256):
+        if processes < 1:
+            raise RuntimeError('illegal process count')
+        self.event_count = event_count
+        sequence_id_list = list(training_data.keys())
+        self.chunk_count = (len(sequence_id_list) + chunk_size - 1) // chunk_size
+
+        self.shape_map = {'base_intensity': (event_count, 1), 'mutual_intensity': (event_count, event_count),
+                          'time_decay': (max_day,), 'time_integral': (max_day,)}
+        self.shared_array_map = {name: multiprocessing.RawArray('d', int(np.prod(self.shape_map[name])))
+                                 for name in self.shape_map}
+        self.parameter = {name: _shared_view(self.shared_array_map[name], self.shape_map[name])
+                          for name in self.shape_map}
+
+        worker_chunk_map = [dict() for _ in range(0, processes)]
+        for chunk_no in range(0, self.chunk_count):
+            chunk_id_list = sequence_id_list[chunk_no * chunk_size: (chunk_no + 1) * chunk_size]
+            worker_chunk_map[chunk_no % processes][chunk_no] = {j: training_data[j] for j in chunk_id_list}
+
+        self.connection_list = []
+        self.process_list = []
+        for chunk_map in worker_chunk_map:
+            if len(chunk_map) == 0:
+                continue
+            parent_connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shard_worker, args=(child_connection, self.shared_array_map,
+                                                                          self.shape_map, chunk_map, event_count))
+            process.daemon = True
+            process.start()
+            self.connection_list.append(parent_connection)
+            self.process_list.append(process)
+
+    def __gather(self, command):
+        for connection in self.connection_list:
+            try:
+                connection.send(command)
+            except BrokenPipeError:
+                # a failed worker has exited, its traceback is still buffered in the pipe
+                pass
+        result_map = dict()
+        error_list = []
+        for connection in self.connection_list:
+            try:
+                result = connection.recv()
+            except EOFError:
+                result = ('error', 'shard worker exited without reply')
+            if isinstance(result, tuple) and result[0] == 'error':
+                error_list.append(result[1])
+            else:
+                result_map.update(result)
+        if len(error_list) > 0:
+            raise RuntimeError('shard worker failed\n' + '\n'.join(error_list))
+        return result_map
+
+    def step(self, base_intensity, mutual_intensity, time_decay, time_integral):
+        """
+        :return: alpha nominator, alpha denominator, mu nominator, mu denominator of the whole training data
+        """
+        self.parameter['base_intensity'][:] = base_intensity
+        self.parameter['mutual_intensity'][:] = mutual_intensity
+        self.parameter['time_decay'][:] = time_decay
+        self.parameter['time_integral'][:] = time_integral
+
+        statistic_map = self.__gather('step')
+        alpha_nominator = np.zeros([self.event_count, self.event_count])
+        alpha_denominator = np.zeros([self.event_count, self.event_count])
+        mu_nominator = np.zeros([self.event_count, 1])
+        mu_denominator = 0
+        for chunk_no in range(0, self.chunk_count):
+            statistic = statistic_map[chunk_no]
+            alpha_nominator += statistic[0]
+            alpha_denominator += statistic[1]
+            mu_nominator += statistic[2]
+            mu_denominator += statistic[3]
+        return alpha_nominator, alpha_denominator, mu_nominator, mu_denominator
+
+    def auxiliary_buffer(self):
+        """
+        the chunks are contiguous, thus the concatenation of chunk buffers is the buffer of the whole training data
+        """
+        buffer_map = self.__gather('auxiliary')
+        return np.concatenate([buffer_map[chunk_no] for chunk_no in range(0, self.chunk_count)])
+
+    def close(self):
+        for connection, process in zip(self.connection_list, self.process_list):
+            if not process.is_alive():
+                continue
+            try:
+                connection.send('stop')
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.process_list:
+            process.join()
+        self.connection_list = []
+        self.process_list = []
@@ -0,0 +1,126 @@
+# coding=utf-8
+import copy
+
+import numpy as np
+
+
+def co_occurring_pair(packed_sequence, event_count):
+    """
+    find all ordered type pairs (u, v) such that an event of type v happens before an event of type u in at least one
+    sequence. The E step and the M step never visit alpha_uv of other pairs, and their alpha_uv is 0 after the first
+    M step
+    :return: sorted int64 pair codes u * event_count + v
+    """
+    code_list = [np.zeros([0], dtype=np.int64)]
+    for _, index_matrix, _ in packed_sequence.iterate_bucket():
+        length = index_matrix.shape[1]
+        if length < 2:
+            continue
+        row, col = np.tril_indices(length, -1)
+        code_list.append(np.unique(index_matrix[:, row] * event_count + index_matrix[:, col]))
+    return np.unique(np.concatenate(code_list))
+
+
+class SparseMutualIntensity(object):
+    """
+    mutual intensity saved in CSR form over the co-occurring type pairs of the training data, entry [u, v] is
+    data[indptr[u] + k] if indices[indptr[u] + k] == v, the entries of other pairs are 0.
+
+    The structure is shared by all intensities of a model, with_data builds a new intensity on the same structure.
+    It supports the fancy indexing alpha[row, col] and sum(axis) used by em_engine, thus the E step and the
+    likelihood calculation accept it in place of the dense matrix
+    """
+
+    def __init__(self, pair_code, event_count, data=None):
+        """
+        :param pair_code: sorted int64 pair codes u * event_count + v, consult co_occurring_pair
+        :param event_count:
+        :param data: value of every pair, 0 if it is None
+        """
+        self.event_count = event_count
+        self.pair_code = pair_code
+        self.row = pair_code // event_count
+        self.indices = pair_code % event_count
+        self.indptr = np.zeros([event_count + 1], dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(self.row, minlength=event_count))
+        self.data = np.zeros([len(pair_code)]) if data is None else data
+
+    @classmethod
+    def from_packed_sequence(cls, packed_sequence, event_count):
+        return cls(co_occurring_pair(packed_sequence, event_count), event_count)
+
+    @property
+    def shape(self):
+        return self.event_count, self.event_count
+
+    @property
+    def nnz(self):
+        return len(self.pair_code)
+
+    @property
+    def nbytes(self):
+        return self.pair_code.nbytes + self.row.nbytes + self.indices.nbytes + self.indptr.nbytes + self.data.nbytes
+
+    def with_data(self, data):
+        """
+        :return: a new intensity on the same structure, the structure arrays are not copied
+        """
+        intensity = copy.copy(self)
+        intensity.data = data
+        return intensity
+
+    def pair_position(self, row, col):
+        """
+        :return: the position of every pair (row, col) in data, -1 if the pair is not stored
+        """
+        code = np.asarray(row, dtype=np.int64) * self.event_count + np.asarray(col, dtype=np.int64)
+        position = np.searchsorted(self.pair_code, code)
+        position = np.minimum(position, max(self.nnz - 1, 0))
+        stored = self.pair_code[position] == code if self.nnz > 0 else np.zeros(code.shape, dtype=bool)
+        return np.where(stored, position, -1)
+
+    def gather(self, row, col):
+        position = self.pair_position(row, col)
+        if self.nnz == 0:
+            return np.zeros(position.shape)
+        return np.where(position >= 0, self.data[position], 0.)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple) or len(key) != 2:
+            raise RuntimeError('sparse mutual intensity only supports alpha[row, col] indexing')
+        return self.gather(key[0], key[1])
+
+    def sum(self, axis=None, dtype=None):
+        """
+        :param dtype: accumulator of the total sum, the sum along an axis is always accumulated in float64
+        """
+        if axis is None:
+            return self.data.sum(dtype=dtype)
+        if axis == 0:
+            return np.bincount(self.indices, weights=self.data, minlength=self.event_count)
+        if axis == 1:
+            return np.bincount(self.row, weights=self.data, minlength=self.event_count)
+        raise RuntimeError('illegal axis')
+
+    def dot(self, state):
+        """
+        :param state: [..., event_count]
+        :return: [..., event_count], entry [..., u] is sum_v alpha_uv * state[..., v], i.e., state . alpha^T
+        """
+        flat_state = state.reshape([-1, self.event_count])
+        contribution = flat_state[:, self.indices] * self.data
+        code = np.arange(len(flat_state))[:, np.newaxis] * self.event_count + self.row[np.newaxis, :]
+        result = np.bincount(code.ravel(), weights=contribution.ravel(), minlength=flat_state.size)
+        return result.reshape(state.shape)
+
+    def from_dense(self, dense, dtype=np.float64):
+        """
+        :param dtype: dtype of the values, i.e., the real_dtype of the model
+        :return: a new intensity on the same structure whose values are read from a dense matrix
+        """
+        return self.with_data(np.asarray(dense, dtype=dtype)[self.row, self.indices])
+
+    def to_dense(self):
+        dense = np.zeros([self.event_count, self.event_count])
+        dense[self.row, self.indices] = self.data
+        return dense
@@ -4,6 +4,8 @@ import csv
 import numpy as np
 import tensorflow as tf
 
+from hawkes.hawkes_result import RESULT_FORMAT_VERSION
+
 
 class Intensity(object):
     def __init__(self, model_config):
@@ -23,8 +25,16 @@ class Intensity(object):
     @staticmethod
     def read_mutual_intensity_data(mutual_intensity_path, size, encoding):
         """
+        :param mutual_intensity_path: a csv file, or a npz result file of hawkes (.npz), the latter is read without
+        parsing
         :return: Mutual intensity is a m by m square matrix, Entry x_ij means the mutual intensity the i trigger j
         """
+        if mutual_intensity_path.endswith('.npz'):
+            mutual_intensity = Intensity.read_result_array(mutual_intensity_path, 'mutual_intensity')
+            if mutual_intensity.shape != (size, size):
+                raise ValueError('mutual intensity incompatible')
+            return np.transpose(mutual_intensity)
+
         mutual_intensity = np.zeros([size, size])
         with open(mutual_intensity_path, 'r', encoding=encoding, newline="") as file:
             csv_reader = csv.reader(file)
@@ -42,6 +52,12 @@ class Intensity(object):
 
     @staticmethod
     def read_base_intensity_data(base_intensity_path, size, encoding):
+        if base_intensity_path.endswith('.npz'):
+            base_intensity = Intensity.read_result_array(base_intensity_path, 'base_intensity')
+            if base_intensity.size != size:
+                raise ValueError('base intensity incompatible')
+            return base_intensity.reshape([1, size])
+
         base_intensity = np.zeros([1, size])
         with open(base_intensity_path, 'r', encoding=encoding, newline="") as file:
             csv_reader = csv.reader(file)
@@ -52,3 +68,10 @@ class Intensity(object):
                     base_intensity[0][col_index] = line[col_index]
                 break
         return base_intensity
+
+    @staticmethod
+    def read_result_array(result_path, name):
+        with np.load(result_path) as result:
+            if int(result['format_version']) != RESULT_FORMAT_VERSION:
+                raise ValueError('result format incompatible')
+            return result[name]
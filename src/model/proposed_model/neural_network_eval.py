@@ -11,6 +11,7 @@ import tensorflow as tf
 import performance_metrics as pm
 import read_data
 import rnn_config as config
+from hawkes.hawkes_result import result_file_name
 from intensity import Intensity
 from model import ProposedModel
 
@@ -160,9 +161,9 @@ def configuration_set():
     time = datetime.datetime.now().strftime("%H%M%S")
     root_path = os.path.abspath('..\\..\\..') + '\\model_evaluate\\Case_80_20\\'
     optimizer = 'SGD'
-    mutual_intensity_path = os.path.join(root_path,
-                                         'fourier_diagnosis_80_procedure_20_iteration_10_slot_1000_mutual_intensity'
-                                         '.csv')
+    # the npz result file of hawkes_eval, consult hawkes.hawkes_result
+    mutual_intensity_path = os.path.join(root_path, result_file_name(
+        'fourier_diagnosis_80_procedure_20_iteration_10_slot_1000_'))
     # the parameter only effective when using SGD
     save_path = root_path + time + "\\"
 
@@ -5,6 +5,8 @@ import os
 import numpy as np
 import tensorflow as tf
 
+from hawkes.hawkes_result import result_file_name
+
 
 class ModelConfiguration(object):
     def __init__(self, x_depth, max_time_stamp, num_hidden, cell_type, init_map, batch_size, pos_weight,
@@ -142,7 +144,9 @@ def validate_configuration_set():
     # fixed train parameters
     now_time = datetime.datetime.now().strftime('%H%M%S')
     all_path = os.path.abspath('..\\..\\..') + '\\model_evaluate\\ValidationTest\\'
-    mutual_intensity_path = os.path.join(all_path, 'mutual_intensity.csv')
+    # the npz result file of hawkes_eval, consult hawkes.hawkes_result
+    mutual_intensity_path = os.path.join(all_path, result_file_name(
+        'fourier_diagnosis_80_procedure_20_iteration_10_slot_1000_'))
     x_path = os.path.join(all_path, 'validation_x.npy')
     t_path = os.path.join(all_path, 'validation_t.npy')
     save_path = all_path + now_time + "\\"
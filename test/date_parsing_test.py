@@ -0,0 +1,32 @@
+# coding=utf-8
+import datetime
+
+import numpy as np
+
+from date_parsing import PLAGH_DATE_FORMAT_LIST, day_offset, parse_date, parse_plagh_date, to_datetime64
+
+
+def days(date, base):
+    return (datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S') -
+            datetime.datetime.strptime(base, '%Y-%m-%d %H:%M:%S')).days
+
+
+def test_plagh_date_falls_back_to_date_format():
+    assert parse_plagh_date('2012/3/4 05:06:07') == datetime.datetime(2012, 3, 4, 5, 6, 7)
+    assert parse_plagh_date('2012/3/4') == datetime.datetime(2012, 3, 4)
+    assert parse_date('2012/03/04', '%Y/%m/%d') is parse_date('2012/03/04', '%Y/%m/%d')
+
+
+def test_bulk_conversion_matches_strptime():
+    date_list = ['2150-01-02 08:00:00', '2150-01-01 12:00:00', '2150-01-05 07:00:00', '2150-01-02 08:00:00']
+    base_list = ['2150-01-01 12:00:00'] * 4
+    # the negative offsets round towards negative infinity as timedelta.days
+    assert day_offset(date_list, base_list).tolist() == [days(*item) for item in zip(date_list, base_list)]
+    assert day_offset(base_list, date_list).tolist() == [days(*item) for item in zip(base_list, date_list)]
+
+    np.testing.assert_array_equal(to_datetime64(date_list, unit='D'),
+                                  np.array(['2150-01-02', '2150-01-01', '2150-01-05', '2150-01-02'],
+                                           dtype='datetime64[D]'))
+    assert to_datetime64(['2012/3/4', '2012/3/4 05:06:07'], PLAGH_DATE_FORMAT_LIST).tolist() == [
+        datetime.datetime(2012, 3, 4), datetime.datetime(2012, 3, 4, 5, 6, 7)]
+    assert to_datetime64([]).shape == (0,)
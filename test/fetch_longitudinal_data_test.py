@@ -0,0 +1,54 @@
+# coding=utf-8
+import numpy as np
+import pytest
+
+from mimic.fetch_longitudinal_data import byte_range_list, parallel_read_and_write_data, read_and_write_data
+
+
+def write_table(file_path, row_count, random_state, multiline=False):
+    with open(file_path, 'w', encoding='utf-8', newline="") as f:
+        f.write('"ROW_ID","SUBJECT_ID","HADM_ID","VALUE"\n')
+        for row_id in range(0, row_count):
+            subject_id = random_state.randint(0, 30)
+            value = '"a, ""quoted"" value"' if row_id % 3 == 0 else str(random_state.randint(0, 1000))
+            if multiline and row_id % 4 == 0:
+                value = '"first line\n' + str(subject_id) + ',second line"'
+            f.write('{},{},{},{}\n'.format(row_id, subject_id, random_state.randint(100000, 200000), value))
+
+
+def test_parallel_extraction_matches_serial(tmp_path):
+    source_path = str(tmp_path) + '/source_'
+    random_state = np.random.RandomState(0)
+    write_table(source_path + 'LABEVENTS.csv', 2000, random_state)
+    write_table(source_path + 'ICUSTAYS.csv', 10, random_state)
+    write_table(source_path + 'NOTEEVENTS.csv', 300, random_state, multiline=True)
+    id_list = {str(item) for item in range(0, 30, 3)}
+    name_list = ['LABEVENTS', 'ICUSTAYS', 'NOTEEVENTS']
+
+    range_list = byte_range_list(source_path + 'LABEVENTS.csv', 1000)
+    assert len(range_list) > 10
+    with open(source_path + 'LABEVENTS.csv', 'rb') as f:
+        data = f.read()
+    assert range_list[0][0] == 0 and range_list[-1][1] == len(data)
+    for start, end in range_list:
+        assert data[end - 1: end] == b'\n'
+
+    for processes in [1, 3]:
+        count_map = parallel_read_and_write_data(source_path, name_list, id_list, str(tmp_path) + '/parallel_',
+                                                 processes=processes, chunk_size=1000)
+        for name in name_list:
+            read_and_write_data(source_path, name, id_list, str(tmp_path) + '/serial_')
+            with open(str(tmp_path) + '/serial_' + name + '.csv', 'rb') as f:
+                expected = f.read()
+            with open(str(tmp_path) + '/parallel_' + name + '.csv', 'rb') as f:
+                assert f.read() == expected
+            # csv.writer ends every row with \r\n, the line breaks inside the quoted fields are kept as \n
+            assert count_map[name] == expected.count(b'\r\n') > 0
+
+
+def test_multiline_record_is_not_split(tmp_path, monkeypatch):
+    source_path = str(tmp_path) + '/source_'
+    write_table(source_path + 'NOTEEVENTS.csv', 50, np.random.RandomState(0), multiline=True)
+    monkeypatch.setattr('mimic.fetch_longitudinal_data.MULTILINE_TABLE', set())
+    with pytest.raises(RuntimeError):
+        parallel_read_and_write_data(source_path, ['NOTEEVENTS'], {'1'}, str(tmp_path) + '/parallel_', processes=1)
@@ -0,0 +1,22 @@
+# coding=utf-8
+import numpy as np
+
+from hawkes.hawkes_benchmark import generate_parameter, generate_sequence_map
+from hawkes.hawkes_process import Hawkes
+
+
+def test_simulated_sequence_is_valid_training_data():
+    random_state = np.random.RandomState(0)
+    generator = Hawkes(training_data={}, test_data={}, event_count=3, kernel='exp', init_strategy='default',
+                       time_slot=None, max_day=1000)
+    generator.base_intensity, generator.mutual_intensity = generate_parameter(3, 1, random_state)
+    assert np.abs(np.linalg.eigvals(generator.mutual_intensity)).max() < 1
+
+    sequence_map = generate_sequence_map(generator, 20, 15, 999, random_state)
+    assert len(sequence_map) == 20
+    for sequence in sequence_map.values():
+        assert 0 < len(sequence) <= 15
+        event_time = [item[1] for item in sequence]
+        assert event_time[0] == 0
+        assert event_time == sorted(event_time)
+        assert all(0 <= item[0] < 3 for item in sequence)
@@ -0,0 +1,217 @@
+# coding=utf-8
+import copy
+import csv
+import datetime
+import os
+import random
+from xml.etree import ElementTree
+from xml.etree.ElementTree import Element, SubElement
+
+import numpy as np
+
+import mimic.cohort_cache as cohort_cache
+import mimic.derive_training_data as dtd
+from hawkes.hawkes_model_eval import (GRID_SUMMARY_FIELD_LIST, convert_result_to_csv, hawkes_grid_eval,
+                                      hawkes_optimization, save_result)
+from hawkes.hawkes_result import load_result, save_result_npz
+
+
+def write_reconstructed_xml(file_path, patient_count, seed=0):
+    """
+    write a small reconstructed.xml with the same node structure as mimic.generate_xml
+    """
+    random_state = np.random.RandomState(seed)
+    root = Element('Patient_List_Event')
+    for patient_id in range(0, patient_count):
+        patient_node = SubElement(root, 'patient_node', {'patient_id': str(patient_id), 'sex': 'M',
+                                                         'birthday': '2100-01-01 00:00:00'})
+        admission_date = datetime.datetime(2150, 1, 1) + datetime.timedelta(days=int(random_state.randint(0, 300)))
+        for visit_id in range(1, random_state.randint(2, 5)):
+            visit_node = SubElement(patient_node, 'visit', {
+                'visit_id': str(visit_id), 'visit_index': str(patient_id * 10 + visit_id),
+                'admission_date': admission_date.strftime('%Y-%m-%d %H:%M:%S'),
+                'discharge_date': 'NoRecord', 'death_time': 'NoRecord'})
+            # the slot histogram of the Fourier kernel needs an event time span larger than init_time
+            admission_date += datetime.timedelta(days=int(random_state.randint(1, 200)))
+            diagnosis_node = SubElement(visit_node, 'diagnosis', {'contain_diagnosis': 'true'})
+            for no, code in enumerate(random_state.randint(0, 12, random_state.randint(1, 4))):
+                SubElement(diagnosis_node, 'diagnosis_item', {'diagnosis_no': str(no + 1), 'icd_9_code': str(code),
+                                                              'disease_name': 'NoName',
+                                                              'normalized_code': 'd' + str(code)})
+            procedure_node = SubElement(visit_node, 'procedures', {'contain_cpt': 'true'})
+            for no, code in enumerate(random_state.randint(0, 6, random_state.randint(0, 3))):
+                SubElement(procedure_node, 'procedure_item', {'procedure_no': str(no + 1), 'icd_9_code': str(code),
+                                                              'procedure_name': 'NoRecord',
+                                                              'normalized_code': 'p' + str(code)})
+    with open(file_path, 'w', encoding='utf-8-sig') as f:
+        f.write(ElementTree.tostring(root, 'unicode'))
+
+
+def test_streaming_parser_matches_tree_walk(tmp_path):
+    file_path = str(tmp_path / 'reconstructed.xml')
+    write_reconstructed_xml(file_path, 30)
+    patient_info_map, visit_date_map, diagnosis_map, procedure_map = dict(), dict(), dict(), dict()
+    with open(file_path, 'rt', encoding='utf-8-sig') as f:
+        for patient_node in ElementTree.parse(f).getroot():
+            patient_id = patient_node.attrib['patient_id']
+            patient_info_map[patient_id] = [patient_node.attrib['birthday'], patient_node.attrib['sex']]
+            for visit_node in patient_node:
+                visit_id = visit_node.attrib['visit_id']
+                visit_date_map.setdefault(patient_id, dict())[visit_id] = visit_node.attrib['admission_date']
+                for item in visit_node.iter('diagnosis_item'):
+                    diagnosis_map.setdefault(patient_id, dict()).setdefault(visit_id, []).append(
+                        item.attrib['normalized_code'])
+                for item in visit_node.iter('procedure_item'):
+                    procedure_map.setdefault(patient_id, dict()).setdefault(visit_id, []).append(
+                        item.attrib['normalized_code'])
+    assert dtd.parsing_xml(file_path) == [patient_info_map, visit_date_map, diagnosis_map, procedure_map]
+
+
+def test_vocabulary_cut_does_not_modify_parsed_data(tmp_path):
+    file_path = str(tmp_path / 'reconstructed.xml')
+    write_reconstructed_xml(file_path, 30)
+    parsed_data = dtd.parsing_xml(file_path)
+    parsed_copy = copy.deepcopy(parsed_data)
+    diagnosis_rank_map = dtd.diagnosis_rank(parsed_data[2])
+    procedure_rank_map = dtd.procedure_rank(parsed_data[3])
+    for diagnosis_reserve, procedure_reserve in [(3, 2), (8, 4)]:
+        cut = dtd.derive_hawkes_cut(parsed_data, diagnosis_rank_map, procedure_rank_map, diagnosis_reserve,
+                                    procedure_reserve)
+        assert cut == dtd.derive_hawkes_data(file_path, diagnosis_reserve, procedure_reserve)
+        assert parsed_data == parsed_copy
+
+
+def test_cohort_cache_matches_parsed_data(tmp_path, monkeypatch):
+    file_path = str(tmp_path / 'reconstructed.xml')
+    write_reconstructed_xml(file_path, 30)
+    parsed_data = dtd.parsing_xml(file_path)
+    diagnosis_rank_map = dtd.diagnosis_rank(parsed_data[2])
+    procedure_rank_map = dtd.procedure_rank(parsed_data[3])
+
+    cohort = cohort_cache.load_cohort_cache(file_path, str(tmp_path))
+    assert os.path.exists(str(tmp_path / cohort_cache.cache_file_name(cohort_cache.xml_digest(file_path))))
+    assert cohort_cache.cohort_parsed_data(cohort) == parsed_data
+    assert cohort_cache.cohort_rank_map(cohort) == (diagnosis_rank_map, procedure_rank_map)
+
+    # the second load only reads the cache
+    monkeypatch.setattr(dtd, 'parsing_xml', None)
+    cached = cohort_cache.load_cohort_cache(file_path, str(tmp_path))
+    for diagnosis_reserve, procedure_reserve in [(3, 2), (8, 4), (20, 10)]:
+        expected = dtd.derive_hawkes_cut(parsed_data, diagnosis_rank_map, procedure_rank_map, diagnosis_reserve,
+                                         procedure_reserve)
+        assert cohort_cache.cohort_hawkes_cut(cached, diagnosis_reserve, procedure_reserve) == expected
+
+    # the entry points read the cache, and the digest of the unchanged XML is read from the digest index
+    digest = cohort_cache.xml_digest(file_path)
+    monkeypatch.setattr(cohort_cache, '_digest_map', dict())
+    monkeypatch.setattr(cohort_cache, 'xml_digest', None)
+    random.seed(0)
+    batch_map, index_name_map = dtd.hawkes(8, 4, str(tmp_path) + os.sep, 'reconstructed.xml')
+    random.seed(0)
+    expected = dtd.derive_hawkes_cut(parsed_data, diagnosis_rank_map, procedure_rank_map, 8, 4)
+    assert (batch_map, index_name_map) == (dtd.hawkes_random_split(expected[0]), expected[1])
+    dtd.neural_nets(8, 4, 2, str(tmp_path) + os.sep, 'reconstructed.xml')
+    assert cohort_cache.memoized_xml_digest(file_path, str(tmp_path)) == digest
+
+
+def test_cohort_cache_digest_follows_xml_change(tmp_path):
+    file_path = str(tmp_path / 'reconstructed.xml')
+    write_reconstructed_xml(file_path, 10, seed=1)
+    first = cohort_cache.load_cohort_cache(file_path)
+    write_reconstructed_xml(file_path, 20, seed=2)
+    os.utime(file_path, ns=(os.stat(file_path).st_atime_ns, os.stat(file_path).st_mtime_ns + 10 ** 9))
+    second = cohort_cache.load_cohort_cache(file_path)
+    assert len(first['patient_id']) == 10 and len(second['patient_id']) == 20
+    assert cohort_cache.memoized_xml_digest(file_path, str(tmp_path)) == cohort_cache.xml_digest(file_path)
+
+
+def test_neural_network_tensor_matches_visit_loop(tmp_path):
+    file_path = str(tmp_path / 'reconstructed.xml')
+    write_reconstructed_xml(file_path, 30)
+    time_stamp = 2
+    patient_x, patient_t = dtd.derive_neural_network_data(file_path, 8, 4, time_stamp)
+
+    _, visit_date, diagnosis_map, procedure_map = dtd.parsing_xml(file_path)
+    index_name_map = dtd.generate_index_name_map(dtd.diagnosis_rank(diagnosis_map), dtd.procedure_rank(procedure_map),
+                                                 8, 4)
+    rank_map = {'D': dtd.diagnosis_rank(diagnosis_map), 'P': dtd.procedure_rank(procedure_map)}
+    expected_x = np.zeros([len(visit_date), time_stamp, 12])
+    expected_t = np.zeros([len(visit_date), time_stamp, 1])
+    for row, patient_id in enumerate(visit_date):
+        for visit_id in visit_date[patient_id]:
+            if int(visit_id) > time_stamp:
+                continue
+            first_day = datetime.datetime.strptime(visit_date[patient_id]['1'], '%Y-%m-%d %H:%M:%S')
+            current_day = datetime.datetime.strptime(visit_date[patient_id][visit_id], '%Y-%m-%d %H:%M:%S')
+            expected_t[row, int(visit_id) - 1, 0] = (current_day - first_day).days
+            for prefix, item_map, reserve in [('D', diagnosis_map, 8), ('P', procedure_map, 4)]:
+                for item in item_map.get(patient_id, dict()).get(visit_id, []):
+                    if rank_map[prefix][item] <= reserve:
+                        expected_x[row, int(visit_id) - 1, index_name_map[prefix + item] - 1] = 1
+    np.testing.assert_array_equal(patient_x, expected_x)
+    np.testing.assert_array_equal(patient_t, expected_t)
+
+    keep = dtd.non_empty_patient(patient_x, patient_t)
+    for row in range(0, len(patient_x)):
+        padded = [j != 0 and patient_t[row, j, 0] == 0 for j in range(0, time_stamp)]
+        assert keep[row] == all(patient_x[row, j].max() == 1 or padded[j] for j in range(0, time_stamp))
+
+
+def test_grid_runner_skips_finished_configuration(tmp_path):
+    write_reconstructed_xml(str(tmp_path / 'reconstructed.xml'), 60)
+    save_file_path = str(tmp_path) + os.sep
+    np.random.seed(0)
+    summary_list = hawkes_grid_eval(save_file_path, 'reconstructed.xml', save_file_path, diagnosis_list=[4],
+                                    procedure_list=[2], iteration_list=[2], kernel_list=['exp', 'Fourier'],
+                                    time_slot_list=[5, 10], processes=2)
+    assert [row['time_slot'] for row in summary_list] == ['none', 5, 10]
+    assert all(row['status'] == 'done' for row in summary_list)
+
+    resumed_list = hawkes_grid_eval(save_file_path, 'reconstructed.xml', save_file_path, diagnosis_list=[4],
+                                    procedure_list=[2], iteration_list=[2], kernel_list=['exp', 'Fourier'],
+                                    time_slot_list=[5, 10], processes=2)
+    assert all(row['status'] == 'skipped' for row in resumed_list)
+    for row, resumed in zip(summary_list, resumed_list):
+        np.testing.assert_allclose(resumed['train_log_likelihood'], row['train_log_likelihood'])
+        np.testing.assert_allclose(resumed['test_log_likelihood'], row['test_log_likelihood'])
+
+    with open(os.path.join(save_file_path, 'hawkes_grid_summary.csv'), 'r', encoding='utf-8-sig') as f:
+        assert len(list(csv.DictReader(f))) == 3
+
+    # an empty grid still writes the header of the summary table
+    assert hawkes_grid_eval(save_file_path, 'reconstructed.xml', save_file_path, diagnosis_list=[4], procedure_list=[2],
+                            iteration_list=[], kernel_list=['exp'], time_slot_list=[], summary_name='empty.csv') == []
+    with open(os.path.join(save_file_path, 'empty.csv'), 'r', encoding='utf-8-sig') as f:
+        assert f.read().strip() == ','.join(GRID_SUMMARY_FIELD_LIST)
+
+
+def test_npz_result_converts_to_same_csv(tmp_path):
+    file_path = str(tmp_path / 'reconstructed.xml')
+    write_reconstructed_xml(file_path, 40)
+    event_sequence_map, _ = dtd.derive_hawkes_data(file_path, 4, 2)
+    patient_list = list(event_sequence_map.keys())
+    train_data = {j: event_sequence_map[j] for j in patient_list[8:]}
+    test_data = {j: event_sequence_map[j] for j in patient_list[0: 8]}
+    np.random.seed(0)
+    return_data_map = hawkes_optimization(train_data, test_data, 2, 4, 2, 'Fourier', 10)
+
+    result_path = save_result_npz(return_data_map, str(tmp_path), 'run_', {'diagnosis': 4, 'time_slot': 10})
+    result = load_result(result_path)
+    assert result['kernel'] == 'Fourier' and result['meta_time_slot'] == 10
+    np.testing.assert_array_equal(result['mutual_intensity'], return_data_map['mutual_intensity'])
+    np.testing.assert_array_equal(result['k_omega'], return_data_map['k_omega'])
+    # the auxiliary variable is not saved and is only read from the model on access
+    assert 'auxiliary_variable' not in return_data_map and 'auxiliary_variable' not in result
+    assert len(return_data_map['auxiliary_variable']) == len(train_data)
+
+    os.mkdir(str(tmp_path / 'direct'))
+    os.mkdir(str(tmp_path / 'converted'))
+    save_result(return_data_map, str(tmp_path / 'direct'), 'run_')
+    convert_result_to_csv(result_path, str(tmp_path / 'converted'), 'run_')
+    file_list = sorted(os.listdir(str(tmp_path / 'direct')))
+    assert file_list == sorted(os.listdir(str(tmp_path / 'converted')))
+    for file_name in file_list:
+        with open(str(tmp_path / 'direct' / file_name), 'r', encoding='utf-8-sig') as f:
+            direct = f.read()
+        with open(str(tmp_path / 'converted' / file_name), 'r', encoding='utf-8-sig') as f:
+            assert f.read() == direct
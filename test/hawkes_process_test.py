@@ -0,0 +1,444 @@
+# coding=utf-8
+import numpy as np
+import pytest
+
+from hawkes.hawkes_process import Hawkes
+from hawkes.packed_sequence import PackedSequence
+from hawkes.sharded_em import ShardedEM
+from hawkes.sparse_intensity import SparseMutualIntensity
+
+
+def generate_sequence_map(sequence_count, event_count, max_length=12, max_interval=30, seed=0):
+    random_state = np.random.RandomState(seed)
+    sequence_map = dict()
+    for j in range(0, sequence_count):
+        length = random_state.randint(1, max_length + 1)
+        event_time = np.cumsum(random_state.randint(0, max_interval, length))
+        event_index = random_state.randint(0, event_count, length)
+        sequence_map[str(j)] = [(int(event_index[i]), int(event_time[i])) for i in range(0, length)]
+    return sequence_map
+
+
+def build_model(kernel='exp', time_slot=None, event_count=4, precision='float64'):
+    np.random.seed(1)
+    training_data = generate_sequence_map(40, event_count, seed=2)
+    test_data = generate_sequence_map(10, event_count, seed=3)
+    hawkes = Hawkes(training_data=training_data, test_data=test_data, event_count=event_count, kernel=kernel,
+                    init_strategy='default', time_slot=time_slot, max_day=1000, precision=precision)
+    hawkes.update_discrete_time_decay_function()
+    hawkes.update_discrete_integral_function()
+    return hawkes
+
+
+def loop_auxiliary_variable(hawkes):
+    """
+    the original per event implementation of eq. 9, 10
+    """
+    auxiliary_map = {}
+    for j in hawkes.training_data:
+        event_list = hawkes.training_data[j]
+        auxiliary_map[j] = {}
+        for i in range(0, len(event_list)):
+            i_event_index, i_event_time = event_list[i]
+            excite = []
+            for l in range(0, i):
+                l_event_index, l_event_time = event_list[l]
+                alpha = hawkes.mutual_intensity[i_event_index][l_event_index]
+                excite.append(alpha * hawkes.discrete_time_decay[i_event_time - l_event_time])
+            base = hawkes.base_intensity[i_event_index][0]
+            denominator = base + sum(excite)
+            auxiliary_map[j][i] = [item / denominator for item in excite] + [base / denominator]
+    return auxiliary_map
+
+
+def test_expectation_step_matches_loop_implementation():
+    for kernel, time_slot in [('exp', None), ('Fourier', 10)]:
+        hawkes = build_model(kernel, time_slot)
+        expected = loop_auxiliary_variable(hawkes)
+        hawkes.expectation_step()
+        for j in expected:
+            for i in expected[j]:
+                np.testing.assert_allclose(hawkes.auxiliary_variable[j][i], expected[j][i], rtol=1e-10)
+
+
+def test_auxiliary_variable_store_is_read_only_mapping():
+    hawkes = build_model()
+    for j in hawkes.training_data:
+        assert len(hawkes.auxiliary_variable[j]) == len(hawkes.training_data[j])
+        for i in hawkes.auxiliary_variable[j]:
+            np.testing.assert_allclose(hawkes.auxiliary_variable[j][i], [1 / (i + 1)] * (i + 1))
+    first = next(iter(hawkes.auxiliary_variable))
+    with pytest.raises(ValueError):
+        hawkes.auxiliary_variable[first][0][0] = 1
+
+
+def loop_maximization_statistic(hawkes):
+    """
+    the original per event implementation of the nominator and denominator of the M step
+    """
+    event_count = hawkes.event_count
+    alpha_nominator = np.zeros([event_count, event_count])
+    alpha_denominator = np.zeros([event_count, event_count])
+    mu_nominator = np.zeros([event_count, 1])
+    mu_denominator = 0
+    for j in hawkes.training_data:
+        event_list = hawkes.training_data[j]
+        last_event_time = event_list[-1][1] + 1
+        for i in range(0, len(event_list)):
+            for k in range(0, i):
+                alpha_nominator[event_list[i][0]][event_list[k][0]] += hawkes.auxiliary_variable[j][i][k]
+            mu_nominator[event_list[i][0]][0] += hawkes.auxiliary_variable[j][i][i]
+        for l in range(0, event_count):
+            for k in range(0, len(event_list)):
+                alpha_denominator[l][event_list[k][0]] += \
+                    hawkes.discrete_time_integral[last_event_time - event_list[k][1]]
+        mu_denominator += event_list[-1][1] - event_list[0][1]
+    return alpha_nominator, alpha_denominator, mu_nominator, mu_denominator
+
+
+def test_maximization_step_matches_loop_implementation():
+    for kernel, time_slot in [('exp', None), ('Fourier', 10)]:
+        hawkes = build_model(kernel, time_slot)
+        hawkes.expectation_step()
+        alpha_nominator, alpha_denominator, mu_nominator, mu_denominator = loop_maximization_statistic(hawkes)
+        hawkes.maximization_step()
+        np.testing.assert_allclose(hawkes.alpha_nominator_matrix, alpha_nominator, rtol=1e-10)
+        np.testing.assert_allclose(hawkes.alpha_denominator_matrix, alpha_denominator, rtol=1e-10)
+        np.testing.assert_allclose(hawkes.mu_nominator_vector, mu_nominator, rtol=1e-10)
+        assert hawkes.mu_denominator_vector == mu_denominator
+
+
+def test_discrete_table_matches_kernel_function():
+    for kernel, time_slot in [('exp', None), ('Fourier', 10), ('Fourier', 7)]:
+        hawkes = build_model(kernel, time_slot)
+        decay = [hawkes.kernel_calculate(0, i) for i in range(0, hawkes.max_day)]
+        integral = [hawkes.kernel_integral(lower_bound=0, upper_bound=i) for i in range(0, hawkes.max_day)]
+        np.testing.assert_allclose(hawkes.discrete_time_decay, decay, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(hawkes.discrete_time_integral, integral, rtol=1e-8, atol=1e-10)
+
+
+def test_spectral_cache_matches_loop_implementation():
+    hawkes = build_model('Fourier', 10)
+    omega = 2 * np.pi * np.arange(0, hawkes.time_slot) / hawkes.time_slot
+    y_omega = np.zeros([hawkes.time_slot, 1], dtype=np.complex128)
+    for k in range(0, hawkes.time_slot):
+        for i in range(0, hawkes.time_slot):
+            y_omega[k][0] += np.exp(-1 * omega[k] * i * complex(0, 1)) * hawkes.count_of_each_slot[i][0]
+    k_omega_cache = np.zeros([hawkes.event_count, hawkes.time_slot], dtype=np.complex128)
+    for j in hawkes.training_data:
+        for event_index, event_time in hawkes.training_data[j]:
+            k_omega_cache[event_index] += np.exp(-1 * complex(0, 1) * omega * event_time)
+
+    assert hawkes.y_omega.shape == (hawkes.time_slot, 1)
+    assert hawkes.k_omega_cache.shape == (hawkes.event_count, hawkes.time_slot)
+    np.testing.assert_allclose(hawkes.y_omega, y_omega, atol=1e-8)
+    np.testing.assert_allclose(hawkes.k_omega_cache, k_omega_cache, atol=1e-3)
+
+
+def test_log_likelihood_matches_loop_implementation():
+    for kernel, time_slot in [('exp', None), ('Fourier', 10)]:
+        hawkes = build_model(kernel, time_slot)
+        for data_source in [hawkes.training_data, hawkes.test_data]:
+            expected = 0
+            for j in data_source:
+                for i in range(0, len(data_source[j])):
+                    expected += hawkes.part_one_calculate(j=j, i=i, data_source=data_source)
+                for u in range(0, hawkes.event_count):
+                    expected -= hawkes.part_two_calculate(j=j, u=u, data_source=data_source)
+            np.testing.assert_allclose(hawkes.log_likelihood_calculate(data_source), expected, rtol=1e-10)
+
+
+def test_sharded_optimization_is_deterministic():
+    result = []
+    for processes in [1, 2, 3]:
+        hawkes = build_model()
+        hawkes.optimization(2, processes=processes, chunk_size=7)
+        result.append(hawkes)
+    for hawkes in result[1:]:
+        np.testing.assert_allclose(hawkes.mutual_intensity, result[0].mutual_intensity, rtol=1e-12)
+        np.testing.assert_allclose(hawkes.base_intensity, result[0].base_intensity, rtol=1e-12)
+        np.testing.assert_allclose(hawkes.auxiliary_variable.buffer, result[0].auxiliary_variable.buffer, rtol=1e-12)
+    assert np.array_equal(result[1].mutual_intensity, result[2].mutual_intensity)
+
+
+def test_sharded_worker_error_is_raised_in_parent():
+    training_data = generate_sequence_map(20, 4, seed=2)
+    # the time decay table is shorter than the event intervals, the E step of the workers raises IndexError
+    sharded_em = ShardedEM(training_data, 4, 10, processes=2, chunk_size=5)
+    with pytest.raises(RuntimeError, match='IndexError'):
+        sharded_em.step(np.ones([4, 1]), np.ones([4, 4]), np.ones([10]), np.ones([10]))
+    sharded_em.close()
+    assert sharded_em.process_list == []
+
+
+def test_truncated_window_matches_full_sum():
+    full = build_model()
+    np.random.seed(1)
+    truncated = Hawkes(training_data=full.training_data, test_data=full.test_data, event_count=full.event_count,
+                       kernel='exp', init_strategy='default', time_slot=None, max_day=1000, truncation=1e-12)
+    truncated.update_discrete_time_decay_function()
+    truncated.update_discrete_integral_function()
+    assert truncated.truncation_width < full.max_day
+
+    full.expectation_step()
+    truncated.expectation_step()
+    np.testing.assert_allclose(truncated.auxiliary_variable.buffer, full.auxiliary_variable.buffer, atol=1e-10)
+    full.maximization_step()
+    truncated.maximization_step()
+    np.testing.assert_allclose(truncated.mutual_intensity, full.mutual_intensity, rtol=1e-8)
+    np.testing.assert_allclose(truncated.log_likelihood_calculate(truncated.test_data),
+                               full.log_likelihood_calculate(full.test_data), rtol=1e-8)
+
+    # without truncation effect, the window covers every earlier event
+    packed = full.packed_training_data
+    later, earlier = packed.window_pair(full.max_day)
+    assert len(later) == int((packed.length * (packed.length - 1) // 2).sum())
+
+
+def test_exp_recursion_matches_table_lookup():
+    recursive = build_model()
+    np.random.seed(1)
+    table = Hawkes(training_data=recursive.training_data, test_data=recursive.test_data,
+                   event_count=recursive.event_count, kernel='exp', init_strategy='default', time_slot=None,
+                   max_day=1000, exp_recursion=False)
+    assert recursive.exp_recursion and not table.exp_recursion
+    recursive.optimization(3)
+    table.optimization(3)
+    np.testing.assert_allclose(recursive.train_log_likelihood_tendency, table.train_log_likelihood_tendency,
+                               rtol=1e-10)
+    np.testing.assert_allclose(recursive.test_log_likelihood_tendency, table.test_log_likelihood_tendency,
+                               rtol=1e-10)
+    np.testing.assert_allclose(recursive.mutual_intensity, table.mutual_intensity, rtol=1e-10)
+    np.testing.assert_allclose(recursive.base_intensity, table.base_intensity, rtol=1e-10)
+    np.testing.assert_allclose(recursive.auxiliary_variable.buffer, table.auxiliary_variable.buffer, rtol=1e-10)
+
+
+def test_early_stopping():
+    hawkes = build_model()
+    hawkes.optimization(100, tolerance=1e-3)
+    assert hawkes.iteration_count < 100
+    assert len(hawkes.train_log_likelihood_tendency) == hawkes.iteration_count + 1
+
+
+def test_checkpoint_resume_matches_uninterrupted_run(tmp_path):
+    for kernel, time_slot in [('exp', None), ('Fourier', 10)]:
+        checkpoint_path = str(tmp_path / (kernel + '_checkpoint.npz'))
+        uninterrupted = build_model(kernel, time_slot)
+        uninterrupted.optimization(4)
+
+        interrupted = build_model(kernel, time_slot)
+        interrupted.optimization(2, checkpoint_path=checkpoint_path)
+        resumed = build_model(kernel, time_slot)
+        np.random.seed(5)
+        resumed.base_intensity = resumed.initialize_base_intensity()
+        resumed.resume(checkpoint_path)
+        assert resumed.iteration_count == 2 and resumed.em_map_count == interrupted.em_map_count
+        resumed.optimization(4)
+        assert resumed.em_map_count == uninterrupted.em_map_count
+
+        np.testing.assert_allclose(resumed.mutual_intensity, uninterrupted.mutual_intensity, rtol=1e-10)
+        np.testing.assert_allclose(resumed.base_intensity, uninterrupted.base_intensity, rtol=1e-10)
+        np.testing.assert_allclose(resumed.train_log_likelihood_tendency,
+                                   uninterrupted.train_log_likelihood_tendency, rtol=1e-10)
+
+
+def test_squarem_reaches_em_fixed_point_with_fewer_updates():
+    plain = build_model()
+    plain.optimization(5000, parameter_tolerance=1e-8)
+    accelerated = build_model()
+    accelerated.optimization(5000, parameter_tolerance=1e-8, acceleration='squarem')
+    assert accelerated.em_map_count < plain.em_map_count
+    np.testing.assert_allclose(accelerated.mutual_intensity, plain.mutual_intensity, rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(accelerated.train_log_likelihood_tendency[-1], plain.train_log_likelihood_tendency[-1],
+                               rtol=1e-6)
+
+
+def test_squarem_fallback_restores_plain_em_state():
+    for exp_recursion in [True, False]:
+        plain = build_model('Fourier', 10)
+        rejected = build_model('Fourier', 10)
+        plain.exp_recursion = rejected.exp_recursion = exp_recursion
+        plain.optimization(0)
+        rejected.optimization(0)
+        plain.em_map()
+        plain.em_map()
+        # an infinite negative tolerance rejects every extrapolation
+        rejected.squarem_step(tolerance=-np.inf)
+        np.testing.assert_allclose(rejected.base_intensity, plain.base_intensity, rtol=1e-12)
+        np.testing.assert_allclose(rejected.mutual_intensity, plain.mutual_intensity, rtol=1e-12)
+        np.testing.assert_allclose(rejected.k_omega, plain.k_omega, rtol=1e-6)
+        np.testing.assert_allclose(rejected.discrete_time_decay, plain.discrete_time_decay, rtol=1e-12)
+        np.testing.assert_allclose(rejected.discrete_time_integral, plain.discrete_time_integral, rtol=1e-12)
+        np.testing.assert_allclose(rejected.auxiliary_variable.buffer, plain.auxiliary_variable.buffer, rtol=1e-12)
+        np.testing.assert_allclose(rejected.log_likelihood_calculate(rejected.training_data),
+                                   plain.log_likelihood_calculate(plain.training_data), rtol=1e-12)
+
+
+def test_sparse_mutual_intensity_matches_dense():
+    # events of a sequence come from one of 5 disjoint groups, thus most type pairs never co-occur
+    event_count = 20
+    training_data = generate_sequence_map(40, 4, seed=2)
+    test_data = generate_sequence_map(10, 4, seed=3)
+    for data_source in [training_data, test_data]:
+        for j in data_source:
+            group = int(j) % 5 * 4
+            data_source[j] = [(event_index + group, event_time) for event_index, event_time in data_source[j]]
+
+    np.random.seed(1)
+    dense = Hawkes(training_data=training_data, test_data=test_data, event_count=event_count, kernel='exp',
+                   init_strategy='default', time_slot=None, max_day=1000, exp_recursion=False)
+    sparse = Hawkes(training_data=training_data, test_data=test_data, event_count=event_count, kernel='exp',
+                    init_strategy='default', time_slot=None, max_day=1000, sparse=True)
+    pair_set = set()
+    for event_list in training_data.values():
+        for i in range(0, len(event_list)):
+            for _l in range(0, i):
+                pair_set.add((event_list[i][0], event_list[_l][0]))
+    structure = sparse.sparse_structure
+    assert set(zip(structure.row.tolist(), structure.indices.tolist())) == pair_set
+    assert structure.nnz < event_count * event_count // 4
+
+    sparse.base_intensity = dense.base_intensity.copy()
+    sparse.mutual_intensity = structure.from_dense(dense.mutual_intensity)
+    dense.optimization(3)
+    sparse.optimization(3)
+    np.testing.assert_allclose(sparse.mutual_intensity_dense(), dense.mutual_intensity, rtol=1e-10)
+    np.testing.assert_allclose(sparse.base_intensity, dense.base_intensity, rtol=1e-10)
+    # the initial likelihood differs as dense alpha of the pairs which never co-occur is not 0 before the M step
+    np.testing.assert_allclose(sparse.train_log_likelihood_tendency[1:], dense.train_log_likelihood_tendency[1:],
+                               rtol=1e-10)
+    np.testing.assert_allclose(sparse.test_log_likelihood_tendency[1:], dense.test_log_likelihood_tendency[1:],
+                               rtol=1e-10)
+
+
+def test_stochastic_optimization():
+    # the first step with a full batch is exactly one EM iteration
+    full = build_model()
+    full.optimization(1)
+    stochastic = build_model()
+    stochastic.stochastic_optimization(1, batch_size=len(stochastic.training_data))
+    np.testing.assert_allclose(stochastic.mutual_intensity, full.mutual_intensity, rtol=1e-10)
+    np.testing.assert_allclose(stochastic.base_intensity, full.base_intensity, rtol=1e-10)
+
+    for exp_recursion in [True, False]:
+        full = build_model()
+        full.optimization(50)
+        stochastic = build_model()
+        stochastic.exp_recursion = exp_recursion
+        stochastic.stochastic_optimization(200, batch_size=8, evaluation_interval=50)
+        assert len(stochastic.train_log_likelihood_tendency) == 5
+        # the mini-batch auxiliary variables are not kept
+        assert stochastic._Hawkes__auxiliary_variable is None
+        np.testing.assert_allclose(stochastic.train_log_likelihood_tendency[-1], full.train_log_likelihood_tendency[-1],
+                                   rtol=1e-3)
+
+
+def test_data_only_statistic_is_cached_and_invalidated():
+    hawkes = build_model('Fourier', 10)
+    packed = hawkes.packed_training_data
+    assert packed.lag_bucket() is packed.lag_bucket()
+    # above the cache limit the lag matrices are gathered again on every call and equal the cached ones
+    uncached = list(PackedSequence(hawkes.training_data).lag_bucket(cache_limit=0))
+    assert len(uncached) == len(packed.lag_bucket())
+    for (positions, index_matrix, lag), cached in zip(uncached, packed.lag_bucket()):
+        np.testing.assert_array_equal(lag, cached[2])
+    assert all(lag.dtype == np.int32 for _, _, lag in packed.lag_bucket())
+    assert packed.integral_lag.dtype == np.int32
+    span_sum = sum(event_list[-1][1] - event_list[0][1] for event_list in hawkes.training_data.values())
+    assert packed.span_sum == span_sum
+
+    training_data = generate_sequence_map(30, 4, seed=7)
+    np.random.seed(1)
+    fresh = Hawkes(training_data=training_data, test_data=hawkes.test_data, event_count=4, kernel='Fourier',
+                   init_strategy='default', time_slot=10, max_day=1000)
+    hawkes.training_data = training_data
+    assert hawkes.packed_training_data is not packed
+    hawkes.optimization(2)
+    fresh.optimization(2)
+    np.testing.assert_allclose(hawkes.mutual_intensity, fresh.mutual_intensity, rtol=1e-10)
+    np.testing.assert_allclose(hawkes.train_log_likelihood_tendency, fresh.train_log_likelihood_tendency, rtol=1e-10)
+
+
+def test_conditional_intensity_matches_loop_implementation():
+    hawkes = build_model()
+    hawkes.optimization(2)
+    history_list = [event_list[0: len(event_list) // 2 + 1] for event_list in hawkes.test_data.values()]
+    history_list.append([])
+    query_time = [max([0] + [event[1] for event in history]) + 3 for history in history_list]
+
+    expected = np.zeros([len(history_list), hawkes.event_count])
+    for b, history in enumerate(history_list):
+        for u in range(0, hawkes.event_count):
+            expected[b, u] = hawkes.base_intensity[u][0]
+            for event_index, event_time in history:
+                expected[b, u] += hawkes.mutual_intensity[u][event_index] * \
+                    hawkes.discrete_time_decay[query_time[b] - event_time]
+    np.testing.assert_allclose(hawkes.conditional_intensity(history_list, query_time), expected, rtol=1e-12)
+
+    grid = hawkes.conditional_intensity_grid(history_list, [0, 3, 10])
+    assert grid.shape == (3, len(history_list), hawkes.event_count)
+    np.testing.assert_allclose(grid[1, :-1], expected[:-1], rtol=1e-12)
+    np.testing.assert_allclose(grid[:, -1], np.repeat(hawkes.base_intensity.T, 3, axis=0), rtol=1e-12)
+
+    sparse = build_model()
+    sparse.sparse_structure = SparseMutualIntensity(np.arange(hawkes.event_count ** 2), hawkes.event_count)
+    sparse.mutual_intensity = sparse.sparse_structure.from_dense(hawkes.mutual_intensity)
+    sparse.base_intensity = hawkes.base_intensity
+    np.testing.assert_allclose(sparse.conditional_intensity(history_list, query_time), expected, rtol=1e-12)
+
+
+def test_multi_start_keeps_best_start():
+    for kernel, time_slot in [('exp', None), ('Fourier', 10)]:
+        serial = build_model(kernel, time_slot)
+        trace_map = serial.multi_start_optimization(4, 5, prune_iteration=2, keep_count=2, seed=3)
+        assert sum(trace['pruned'] for trace in trace_map.values()) == 2
+        for trace in trace_map.values():
+            assert len(trace['train_log_likelihood_tendency']) == (3 if trace['pruned'] else 6)
+        final = {k: trace_map[k]['train_log_likelihood_tendency'][-1] for k in trace_map if not trace_map[k]['pruned']}
+        assert serial.best_start == max(final, key=final.get)
+        assert serial.train_log_likelihood_tendency == trace_map[serial.best_start]['train_log_likelihood_tendency']
+
+        # the start of a fresh model with the seed of the best start reaches the same parameters
+        single = build_model(kernel, time_slot)
+        global_state = np.random.get_state()
+        single.restore_optimization_state(single.random_start_state(3 + serial.best_start))
+        assert np.array_equal(np.random.get_state()[1], global_state[1])
+        single.optimization(5)
+        np.testing.assert_allclose(single.mutual_intensity, serial.mutual_intensity, rtol=1e-10)
+
+        parallel = build_model(kernel, time_slot)
+        parallel_trace_map = parallel.multi_start_optimization(4, 5, prune_iteration=2, keep_count=2, processes=2,
+                                                               seed=3)
+        assert parallel.best_start == serial.best_start
+        for k in trace_map:
+            np.testing.assert_allclose(parallel_trace_map[k]['train_log_likelihood_tendency'],
+                                       trace_map[k]['train_log_likelihood_tendency'], rtol=1e-12)
+        np.testing.assert_allclose(parallel.mutual_intensity, serial.mutual_intensity, rtol=1e-12)
+
+
+def test_float32_precision_matches_float64():
+    for kernel, time_slot, exp_recursion in [('exp', None, True), ('exp', None, False), ('Fourier', 10, False)]:
+        reference = build_model(kernel, time_slot)
+        single = build_model(kernel, time_slot, precision='float32')
+        reference.exp_recursion = single.exp_recursion = exp_recursion
+        reference.optimization(5)
+        single.optimization(5)
+
+        assert single.base_intensity.dtype == np.float32 and single.mutual_intensity.dtype == np.float32
+        assert single.discrete_time_decay.dtype == np.float32
+        assert single.discrete_time_integral.dtype == np.float32
+        if not exp_recursion:
+            assert single.auxiliary_variable.buffer.dtype == np.float32
+        if kernel == 'Fourier':
+            assert single.y_omega.dtype == np.complex64
+        for tendency in ['train_log_likelihood_tendency', 'test_log_likelihood_tendency']:
+            np.testing.assert_allclose(getattr(single, tendency), getattr(reference, tendency), rtol=1e-5)
+        np.testing.assert_allclose(single.mutual_intensity, reference.mutual_intensity, rtol=1e-3, atol=1e-6)
+
+    sparse = Hawkes(training_data=generate_sequence_map(40, 4, seed=2), test_data=generate_sequence_map(10, 4, seed=3),
+                    event_count=4, kernel='exp', init_strategy='default', time_slot=None, max_day=1000, sparse=True,
+                    precision='float32')
+    sparse.training_data = generate_sequence_map(30, 4, seed=4)
+    assert sparse.mutual_intensity.data.dtype == np.float32
+    sparse.optimization(2)
+    assert sparse.mutual_intensity.data.dtype == np.float32